@@ -0,0 +1,111 @@
+"""
+answer_cache.py  –  In-memory answer cache for rag_inference
+------------------------------------------------------------------
+Two lookups, both scoped to a domain:
+  • exact     – normalised query text (case, whitespace, trailing ?!.)
+  • semantic  – cosine similarity of query embeddings ≥ `threshold`
+                (optional: a paraphrase may still ask something else)
+Entries expire after `ttl` seconds, the cache holds at most `max_entries`
+(least recently used evicted first), and every entry remembers the index
+version it was answered from – a re-indexed collection never serves stale
+answers.
+Source cards are copied on put and get, so callers never share them.
+"""
+
+from __future__ import annotations
+import re, time, threading
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+_WS = re.compile(r"\s+")
+
+
+def normalise_query(query: str) -> str:
+    return _WS.sub(" ", query.strip().lower()).rstrip(" ?!.")
+
+
+@dataclass
+class CachedAnswer:
+    answer : str
+    sources: list
+    version: str
+    expires: float
+    emb    : Optional[np.ndarray] = None      # unit-length query embedding
+
+
+class AnswerCache:
+    def __init__(self, max_entries: int = 512, ttl: float = 3600.0,
+                 threshold: Optional[float] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold or None     # None/0 → exact matches only
+        self._entries: "OrderedDict[Tuple[str, str], CachedAnswer]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def semantic(self) -> bool:
+        return self.threshold is not None
+
+    def get(self, domain: str, query: str, version: str,
+            query_emb: Optional[Sequence[float]] = None) -> Tuple[Optional[CachedAnswer], Optional[str]]:
+        """Return (entry, "exact" | "semantic") or (None, None)."""
+        key = (domain, normalise_query(query))
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry.version == version and entry.expires > now:
+                    self._entries.move_to_end(key)
+                    return _copy(entry), "exact"
+                del self._entries[key]
+
+            if query_emb is None or not self.semantic:
+                return None, None
+            q = _unit(query_emb)
+            best, best_key = self.threshold, None
+            for k, e in list(self._entries.items()):
+                if e.version != version or e.expires <= now:
+                    del self._entries[k]
+                    continue
+                if k[0] != domain or e.emb is None:
+                    continue
+                sim = float(np.dot(q, e.emb))
+                if sim >= best:
+                    best, best_key = sim, k
+            if best_key is None:
+                return None, None
+            self._entries.move_to_end(best_key)
+            return _copy(self._entries[best_key]), "semantic"
+
+    def put(self, domain: str, query: str, version: str, answer: str,
+            sources: list, query_emb: Optional[Sequence[float]] = None) -> None:
+        key = (domain, normalise_query(query))
+        entry = CachedAnswer(answer, _cards(sources), version, time.time() + self.ttl,
+                             _unit(query_emb) if query_emb is not None else None)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def _cards(sources: list) -> list:
+    return [dict(card) for card in sources]
+
+def _copy(entry: CachedAnswer) -> CachedAnswer:
+    return replace(entry, sources=_cards(entry.sources))
+
+def _unit(v: Sequence[float]) -> np.ndarray:
+    v = np.asarray(v, dtype=np.float32)
+    n = float(np.linalg.norm(v))
+    return v / n if n else v
@@ -1,30 +1,141 @@
-from flask import Flask, render_template, request, jsonify
-from rag import rag_inference, DB_CFG
+import os, json, time, threading
+from flask import Flask, Response, render_template, request, jsonify, stream_with_context
+from rag import (rag_inference, rag_inference_stream, warm_up, readiness, is_ready,
+                 is_valid_domain, index_dir, LLMOverloadedError, LLM, DB_CFG)
+from stage_timing import STATS_NAME
+import metrics
 
 app = Flask(__name__, static_url_path='/static')
 
+WARMUP_RETRY_S = float(os.getenv("RAG_WARMUP_RETRY", 5))   # seconds between warm-up attempts
+_WARMUP_LOCK = threading.Lock()
+_warmup_thread = None
+
+def _warm_up_until_ready():
+    """Warm up every domain, then retry only those still starting or disabled."""
+    warm_up()
+    while not is_ready():
+        time.sleep(WARMUP_RETRY_S)
+        warm_up()
+
+def start_warm_up():
+    """Load models and open collections in the background (retried until /readyz is 200)."""
+    global _warmup_thread
+    with _WARMUP_LOCK:
+        if _warmup_thread is None or not _warmup_thread.is_alive():
+            _warmup_thread = threading.Thread(target=_warm_up_until_ready, daemon=True,
+                                              name="warm-up")
+            _warmup_thread.start()
+
+# Opt-in: warm up at start-up instead of on the first probe of /readyz (RAG_WARMUP=1)
+if os.getenv("RAG_WARMUP", "0") == "1":
+    start_warm_up()
+
 @app.route('/')
 def home():
     return render_template('index.html')
 
-@app.route('/search', methods=['POST'])
-def search():
-    data   = request.get_json()
+def _parse_search_request():
+    """Return (query, domain, error_response)."""
+    data   = request.get_json(silent=True) or {}
     query  = data.get('query', '').strip()
     domain = data.get('domain', 'sop')
 
     if not query:
-        return jsonify({"error": "Empty query."}), 400
-    if domain not in DB_CFG:
-        return jsonify({"error": f"Unknown domain '{domain}'."}), 400
-
-    try:
-        answer, sources = rag_inference(domain, query)
-        return jsonify({"answer": answer, "sources": sources})
-    except Exception as e:
-        # Log the error for server-side debugging
-        app.logger.exception("Search processing failed")
-        return jsonify({"error": str(e)}), 500
+        return query, domain, (jsonify({"error": "Empty query."}), 400)
+    if not is_valid_domain(domain):
+        return query, domain, (jsonify({"error": f"Unknown domain '{domain}'."}), 400)
+    return query, domain, None
+
+@app.route('/search', methods=['POST'])
+def search():
+    query, domain, error = _parse_search_request()
+    if error:
+        return error
+
+    t0 = time.perf_counter()
+    info, failure = None, None
+    with metrics.IN_FLIGHT.track(endpoint="/search"):
+        try:
+            answer, sources, info = rag_inference(domain, query)
+            if answer.startswith("[LLM error]"):    # still a 200 – count it anyway
+                metrics.ERRORS.inc(endpoint="/search", domain=domain, error="LLMError")
+            timings = {**info["timings"], "total": time.perf_counter() - t0}
+            response = (jsonify({"answer": answer, "sources": sources,
+                                 "cached": info["cached"], "timings": info["timings"]}),
+                        200, {"Server-Timing": metrics.server_timing(timings)})
+        except LLMOverloadedError as e:
+            failure = e
+            response = jsonify({"error": str(e)}), 503, {"Retry-After": "5"}
+        except Exception as e:
+            # Log the error for server-side debugging
+            app.logger.exception("Search processing failed")
+            failure = e
+            response = jsonify({"error": str(e)}), 500
+    metrics.record_search("/search", domain, response[1], time.perf_counter() - t0,
+                          info, failure)
+    return response
+
+@app.route('/search/stream', methods=['POST'])
+def search_stream():
+    """Same request as /search; responds with NDJSON events (see rag_inference_stream)."""
+    query, domain, error = _parse_search_request()
+    if error:
+        return error
+
+    # headers go out before any stage has run, so timings travel in the
+    # "sources" / "done" events instead of a Server-Timing header
+    def generate():
+        t0 = time.perf_counter()
+        info, failure = {"cached": None, "timings": {}}, None
+        with metrics.IN_FLIGHT.track(endpoint="/search/stream"):
+            try:
+                for event in rag_inference_stream(domain, query):
+                    if event["type"] == "sources":
+                        info["cached"] = event.get("cached")
+                    elif event["type"] == "done":
+                        info["timings"] = event.get("timings", {})
+                    yield json.dumps(event) + "\n"
+            except Exception as e:
+                app.logger.exception("Streaming search failed")
+                failure = e
+                yield json.dumps({"type": "error", "error": str(e)}) + "\n"
+            finally:
+                status = 200 if failure is None else \
+                    503 if isinstance(failure, LLMOverloadedError) else 500
+                metrics.record_search("/search/stream", domain, status,
+                                      time.perf_counter() - t0, info, failure)
+
+    return Response(stream_with_context(generate()),
+                    mimetype='application/x-ndjson',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/healthz')
+def healthz():
+    """Liveness: the process is up and serving HTTP."""
+    return jsonify({"status": "ok", "pid": os.getpid()})
+
+@app.route('/readyz')
+def readyz():
+    """
+    Readiness: 200 once every domain with an index has its model and
+    collection loaded, else 503.  Domains without an index are "disabled";
+    each probe re-checks them, so a newly built one is picked up.
+    """
+    domains = readiness()
+    ready = is_ready(domains)
+    if not ready or "disabled" in domains.values():
+        start_warm_up()
+    return jsonify({"ready": ready, "domains": domains}), 200 if ready else 503
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus text format: request/stage latency, errors, cache, LLM queue, indexer runs."""
+    for state, value in LLM.stats().items():
+        metrics.LLM_STATE.set(value, state=state)
+    for domain in DB_CFG:
+        metrics.load_index_stats(domain, index_dir(domain) / STATS_NAME)
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
 
 if __name__ == '__main__':
-    app.run(debug=False)
\ No newline at end of file
+    app.run(debug=False)
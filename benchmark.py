@@ -0,0 +1,461 @@
+"""
+benchmark.py  –  Offline performance benchmarks
+------------------------------------------------------------------
+Runs entirely on this machine, without Ollama or real documents:
+
+1. generates a synthetic SOP corpus (front-matter .txt files) and a
+   synthetic support-article export (one JSON array) of configurable size
+2. times index_sop.main / index_json.main – full build and no-op re-run
+3. times search_similar_chunks and rag_inference per query (p50/p95/p99)
+   against a stub LLM server (stub_llm.py) with configurable latency, and
+   the mean size of the packed prompt context in tokens
+4. load-tests POST /search on the real Flask app with N concurrent clients
+5. compares the vector backends (Chroma vs the int8 / float16 matrix export,
+   vector_store.py) per domain – query latency, recall@k against an exact
+   float32 search and the memory a worker adds – optionally also on
+   --vectors N synthetic vectors, for corpus sizes not worth indexing
+
+Results are written as JSON (--out); --compare OLD.json reports the change
+of every tracked metric and exits with status 1 if one regressed by more
+than --tolerance.
+
+    python benchmark.py --sops 500 --articles 2000 --queries 200 --out bench.json
+    python benchmark.py --out new.json --compare bench.json
+    python benchmark.py --skip rag load --vectors 100000       # backends at scale
+"""
+
+from __future__ import annotations
+import os, sys, json, time, random, shutil, argparse, platform, tempfile, subprocess
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import numpy as np
+
+VOCAB = ("patient appointment schedule reschedule insurance claim billing ledger "
+         "refund payment copay deductible x-ray radiograph sterilize autoclave "
+         "hygiene cleaning consent form hipaa privacy password reset printer "
+         "scanner chart note treatment plan crown filling extraction referral "
+         "eligibility verification front desk check-in check-out recall reminder "
+         "lab case impression prescription allergy medical history emergency").split()
+DEPARTMENTS = ("Front Desk", "Billing", "Clinical", "IT", "Compliance")
+
+# metric path → True if higher is better (used by --compare)
+TRACKED = {
+    "indexing.sop.chunks_per_s"     : True,
+    "indexing.json.items_per_s"     : True,
+    "indexing.sop.noop_s"           : False,
+    "search.sop.p95_ms"             : False,
+    "search.support.p95_ms"         : False,
+    "search.all.p95_ms"             : False,
+    "rag_inference.p95_ms"          : False,
+    "rag_inference.context_tokens"  : False,
+    "load.p95_ms"                   : False,
+    "load.requests_per_s"           : True,
+    "backends.support.int8.p95_ms"  : False,
+    "backends.support.int8.recall"  : True,
+}
+
+
+# ───────────────────────── synthetic corpus ───────────────────────── #
+def _sentence(rng: random.Random, n: int) -> str:
+    return " ".join(rng.choice(VOCAB) for _ in range(n)).capitalize() + "."
+
+def make_corpus(root: Path, n_sops: int, n_articles: int, words: int, seed: int = 0) -> Dict:
+    """Write  root/sop_documents/*.txt  and  root/json_data/articles.json ."""
+    rng = random.Random(seed)
+    sop_dir, json_dir = root / "sop_documents", root / "json_data"
+    sop_dir.mkdir(parents=True, exist_ok=True)
+    json_dir.mkdir(parents=True, exist_ok=True)
+    for i in range(n_sops):
+        body = "\n\n".join(" ".join(_sentence(rng, rng.randint(6, 18)) for _ in range(5))
+                           for _ in range(max(1, words // 60)))
+        (sop_dir / f"SOP-{i:05d}_procedure.txt").write_text(
+            f"---\nsop_id: SOP-{i:05d}\ntitle: {_sentence(rng, 4)[:-1]}\n"
+            f"department: {rng.choice(DEPARTMENTS)}\n---\n{body}\n", encoding="utf-8")
+    with open(json_dir / "articles.json", "w", encoding="utf-8") as f:
+        f.write("[")
+        for i in range(n_articles):
+            if i:
+                f.write(",")
+            json.dump({"title": _sentence(rng, 5)[:-1],
+                       "description_text": " ".join(_sentence(rng, rng.randint(8, 20))
+                                                    for _ in range(max(1, words // 14))),
+                       "article_id": f"KB-{i:06d}",
+                       "department": rng.choice(DEPARTMENTS)}, f)
+        f.write("]")
+    return {"sops": n_sops, "articles": n_articles, "words_per_doc": words}
+
+def make_queries(n: int, n_sops: int, seed: int = 1) -> List[str]:
+    rng = random.Random(seed)
+    queries = []
+    for i in range(n):
+        if i % 5 == 4 and n_sops:                     # some exact-ID lookups
+            queries.append(f"What does SOP-{rng.randrange(n_sops):05d} say?")
+        else:
+            queries.append(f"How do I {' '.join(rng.choice(VOCAB) for _ in range(rng.randint(3, 7)))}?")
+    return queries
+
+
+# ───────────────────────────── helpers ───────────────────────────── #
+def latency_stats(seconds: List[float]) -> Dict:
+    ms = np.asarray(seconds) * 1000
+    return {"n": len(ms), "mean_ms": float(ms.mean()),
+            "p50_ms": float(np.percentile(ms, 50)), "p95_ms": float(np.percentile(ms, 95)),
+            "p99_ms": float(np.percentile(ms, 99)), "max_ms": float(ms.max())}
+
+def _timed(fn: Callable, *args) -> float:
+    t0 = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - t0
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, cwd=Path(__file__).resolve().parent).stdout.strip() or None
+    except OSError:
+        return None
+
+def _count(root: Path, name: str) -> int:
+    import chromadb
+    from index_versions import active_version
+    return chromadb.PersistentClient(path=str(active_version(root))).get_collection(name).count()
+
+
+# ───────────────────────────── stages ────────────────────────────── #
+def bench_indexing(work: Path, workers: int, n_items: int) -> Dict:
+    import index_sop, index_json
+    index_sop.CHROMA_PATH = work / "chroma_sops"
+    index_json.SOURCE_DIR = work / "json_data"
+    index_json.CHROMA_PATH = work / "chromadb_data"
+
+    sop_s = _timed(index_sop.main, True, workers)
+    sop_chunks = _count(index_sop.CHROMA_PATH, index_sop.COLLECTION_NAME)
+    sop_noop = _timed(index_sop.main, False, workers)
+    json_s = _timed(index_json.main, True)
+    json_chunks = _count(index_json.CHROMA_PATH, index_json.COLLECTION_NAME)
+    json_noop = _timed(index_json.main, False)
+    files = sum(1 for _ in (work / "sop_documents").glob("*.txt"))
+    return {
+        "sop" : {"files": files, "chunks": sop_chunks, "seconds": sop_s,
+                 "files_per_s": files / sop_s, "chunks_per_s": sop_chunks / sop_s,
+                 "noop_s": sop_noop},
+        "json": {"items": n_items, "chunks": json_chunks, "seconds": json_s,
+                 "items_per_s": n_items / json_s, "chunks_per_s": json_chunks / json_s,
+                 "noop_s": json_noop},
+    }
+
+def bench_queries(rag, queries: List[str]) -> Dict:
+    out = {}
+    for domain in list(rag.DB_CFG) + [rag.ALL_DOMAINS]:
+        rag.search_similar_chunks(domain, queries[0])          # warm caches / models
+        out[domain] = latency_stats([_timed(rag.search_similar_chunks, domain, q)
+                                     for q in queries])
+    return out
+
+def bench_rag(rag, queries: List[str]) -> Dict:
+    rag.rag_inference("sop", queries[0])
+    lat, tokens = [], []
+    for q in queries:
+        t0 = time.perf_counter()
+        _, _, info = rag.rag_inference("sop", q)
+        lat.append(time.perf_counter() - t0)
+        if "tokens" in info.get("context", {}):
+            tokens.append(info["context"]["tokens"])
+    return {**latency_stats(lat),
+            "context_tokens": sum(tokens) / len(tokens) if tokens else None}
+
+def bench_load(queries: List[str], concurrency: int, requests_total: int) -> Dict:
+    import logging, threading, requests
+    from werkzeug.serving import make_server
+    import app as webapp
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)     # no per-request lines
+    server = make_server("127.0.0.1", 0, webapp.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/search"
+    local = threading.local()
+    status: Dict[str, int] = {}
+    lock = threading.Lock()
+
+    def one(i: int) -> float:
+        body = {"query": queries[i % len(queries)],
+                "domain": ("sop", "support", "all")[i % 3]}
+        t0 = time.perf_counter()
+        try:
+            if not hasattr(local, "session"):
+                local.session = requests.Session()
+            code = str(local.session.post(url, json=body, timeout=120).status_code)
+        except requests.RequestException as e:
+            code = type(e).__name__
+        elapsed = time.perf_counter() - t0
+        with lock:
+            status[code] = status.get(code, 0) + 1
+        return elapsed
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        lat = list(pool.map(one, range(requests_total)))
+    wall = time.perf_counter() - t0
+    server.shutdown()
+    return {**latency_stats(lat), "concurrency": concurrency, "wall_s": wall,
+            "requests_per_s": requests_total / wall, "status": status}
+
+
+# ────────────────────────── vector backends ──────────────────────── #
+def _rss_mb() -> Dict[str, float] | None:
+    """Private (anonymous) and file-backed resident memory of this process (Linux only)."""
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+        return {kind: int(fields[f"Rss{kind.capitalize()}"].split()[0]) / 1024
+                for kind in ("anon", "file")}
+    except (OSError, KeyError, ValueError):
+        return None
+
+def _probe_memory(backend: str, path: str, name: str, queries: np.ndarray, k: int) -> Dict:
+    """
+    Run in a fresh process: resident memory added by importing the backend,
+    opening the index and answering `queries`.  Anonymous memory is private
+    to each worker; file-backed pages (the mmapped matrix) are shared.
+    """
+    start = _rss_mb()
+    if backend == "chroma":
+        import chromadb
+        imported = _rss_mb()
+        store = chromadb.PersistentClient(path=path).get_collection(name)
+    else:
+        from vector_store import MatrixStore
+        imported = _rss_mb()
+        store = MatrixStore(path)
+    for q in queries:
+        store.query(query_embeddings=[q], n_results=k, include=["distances"])
+    end = _rss_mb()
+    if start is None:
+        return {}
+    return {"import_mb": imported["anon"] - start["anon"],
+            "anon_mb": end["anon"] - imported["anon"],
+            "file_mb": end["file"] - imported["file"]}
+
+def _ranked(store, queries: np.ndarray, k: int) -> tuple[List[float], List[List[str]]]:
+    seconds, ids = [], []
+    for q in queries:
+        t0 = time.perf_counter()
+        res = store.query(query_embeddings=[q], n_results=k, include=["distances"])
+        seconds.append(time.perf_counter() - t0)
+        ids.append(res["ids"][0])
+    return seconds, ids
+
+def bench_backends(collection, chroma_path: Path, queries: np.ndarray, work: Path,
+                   k: int = 10) -> Dict:
+    """
+    Export `collection` in both matrix dtypes and compare them with Chroma:
+    latency per query, recall@k against an exact float32 search, disk size
+    and (in a fresh process each) the memory one worker adds.
+    """
+    from vector_store import MatrixStore, export_matrix, DTYPES
+    stores, out = {"chroma": collection}, {}
+    for dtype in DTYPES:
+        t0 = time.perf_counter()
+        export_matrix(collection, work / dtype, dtype)
+        out[dtype] = {"export_s": time.perf_counter() - t0,
+                      "disk_mb": sum(p.stat().st_size for p in (work / dtype).iterdir()) / 2**20}
+        stores[dtype] = MatrixStore(work / dtype)
+
+    full = np.load(work / "int8" / "vectors_f32.npy", mmap_mode="r")   # exact reference
+    ids = np.load(work / "int8" / "ids.npy")
+    q = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+    sims = np.asarray(full) @ q.T
+    truth = [set(ids[np.argsort(-sims[:, i])[:k]].astype(str)) for i in range(len(q))]
+
+    ctx = multiprocessing.get_context("spawn")
+    for backend, store in stores.items():
+        store.query(query_embeddings=[queries[0]], n_results=k)          # warm
+        seconds, found = _ranked(store, queries, k)
+        recall = float(np.mean([len(truth[i] & set(f)) / max(1, len(truth[i]))
+                                for i, f in enumerate(found)]))
+        path = chroma_path if backend == "chroma" else work / backend
+        with ctx.Pool(1) as pool:
+            memory = pool.apply(_probe_memory, (backend, str(path), collection.name,
+                                                queries, k))
+        out[backend] = {**out.get(backend, {}), **latency_stats(seconds),
+                        "recall": recall, "k": k, "memory": memory}
+        print(f"[BENCH]   {backend:<8} p50 {out[backend]['p50_ms']:7.2f} ms  "
+              f"p95 {out[backend]['p95_ms']:7.2f} ms  recall@{k} {recall:.3f}  "
+              f"private +{memory.get('anon_mb', float('nan')):.0f} MiB  "
+              f"shared +{memory.get('file_mb', float('nan')):.0f} MiB")
+    for store in stores.values():
+        if isinstance(store, MatrixStore):
+            store.close()
+    out["chunks"] = collection.count()
+    return out
+
+def bench_domain_backends(rag, queries: List[str], work: Path) -> Dict:
+    """bench_backends on each domain's live index, with real query embeddings."""
+    import chromadb
+    from index_versions import active_version
+    out = {}
+    for domain, cfg in rag.DB_CFG.items():
+        vecs = np.stack([rag.embed_query(domain, q) for q in queries])
+        path = active_version(cfg["persist_dir"])
+        collection = chromadb.PersistentClient(path=str(path)).get_collection(
+            cfg["collection"], embedding_function=rag._EMBEDDER_CACHE[domain])
+        print(f"[BENCH] backends on '{domain}' ({collection.count()} chunks) …")
+        out[domain] = bench_backends(collection, path, vecs, work / "backends" / domain)
+    return out
+
+def make_vector_collection(path: Path, n: int, dim: int = 384, seed: int = 0):
+    """
+    Chroma collection of `n` clustered random unit vectors (cosine space) –
+    backend comparisons at corpus sizes that would take long to index.
+    """
+    import chromadb
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((max(1, n // 200), dim)).astype(np.float32)
+    collection = chromadb.PersistentClient(path=str(path)).get_or_create_collection(
+        "vectors", metadata={"hnsw:space": "cosine"}, embedding_function=None)
+    batch = 5000                                  # below Chroma's max batch size
+    for start in range(collection.count(), n, batch):
+        m = min(batch, n - start)
+        v = centres[rng.integers(len(centres), size=m)] + \
+            0.8 * rng.standard_normal((m, dim)).astype(np.float32)
+        collection.add(ids=[f"v{i}" for i in range(start, start + m)],
+                       embeddings=v / np.linalg.norm(v, axis=1, keepdims=True),
+                       documents=[f"chunk {i}" for i in range(start, start + m)],
+                       metadatas=[{"cluster_k": -1}] * m)
+    return collection
+
+def bench_synthetic_backends(work: Path, n: int, n_queries: int) -> Dict:
+    path = work / "backends" / "synthetic"
+    print(f"[BENCH] backends on {n} synthetic vectors …")
+    t0 = time.perf_counter()
+    collection = make_vector_collection(path / "chroma", n)
+    build_s = time.perf_counter() - t0
+    got = collection.get(ids=[f"v{i}" for i in range(0, n, max(1, n // n_queries))][:n_queries],
+                         include=["embeddings"])
+    rng = np.random.default_rng(1)
+    queries = np.asarray(got["embeddings"], dtype=np.float32)
+    queries += 0.05 * rng.standard_normal(queries.shape).astype(np.float32)
+    return {"chroma_build_s": build_s,
+            **bench_backends(collection, path / "chroma", queries, path)}
+
+
+# ──────────────────────────── comparison ─────────────────────────── #
+def _get(d: Dict, path: str):
+    for part in path.split("."):
+        if not isinstance(d, dict) or part not in d:
+            return None
+        d = d[part]
+    return d
+
+def compare(new: Dict, old: Dict, tolerance: float) -> bool:
+    """Print the change of every tracked metric; False if any regressed > tolerance."""
+    ok = True
+    print(f"{'metric':<30}{'old':>12}{'new':>12}{'change':>10}")
+    for path, higher_better in TRACKED.items():
+        a, b = _get(old, path), _get(new, path)
+        if not isinstance(a, (int, float)) or not isinstance(b, (int, float)) or a == 0:
+            continue
+        change = (b - a) / a
+        worse = -change if higher_better else change
+        flag = "  REGRESSION" if worse > tolerance else ""
+        ok &= not flag
+        print(f"{path:<30}{a:>12.2f}{b:>12.2f}{change:>+10.1%}{flag}")
+    return ok
+
+
+# ─────────────────────────────── main ────────────────────────────── #
+def parse_args(argv=None) -> argparse.Namespace:
+    ap = argparse.ArgumentParser(description="Offline indexing / query / load benchmarks")
+    ap.add_argument("--sops", type=int, default=200, help="synthetic SOP files")
+    ap.add_argument("--articles", type=int, default=1000, help="synthetic support articles")
+    ap.add_argument("--words", type=int, default=400, help="approx. words per document")
+    ap.add_argument("--queries", type=int, default=100, help="queries per latency test")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                    help="index_sop extraction processes")
+    ap.add_argument("--llm-latency", type=float, default=0.05, help="stub LLM seconds to first token")
+    ap.add_argument("--llm-tokens", type=int, default=32, help="stub LLM fragments per answer")
+    ap.add_argument("--llm-token-latency", type=float, default=0.002)
+    ap.add_argument("--concurrency", type=int, default=8, help="concurrent /search clients")
+    ap.add_argument("--requests", type=int, default=200, help="total /search requests")
+    ap.add_argument("--skip", nargs="*", default=[],
+                    choices=["index", "query", "rag", "load", "backends"],
+                    help="stages to skip (the others need an index from this workdir)")
+    ap.add_argument("--vectors", type=int, default=0,
+                    help="also compare vector backends on N synthetic vectors (0 = off)")
+    ap.add_argument("--workdir", type=Path, default=None,
+                    help="keep corpus + indexes here (default: temp dir, deleted afterwards)")
+    ap.add_argument("--embed-cache", action="store_true",
+                    help="keep the embedding cache on (default off: measure the model)")
+    ap.add_argument("--out", type=Path, default=Path("bench_results.json"))
+    ap.add_argument("--compare", type=Path, default=None, help="earlier results JSON")
+    ap.add_argument("--tolerance", type=float, default=0.2,
+                    help="allowed relative regression for --compare")
+    return ap.parse_args(argv)
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    work = args.workdir or Path(tempfile.mkdtemp(prefix="sop-bench-"))
+    work.mkdir(parents=True, exist_ok=True)
+    # must be set before the indexers / rag are imported
+    os.environ["SOURCE_DIR"] = str(work / "sop_documents")
+    if not args.embed_cache:
+        os.environ["EMBED_CACHE_PATH"] = ""
+    else:
+        os.environ.setdefault("EMBED_CACHE_PATH", str(work / "embedding_cache.sqlite"))
+    os.environ.setdefault("RAG_WARMUP", "0")
+
+    results: Dict = {"meta": {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "commit": _git_commit(),
+        "python": platform.python_version(), "platform": platform.platform(),
+        "cpus": os.cpu_count(), "args": {k: str(v) for k, v in vars(args).items()},
+    }}
+    try:
+        if "index" not in args.skip or not (work / "sop_documents").exists():
+            results["corpus"] = make_corpus(work, args.sops, args.articles, args.words)
+        if "index" not in args.skip:
+            print(f"[BENCH] indexing {args.sops} SOPs / {args.articles} articles …")
+            results["indexing"] = bench_indexing(work, args.workers, args.articles)
+
+        from stub_llm import start_stub_server
+        stub, stub_url = start_stub_server(latency=args.llm_latency, tokens=args.llm_tokens,
+                                           token_latency=args.llm_token_latency)
+        import rag
+        rag.LLM.url = stub_url
+        rag.ANSWER_CACHE_SIZE = 0                     # measure the pipeline, not the cache
+        rag.DB_CFG["sop"]["persist_dir"] = str(work / "chroma_sops")
+        rag.DB_CFG["support"]["persist_dir"] = str(work / "chromadb_data")
+        queries = make_queries(args.queries, args.sops)
+
+        if "query" not in args.skip:
+            print(f"[BENCH] search_similar_chunks × {len(queries)} per domain …")
+            results["search"] = bench_queries(rag, queries)
+        if "rag" not in args.skip:
+            print(f"[BENCH] rag_inference × {len(queries)} …")
+            results["rag_inference"] = bench_rag(rag, queries)
+        if "load" not in args.skip:
+            print(f"[BENCH] /search load: {args.requests} requests, {args.concurrency} clients …")
+            results["load"] = bench_load(queries, args.concurrency, args.requests)
+        if "backends" not in args.skip:
+            results["backends"] = bench_domain_backends(rag, queries, work)
+            if args.vectors:
+                results["backends"]["synthetic"] = bench_synthetic_backends(
+                    work, args.vectors, len(queries))
+        results["llm_stub"] = {"latency_s": args.llm_latency, "tokens": args.llm_tokens,
+                               **stub.stats()}
+        stub.shutdown()
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(work, ignore_errors=True)
+
+    args.out.write_text(json.dumps(results, indent=2), encoding="utf-8")
+    print(f"[BENCH] results written to {args.out}")
+    if args.compare:
+        ok = compare(results, json.loads(args.compare.read_text(encoding="utf-8")),
+                     args.tolerance)
+        return 0 if ok else 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
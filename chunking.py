@@ -0,0 +1,124 @@
+"""
+chunking.py  –  Offset-based overlapping chunker shared by the indexers
+------------------------------------------------------------------
+Chunk boundaries are computed as character offsets into the original
+string; the text itself is only sliced once per chunk, when it is needed.
+
+    for start, end, text in iter_chunks(body, size=100, overlap=20):
+        ...  # store start/end in the chunk metadata
+
+Units are whitespace-separated words by default, or real tokenizer tokens
+(CHUNK_UNIT=tokens, counted with the embedding model's tokenizer).  With
+CHUNK_SNAP=1 a chunk ends at the last sentence / paragraph / heading break
+inside its overlap with the next chunk, and the next chunk starts at the
+beginning of the sentence containing its nominal start (looking back at
+most one overlap), so chunks stop cutting sentences in half.
+
+Every unit is covered: the last window always reaches the end of the text,
+and a text shorter than one window becomes a single chunk.
+"""
+
+from __future__ import annotations
+import os, re
+from functools import lru_cache
+from typing import Dict, Iterator, List, Optional, Tuple
+
+CHUNKER_VERSION = 2
+CHUNK_UNIT = os.getenv("CHUNK_UNIT", "words")          # "words" | "tokens"
+CHUNK_SNAP = os.getenv("CHUNK_SNAP", "0") == "1"       # snap to sentence boundaries
+
+_WORD = re.compile(r"\S+")
+_BOUNDARY = re.compile(r"[.!?][\"')\]]*\s+|\n[ \t]*\n\s*|\n(?=[ \t]*#{1,6}\s)")
+
+Span = Tuple[int, int]
+
+
+def chunker_params(unit: str = CHUNK_UNIT, snap: bool = CHUNK_SNAP) -> Dict:
+    """Settings that change chunk boundaries – part of the indexers' manifest params."""
+    return {"version": CHUNKER_VERSION, "unit": unit, "snap": snap}
+
+
+@lru_cache(maxsize=4)
+def get_tokenizer(model_name: str):
+    """Fast HF tokenizer of a SentenceTransformer model (loaded once per process)."""
+    from transformers import AutoTokenizer
+    for name in (model_name, f"sentence-transformers/{model_name}"):
+        try:
+            return AutoTokenizer.from_pretrained(name, use_fast=True)
+        except (OSError, ValueError):
+            continue
+    raise ValueError(f"No tokenizer found for '{model_name}'")
+
+
+def _unit_spans(text: str, tokenizer=None) -> Iterator[Span]:
+    if tokenizer is None:
+        for m in _WORD.finditer(text):
+            yield m.span()
+        return
+    enc = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True,
+                    verbose=False)
+    for start, end in enc["offset_mapping"]:
+        if end > start:
+            yield start, end
+
+
+def chunk_spans(text: str, size: int, overlap: int, snap: bool = False,
+                tokenizer=None) -> List[Span]:
+    """
+    (start, end) character offsets of overlapping windows of `size` units,
+    advancing by `size - overlap`.  Only the window boundaries are kept, not
+    the units themselves.
+    """
+    if not 0 <= overlap < size:
+        raise ValueError(f"need 0 <= overlap < size (got size={size}, overlap={overlap})")
+    step = size - overlap
+    starts: List[int] = []
+    ends: List[int] = []
+    n, last_end = 0, 0
+    for j, (s, e) in enumerate(_unit_spans(text, tokenizer)):
+        if j % step == 0:
+            starts.append(s)
+        if j >= size - 1 and (j - size + 1) % step == 0:
+            ends.append(e)
+        n, last_end = j + 1, e
+    if n == 0:
+        return []
+
+    n_windows = 1 if n <= size else -(-(n - size) // step) + 1
+    spans = [(starts[k], ends[k] if k < len(ends) else last_end) for k in range(n_windows)]
+    if snap:
+        _snap(text, spans)
+    return spans
+
+
+def _snap(text: str, spans: List[Span]) -> None:
+    for k in range(len(spans) - 1):
+        (s, e), (ns, ne) = spans[k], spans[k + 1]
+        cut = None
+        for m in _BOUNDARY.finditer(text, ns, e):      # break inside the overlap
+            cut = m
+        if cut is not None and cut.end() > ns:
+            e = cut.end()
+            while e > s and text[e - 1].isspace():
+                e -= 1
+        back = None
+        for m in _BOUNDARY.finditer(text, max(s, ns - (e - ns)), ns):
+            back = m                                    # start of the sentence holding ns
+        if back is not None and back.end() <= ns:
+            ns = back.end()
+        spans[k], spans[k + 1] = (s, max(e, ns)), (ns, ne)
+
+
+def iter_chunks(text: str, size: int, overlap: int, snap: bool = False,
+                tokenizer=None) -> Iterator[Tuple[int, int, str]]:
+    """Yield (start, end, text[start:end]) for every chunk of `text`."""
+    for start, end in chunk_spans(text, size, overlap, snap, tokenizer):
+        yield start, end, text[start:end]
+
+
+def chunk_text(text: str, size: int, overlap: int, unit: str = CHUNK_UNIT,
+               snap: bool = CHUNK_SNAP, model_name: Optional[str] = None
+               ) -> Iterator[Tuple[int, int, str]]:
+    """iter_chunks() configured from CHUNK_UNIT / CHUNK_SNAP (what the indexers call)."""
+    tokenizer = get_tokenizer(model_name) if unit == "tokens" and model_name else None
+    return iter_chunks(text, size, overlap, snap, tokenizer)
@@ -0,0 +1,55 @@
+"""
+cli.py  –  One entry point for the indexing, clustering, serving and benchmark tools
+------------------------------------------------------------------
+    python cli.py index sop [--rebuild] [--workers N] …   # index_sop.py
+    python cli.py index json [--rebuild] …                # index_json.py
+    python cli.py cluster --k auto …                      # sop_clustering.py
+    python cli.py serve --workers 4 …                     # serve.py
+    python cli.py bench --sops 500 …                      # benchmark.py
+
+Everything after the command goes to that tool unchanged (`cli.py index sop
+-h` lists its options).  Only the chosen tool is imported, and each tool
+loads torch / chromadb / scikit-learn itself once it actually needs them,
+so `--help` and an index run with nothing to do return almost instantly.
+"""
+
+from __future__ import annotations
+import sys, argparse
+
+
+def parse_args(argv=None) -> tuple[argparse.Namespace, list[str]]:
+    ap = argparse.ArgumentParser(
+        prog="cli.py", description="SOP search: indexing, clustering, serving, benchmarks",
+        epilog="Options after the command are passed to it; '<command> -h' lists them.")
+    sub = ap.add_subparsers(dest="command", required=True, metavar="command")
+    index = sub.add_parser("index", add_help=False,
+                           help="build / refresh a collection (incremental; --rebuild to wipe)")
+    index.add_argument("source", choices=["sop", "json"])
+    sub.add_parser("cluster", add_help=False, help="cluster SOPs and store labels (K-Means)")
+    sub.add_parser("serve", add_help=False,
+                   help="production server: web workers + shared embedding process")
+    sub.add_parser("bench", add_help=False, help="offline benchmark on a synthetic corpus")
+    return ap.parse_known_args(argv)
+
+def main(argv=None) -> int:
+    args, rest = parse_args(argv)
+    if args.command == "index":
+        if args.source == "sop":
+            import index_sop
+            index_sop.cli(rest)
+        else:
+            import index_json
+            index_json.cli(rest)
+    elif args.command == "cluster":
+        import sop_clustering
+        sop_clustering.main(rest)
+    elif args.command == "serve":
+        import serve
+        return serve.main(rest)
+    elif args.command == "bench":
+        import benchmark
+        return benchmark.main(rest)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,71 @@
+"""
+cluster_router.py  –  Route a query to the nearest SOP clusters
+------------------------------------------------------------------
+sop_clustering.py stores a `cluster_k` label on every chunk and saves the
+centroids to  <persist_dir>/cluster_centroids.npz .  With routing enabled,
+rag.py compares the query embedding with the centroids (cosine), keeps the
+`nprobe` closest clusters and restricts the Chroma query to them with a
+metadata filter.  Chunks indexed since the last clustering run carry
+cluster_k = UNASSIGNED and are always searched.  Chroma cannot filter on a
+missing key, so chunks without cluster_k would be skipped; index_sop.py
+re-indexes chunks from before routing once (METADATA_SCHEMA) to stamp it.
+
+Routing is skipped (full search) when it is not confident: the best
+centroid is too far from the query, or the last kept and the first dropped
+cluster are almost equally close.
+"""
+
+from __future__ import annotations
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+CENTROIDS_NAME = "cluster_centroids.npz"
+CLUSTER_KEY    = "cluster_k"
+UNASSIGNED     = -1
+
+
+def load_cluster_labels(path: Path) -> Dict[str, int]:
+    """sop_id → cluster label from a saved centroids file ({} if there is none)."""
+    try:
+        with np.load(path) as data:
+            return dict(zip(data["sop_ids"].tolist(), data["labels"].tolist()))
+    except (OSError, KeyError, ValueError):
+        return {}
+
+
+class ClusterRouter:
+    def __init__(self, centroids: np.ndarray, nprobe: int = 3,
+                 min_sim: float = 0.2, min_margin: float = 0.01):
+        c = np.asarray(centroids, dtype=np.float32)
+        self.centroids = c / np.maximum(np.linalg.norm(c, axis=1, keepdims=True), 1e-12)
+        self.nprobe = nprobe
+        self.min_sim = min_sim
+        self.min_margin = min_margin
+
+    @classmethod
+    def load(cls, path: Path, **kwargs) -> "ClusterRouter":
+        with np.load(path) as data:
+            return cls(data["centroids"], **kwargs)
+
+    def __len__(self) -> int:
+        return len(self.centroids)
+
+    def route(self, query_embedding) -> Optional[List[int]]:
+        """The `nprobe` nearest cluster ids, or None → search everything."""
+        if self.nprobe >= len(self.centroids):
+            return None
+        q = np.asarray(query_embedding, dtype=np.float32)
+        sims = self.centroids @ (q / max(float(np.linalg.norm(q)), 1e-12))
+        order = np.argsort(-sims)
+        if sims[order[0]] < self.min_sim:
+            return None
+        if sims[order[self.nprobe - 1]] - sims[order[self.nprobe]] < self.min_margin:
+            return None
+        return [int(i) for i in order[:self.nprobe]]
+
+    @staticmethod
+    def where(clusters: List[int]) -> dict:
+        """Chroma metadata filter for the routed clusters (+ unassigned chunks)."""
+        return {CLUSTER_KEY: {"$in": list(clusters) + [UNASSIGNED]}}
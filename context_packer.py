@@ -0,0 +1,224 @@
+"""
+context_packer.py  –  Token-budgeted prompt context from retrieved chunks
+------------------------------------------------------------------
+Turns the ranked hits of search_similar_chunks into the EXCERPTS block of
+the LLM prompt.  Every token there is prefill time in Ollama, so:
+
+1. hits from the same document are merged into one passage – chunks
+   overlap (CHUNK_OVERLAP) and their char_start / char_end offsets say by
+   how much, so the shared text appears once; non-adjacent pieces of one
+   document are joined with an ellipsis line
+2. passages whose word 3-shingles are mostly contained in a better-ranked
+   passage (the same text indexed twice, or in both domains) are dropped
+3. passages are added best-first while they fit CONTEXT_TOKEN_BUDGET,
+   counted with a real tokenizer; one that does not fit is cut at a
+   sentence (or word) end if enough room is left, otherwise skipped
+
+    passages, stats = pack_context(hits, budget=1024, counter=get_counter("all-MiniLM-L6-v2"))
+    excerpts = "\n\n".join(render_passage(i, p) for i, p in enumerate(passages, 1))
+
+Tokens are counted with CONTEXT_TOKENIZER (a Hugging Face tokenizer name,
+ideally the LLM's, e.g. Qwen/Qwen3-8B) or, by default, the embedding
+model's tokenizer, which is already on disk.  Without any tokenizer the
+count falls back to characters / CHARS_PER_TOKEN.
+"""
+
+from __future__ import annotations
+import os, re, math, threading
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 1024))   # 0 = unlimited
+CONTEXT_TOKENIZER    = os.getenv("CONTEXT_TOKENIZER", "")             # "" = embedding model's
+CONTEXT_DEDUP_SIM    = float(os.getenv("CONTEXT_DEDUP_SIM", 0.8))     # containment; 0 = off
+MIN_PASSAGE_TOKENS   = 48          # a passage cut shorter than this is skipped instead
+CHARS_PER_TOKEN      = 4           # estimate when no tokenizer can be loaded
+GAP = "\n…\n"                      # between non-adjacent pieces of one document
+
+_WORD = re.compile(r"\w+")
+_SENTENCE_END = re.compile(r"[.!?:;][\"')\]]*(?=\s)|\n")
+
+
+# ───────────────────────────── tokens ────────────────────────────── #
+class TokenCounter:
+    """Counts and truncates by tokenizer tokens (loaded on first use)."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._tokenizer = None
+        self._loaded = False
+        self._lock = threading.Lock()           # HF fast tokenizers are not re-entrant
+
+    def _get(self):
+        if not self._loaded:
+            from chunking import get_tokenizer
+            try:
+                self._tokenizer = get_tokenizer(self.name)
+            except (ImportError, OSError, ValueError) as e:
+                print(f"[WARN] No tokenizer for '{self.name}' ({e}) – estimating tokens "
+                      f"as characters / {CHARS_PER_TOKEN}.")
+            self._loaded = True
+        return self._tokenizer
+
+    def _offsets(self, text: str) -> Optional[List[Tuple[int, int]]]:
+        with self._lock:
+            tok = self._get()
+            if tok is None:
+                return None
+            enc = tok(text, add_special_tokens=False, return_offsets_mapping=True,
+                      verbose=False)
+        return enc["offset_mapping"]
+
+    def count(self, text: str) -> int:
+        offsets = self._offsets(text)
+        return math.ceil(len(text) / CHARS_PER_TOKEN) if offsets is None else len(offsets)
+
+    def truncate(self, text: str, n: int) -> str:
+        """At most `n` tokens of `text`, cut back to a sentence or word end, plus '…'."""
+        if n <= 1:
+            return ""
+        offsets = self._offsets(text)
+        if offsets is None:
+            end = (n - 1) * CHARS_PER_TOKEN
+        elif len(offsets) <= n:
+            return text
+        else:
+            end = offsets[n - 2][1]             # keep one token for the ellipsis
+        if end >= len(text):
+            return text
+        cut = text[:end]
+        floor = len(cut) // 2                   # never give up more than half
+        sentence = max((m.end() for m in _SENTENCE_END.finditer(cut)), default=0)
+        if sentence > floor:
+            cut = cut[:sentence]
+        elif " " in cut[floor:]:
+            cut = cut[:cut.rindex(" ")]
+        return cut.rstrip() + " …"
+
+@lru_cache(maxsize=None)
+def get_counter(name: str) -> TokenCounter:
+    """One shared counter per tokenizer name."""
+    return TokenCounter(name)
+
+
+# ──────────────────────────── passages ───────────────────────────── #
+@dataclass
+class Passage:
+    domain   : str
+    doc      : str                      # document key (chunk-ID prefix)
+    meta     : dict                     # title / id / department of the best hit
+    relevance: float                    # best hit's relevance (0 – 1)
+    rank     : int                      # best hit's position in the retrieval order
+    chunk_ids: List[str] = field(default_factory=list)
+    parts    : List[Tuple[Optional[Tuple[int, int]], str]] = field(default_factory=list)
+    text     : str = ""
+
+
+def document_key(chunk_id: str) -> str:
+    """'SOP-12_1a2b3c4d_3' → 'SOP-12_1a2b3c4d', 'KB-9_chunk_0' → 'KB-9_chunk' (chunk IDs)."""
+    head, sep, tail = chunk_id.rpartition("_")
+    return head if sep and tail.isdigit() else chunk_id
+
+def _join(parts: Sequence[Tuple[Optional[Tuple[int, int]], str]]) -> str:
+    """
+    One text from a document's chunks: pieces with offsets in document order,
+    overlaps written once; pieces without (older indexes) follow as they are.
+    """
+    spans = sorted((span, text) for span, text in parts
+                   if span is not None and span[1] - span[0] == len(text))
+    loose = [text for span, text in parts
+             if span is None or span[1] - span[0] != len(text)]
+    segments, end = [], -1
+    for (s, e), text in spans:
+        if segments and s <= end:               # overlaps / touches the previous piece
+            if e > end:
+                segments[-1] += text[end - s:]
+                end = e
+        else:
+            segments.append(text)
+            end = e
+    return GAP.join(segments + loose)
+
+def merge_hits(hits: Sequence[dict]) -> List[Passage]:
+    """Group ranked hits by (domain, document); passages ordered by their best hit."""
+    passages: Dict[Tuple[str, str], Passage] = {}
+    for rank, hit in enumerate(hits):
+        key = (hit["domain"], document_key(hit["chunk_id"]))
+        p = passages.get(key)
+        if p is None:
+            p = passages[key] = Passage(hit["domain"], key[1], hit["meta"],
+                                        hit["relevance"], rank)
+        p.chunk_ids.append(hit["chunk_id"])
+        p.parts.append((hit.get("span"), hit["chunk"]))
+    for p in passages.values():
+        p.text = _join(p.parts)
+    return list(passages.values())
+
+def _shingles(text: str, n: int = 3) -> set:
+    words = _WORD.findall(text.lower())
+    return {tuple(words[i:i + n]) for i in range(max(1, len(words) - n + 1))}
+
+def drop_near_duplicates(passages: Sequence[Passage],
+                         threshold: float = CONTEXT_DEDUP_SIM) -> Tuple[List[Passage], int]:
+    """
+    Keep passages (best first) unless most of the shorter one's 3-shingles
+    occur in a passage already kept.  Returns (kept, number dropped).
+    """
+    if threshold <= 0:
+        return list(passages), 0
+    kept, seen = [], []
+    for p in passages:
+        sh = _shingles(p.text)
+        if any(len(sh & other) / max(1, min(len(sh), len(other))) >= threshold
+               for other in seen):
+            continue
+        kept.append(p)
+        seen.append(sh)
+    return kept, len(passages) - len(kept)
+
+
+# ───────────────────────────── packing ───────────────────────────── #
+def render_passage(number: int, p: Passage) -> str:
+    """One excerpt as the LLM sees it."""
+    meta = p.meta
+    ref = f" ({meta['id']})" if meta.get("id") not in (None, "", "N/A") else ""
+    return (f"[{number}] SOURCE: {meta['title']}{ref} | "
+            f"Relevance: {round(p.relevance * 100, 1)}%\n{p.text.strip()}")
+
+def pack_context(hits: Sequence[dict], budget: int = CONTEXT_TOKEN_BUDGET,
+                 counter: Optional[TokenCounter] = None,
+                 dedup: float = CONTEXT_DEDUP_SIM) -> Tuple[List[Passage], Dict]:
+    """
+    Merged, de-duplicated passages that fit `budget` tokens once rendered
+    (budget <= 0: no limit; no counter: no limit and no count), and counts
+    of what happened:
+    hits, passages, merged (chunks folded into another), duplicates,
+    truncated, skipped and tokens.
+    """
+    merged = merge_hits(hits)
+    passages, duplicates = drop_near_duplicates(merged, dedup)
+    stats = {"hits": len(hits), "merged": len(hits) - len(merged),
+             "duplicates": duplicates, "truncated": 0, "skipped": 0, "tokens": 0}
+    out: List[Passage] = []
+    for p in passages:
+        if counter is None:
+            out.append(p)
+            continue
+        cost = counter.count(render_passage(len(out) + 1, p)) + 2   # + blank line
+        if budget <= 0 or stats["tokens"] + cost <= budget:
+            out.append(p)
+            stats["tokens"] += cost
+            continue
+        header = counter.count(render_passage(len(out) + 1, Passage(
+            p.domain, p.doc, p.meta, p.relevance, p.rank))) + 2
+        room = budget - stats["tokens"] - header
+        if room >= MIN_PASSAGE_TOKENS or (not out and room > 1):
+            p.text = counter.truncate(p.text, room)
+            out.append(p)
+            stats["tokens"] += counter.count(render_passage(len(out), p)) + 2
+            stats["truncated"] += 1
+        else:
+            stats["skipped"] += 1
+    stats["passages"] = len(out)
+    return out, stats
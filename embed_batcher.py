@@ -0,0 +1,95 @@
+"""
+embed_batcher.py  –  Micro-batching of concurrent query embeddings
+------------------------------------------------------------------
+Every search embeds exactly one query.  Under concurrent load that means
+many batch-of-one forward passes fighting over the same model.  A
+MicroBatcher sits in front of the embedding function: callers enqueue their
+text and block; one worker thread takes whatever is queued (up to
+`max_batch`), waits at most `max_wait` seconds for more, encodes the lot in
+one call and hands every caller its own vector.
+
+    batcher = MicroBatcher(emb_fn, max_batch=32, max_wait=0.002)
+    vec = batcher.embed("how do I reset a password?")     # np.float32 row
+
+While a batch is being encoded new queries pile up in the queue, so under
+load batches fill by themselves; a lone request only pays `max_wait`.
+Identical texts in one batch are encoded once.
+"""
+
+from __future__ import annotations
+import time, queue, threading
+from concurrent.futures import Future
+from typing import Callable, List, Sequence, Tuple
+
+import numpy as np
+
+
+class MicroBatcher:
+    def __init__(self, embed_fn: Callable[[List[str]], Sequence], max_batch: int = 32,
+                 max_wait: float = 0.002, name: str = "embed-batch"):
+        self.embed_fn = embed_fn
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait)
+        self.name = name
+        self._queue: "queue.Queue[Tuple[str, Future]]" = queue.Queue()
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+
+    def submit(self, text: str) -> Future:
+        """Queue one text; the Future resolves to its float32 vector."""
+        future: Future = Future()
+        self._queue.put((text, future))
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, daemon=True,
+                                                    name=self.name)
+                    self._thread.start()
+        return future
+
+    def embed(self, text: str) -> np.ndarray:
+        return self.submit(text).result()
+
+    def stats(self) -> dict:
+        return {"batches": self.batches, "items": self.items,
+                "mean_batch": self.items / self.batches if self.batches else 0.0}
+
+    # ───────────── worker ─────────────
+    def _collect(self) -> List[Tuple[str, Future]]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except queue.Empty:
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            batch = [(t, f) for t, f in batch if f.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            unique = list(dict.fromkeys(t for t, _ in batch))
+            try:
+                vectors = np.asarray(self.embed_fn(unique), dtype=np.float32)
+            except Exception as e:             # every caller in the batch sees the error
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.items += len(batch)
+            row = {t: i for i, t in enumerate(unique)}
+            for text, future in batch:
+                future.set_result(vectors[row[text]])
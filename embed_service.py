@@ -0,0 +1,261 @@
+"""
+embed_service.py  –  One embedding process shared by every server worker
+------------------------------------------------------------------
+With N web workers each loading torch and the SentenceTransformer model,
+model memory grows N-fold.  In production (serve.py) a single process owns
+the models instead and the workers send it their query texts:
+
+    python embed_service.py --address unix:/tmp/sop-embed.sock
+    EMBED_SERVICE=unix:/tmp/sop-embed.sock  →  rag.py uses RemoteEmbeddingFunction
+                                               (gpu_embedding_function.py)
+
+Requests from all workers meet in one MicroBatcher per model, so concurrent
+searches share forward passes across processes too.  Addresses are
+`unix:/path/to.sock` (Linux / macOS) or `host:port` (TCP, e.g. on Windows).
+
+Wire format (both directions): 4-byte big-endian length + JSON header; an
+embedding reply is followed by the float32 matrix (`shape` in the header).
+    → {"op": "embed", "model": "...", "normalize": false, "texts": [...]}
+    ← {"ok": true, "shape": [n, dim]} + n·dim·4 bytes
+    → {"op": "ping"}   ← {"ok": true, "models": [...], "pid": 1234, "batches": {...}}
+"""
+
+from __future__ import annotations
+import os, sys, json, time, signal, socket, struct, argparse, threading, socketserver
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from embed_batcher import MicroBatcher
+
+DEFAULT_ADDRESS = "unix:/tmp/sop-embed.sock" if hasattr(socket, "AF_UNIX") \
+    else "127.0.0.1:5099"
+SERVICE_TIMEOUT = float(os.getenv("EMBED_SERVICE_TIMEOUT", 30))   # seconds per call
+_HEADER = struct.Struct(">I")
+
+
+class EmbedServiceError(RuntimeError):
+    """The embedding service is unreachable or answered with an error."""
+
+
+def parse_address(address: str) -> Tuple[int, object]:
+    """'unix:/path' → (AF_UNIX, path);  'host:port' / 'tcp://host:port' → (AF_INET, (host, port))."""
+    if address.startswith("unix:"):
+        return socket.AF_UNIX, address[len("unix:"):]
+    host, _, port = address.removeprefix("tcp://").rpartition(":")
+    return socket.AF_INET, (host or "127.0.0.1", int(port))
+
+def _send(sock: socket.socket, header: dict, payload: bytes = b"") -> None:
+    data = json.dumps(header).encode("utf-8")
+    sock.sendall(_HEADER.pack(len(data)) + data + payload)
+
+def _recv_exact(sock: socket.socket, n: int) -> bytes:
+    buf = bytearray()
+    while len(buf) < n:
+        part = sock.recv(n - len(buf))
+        if not part:
+            raise ConnectionError("connection closed")
+        buf += part
+    return bytes(buf)
+
+def _recv(sock: socket.socket) -> dict:
+    (n,) = _HEADER.unpack(_recv_exact(sock, _HEADER.size))
+    return json.loads(_recv_exact(sock, n))
+
+
+# ─────────────────────────────── client ──────────────────────────────── #
+class EmbedClient:
+    """Talks to the embedding service; one connection per calling thread."""
+
+    def __init__(self, address: str, timeout: float = SERVICE_TIMEOUT):
+        self.address = address
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connect(self) -> socket.socket:
+        family, target = parse_address(self.address)
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(target)
+        return sock
+
+    def _call(self, header: dict) -> Tuple[dict, socket.socket]:
+        for attempt in (1, 2):                  # a stale keep-alive connection gets one retry
+            sock = getattr(self._local, "sock", None)
+            try:
+                if sock is None:
+                    sock = self._local.sock = self._connect()
+                _send(sock, header)
+                return _recv(sock), sock
+            except OSError as e:
+                self.close()
+                if attempt == 2:
+                    raise EmbedServiceError(f"embedding service {self.address}: {e}") from e
+
+    def embed(self, model: str, normalize: bool, texts: List[str]) -> np.ndarray:
+        """float32 matrix, one row per text."""
+        reply, sock = self._call({"op": "embed", "model": model,
+                                  "normalize": normalize, "texts": texts})
+        if not reply.get("ok"):
+            raise EmbedServiceError(reply.get("error", "embedding failed"))
+        rows, dim = reply["shape"]
+        try:
+            data = _recv_exact(sock, rows * dim * 4)
+        except OSError as e:
+            self.close()
+            raise EmbedServiceError(f"embedding service {self.address}: {e}") from e
+        return np.frombuffer(data, dtype=np.float32).reshape(rows, dim)
+
+    def ping(self) -> dict:
+        reply, _ = self._call({"op": "ping"})
+        return reply
+
+    def close(self) -> None:
+        sock = getattr(self._local, "sock", None)
+        self._local.sock = None
+        if sock is not None:
+            sock.close()
+
+
+def wait_until_up(address: str, timeout: float = 120.0) -> dict:
+    """Ping the service until it answers (raises EmbedServiceError after `timeout`)."""
+    client = EmbedClient(address, timeout=5)
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return client.ping()
+        except EmbedServiceError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.2)
+        finally:
+            client.close()
+
+
+# ─────────────────────────────── server ──────────────────────────────── #
+class EmbedService:
+    """Loads models on first use; one MicroBatcher per (model, normalize)."""
+
+    def __init__(self, device: str | None = None, max_batch: int = 64, max_wait: float = 0.002):
+        self.device = device
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._batchers: Dict[Tuple[str, bool], MicroBatcher] = {}
+        self._lock = threading.Lock()
+
+    def batcher(self, model: str, normalize: bool) -> MicroBatcher:
+        key = (model, bool(normalize))
+        with self._lock:                        # concurrent first requests load once
+            if key not in self._batchers:
+                from gpu_embedding_function import get_shared_embedding_function
+                emb_fn = get_shared_embedding_function(model, self.device, normalize)
+                self._batchers[key] = MicroBatcher(emb_fn, self.max_batch, self.max_wait,
+                                                   name=f"embed-batch-{model}")
+            return self._batchers[key]
+
+    def embed(self, model: str, normalize: bool, texts: List[str]) -> np.ndarray:
+        if not texts:                           # nothing to encode – don't load the model
+            return np.empty((0, 0), dtype=np.float32)
+        batcher = self.batcher(model, normalize)
+        futures = [batcher.submit(t) for t in texts]
+        return np.vstack([f.result() for f in futures]).astype(np.float32, copy=False)
+
+    def models(self) -> List[str]:
+        return sorted({m for m, _ in self._batchers})
+
+    def stats(self) -> Dict[str, dict]:
+        return {f"{m}{' (normalized)' if n else ''}": b.stats()
+                for (m, n), b in self._batchers.items()}
+
+
+def _embed_args(req: dict) -> Tuple[str, bool, List[str]]:
+    """(model, normalize, texts) of an embed request; ValueError if malformed."""
+    model, normalize, texts = req.get("model"), req.get("normalize", False), req.get("texts")
+    if not isinstance(model, str) or not model:
+        raise ValueError("'model' must be a non-empty string")
+    if not isinstance(normalize, bool):
+        raise ValueError("'normalize' must be true or false")
+    if not isinstance(texts, list) or not all(isinstance(t, str) for t in texts):
+        raise ValueError("'texts' must be a list of strings")
+    return model, normalize, texts
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        sock = self.request
+        while True:
+            try:
+                req = _recv(sock)
+            except (ConnectionError, OSError, ValueError):
+                return                          # client closed the connection
+            try:
+                if not isinstance(req, dict):
+                    raise ValueError("request must be a JSON object")
+                if req.get("op") == "ping":
+                    _send(sock, {"ok": True, "models": self.server.service.models(),
+                                 "pid": os.getpid(), "batches": self.server.service.stats()})
+                elif req.get("op") == "embed":
+                    vecs = self.server.service.embed(*_embed_args(req))
+                    _send(sock, {"ok": True, "shape": list(vecs.shape)}, vecs.tobytes())
+                else:
+                    _send(sock, {"ok": False, "error": f"unknown op {req.get('op')!r}"})
+            except OSError:
+                return
+            except Exception as e:              # bad request / model failure: report, keep serving
+                try:
+                    _send(sock, {"ok": False, "error": f"{type(e).__name__}: {e}"})
+                except OSError:
+                    return                      # client already gone
+
+
+def make_server(address: str, service: EmbedService) -> socketserver.BaseServer:
+    family, target = parse_address(address)
+    if family == socket.AF_INET:
+        base = socketserver.TCPServer
+    else:
+        base = socketserver.UnixStreamServer
+        if os.path.exists(target):              # left over from a previous run
+            os.unlink(target)
+    cls = type("EmbedServer", (socketserver.ThreadingMixIn, base),
+               {"daemon_threads": True, "allow_reuse_address": True})
+    server = cls(target, _Handler)
+    server.service = service
+    return server
+
+
+def _terminate(signum, frame):
+    raise KeyboardInterrupt
+
+def main(argv=None) -> None:
+    ap = argparse.ArgumentParser(description="Shared embedding service for the web workers")
+    ap.add_argument("--address", default=os.getenv("EMBED_SERVICE") or DEFAULT_ADDRESS,
+                    help="unix:/path/to.sock or host:port")
+    ap.add_argument("--device", default=None, help="cuda / cpu (default: auto)")
+    ap.add_argument("--batch", type=int, default=int(os.getenv("EMBED_MICROBATCH", 64)),
+                    help="max texts per forward pass")
+    ap.add_argument("--wait-ms", type=float,
+                    default=float(os.getenv("EMBED_MICROBATCH_WAIT_MS", 2)),
+                    help="max wait for a batch to fill")
+    ap.add_argument("--preload", nargs="*", default=[],
+                    help="models to load before accepting requests")
+    args = ap.parse_args(argv)
+
+    service = EmbedService(args.device, args.batch, args.wait_ms / 1000)
+    for model in args.preload:
+        service.embed(model, False, ["warm-up"])
+    server = make_server(args.address, service)
+    signal.signal(signal.SIGTERM, _terminate)   # serve.py stops us with SIGTERM
+    print(f"[EMBED] Serving on {args.address} (pid {os.getpid()}, batch {args.batch}, "
+          f"wait {args.wait_ms:g} ms)", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        family, target = parse_address(args.address)
+        if family != socket.AF_INET and os.path.exists(target):
+            os.unlink(target)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+"""
+embedding_cache.py  –  Persistent, size-bounded embedding cache (SQLite)
+------------------------------------------------------------------
+Rows are keyed by (model name, normalise flag, SHA-256 of the text) and hold
+the float32 vector.  Every hit refreshes `last_used`; when the table grows
+past `max_entries` the least recently used 10 % are evicted.  The database
+runs in WAL mode so indexers and several server workers can share one file.
+"""
+
+from __future__ import annotations
+import os, time, sqlite3, hashlib, threading
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+DEFAULT_CACHE_PATH  = os.getenv("EMBED_CACHE_PATH",
+                                str(Path(__file__).resolve().parent / "embedding_cache.sqlite"))
+DEFAULT_MAX_ENTRIES = int(os.getenv("EMBED_CACHE_MAX_ENTRIES", 500_000))
+_SQL_VARS = 500          # keys per IN (...) query, well below SQLite's limit
+
+
+def text_hash(text: str) -> bytes:
+    return hashlib.sha256(text.encode("utf-8")).digest()
+
+
+class EmbeddingCache:
+    def __init__(self, path: str | Path = DEFAULT_CACHE_PATH,
+                 max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL, normalize INTEGER NOT NULL, text_hash BLOB NOT NULL,"
+            " vec BLOB NOT NULL, last_used REAL NOT NULL,"
+            " PRIMARY KEY (model, normalize, text_hash)) WITHOUT ROWID"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS embeddings_lru ON embeddings(last_used)")
+        self._db.commit()
+        self._count = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def get_many(self, model: str, normalize: bool,
+                 texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        """Cached vector per text, or None on a miss."""
+        hashes = [text_hash(t) for t in texts]
+        found: Dict[bytes, np.ndarray] = {}
+        with self._lock:
+            for i in range(0, len(hashes), _SQL_VARS):
+                part = hashes[i:i + _SQL_VARS]
+                rows = self._db.execute(
+                    "SELECT text_hash, vec FROM embeddings WHERE model=? AND normalize=?"
+                    f" AND text_hash IN ({','.join('?' * len(part))})",
+                    (model, int(normalize), *part),
+                ).fetchall()
+                found.update((h, np.frombuffer(v, dtype=np.float32)) for h, v in rows)
+            if found:
+                now = time.time()
+                self._db.executemany(
+                    "UPDATE embeddings SET last_used=? WHERE model=? AND normalize=? AND text_hash=?",
+                    [(now, model, int(normalize), h) for h in found],
+                )
+                self._db.commit()
+        out = [found.get(h) for h in hashes]
+        n_hit = sum(v is not None for v in out)
+        self.hits += n_hit
+        self.misses += len(out) - n_hit
+        return out
+
+    def put_many(self, model: str, normalize: bool, texts: Sequence[str],
+                 vectors: Sequence[np.ndarray]) -> None:
+        now = time.time()
+        rows = [(model, int(normalize), text_hash(t),
+                 np.asarray(v, dtype=np.float32).tobytes(), now)
+                for t, v in zip(texts, vectors)]
+        with self._lock:
+            added = self._db.executemany(
+                "INSERT OR IGNORE INTO embeddings VALUES (?,?,?,?,?)", rows).rowcount
+            if added < len(rows):                # some keys exist: refresh them in place
+                self._db.executemany(
+                    "UPDATE embeddings SET vec=?, last_used=?"
+                    " WHERE model=? AND normalize=? AND text_hash=?",
+                    [(vec, used, m, n, h) for m, n, h, vec, used in rows])
+            self._db.commit()
+            self._count += added                 # only rows that are really new
+            if self._count > self.max_entries:
+                self._evict()
+
+    def _evict(self) -> None:
+        """Drop least-recently-used rows down to 90 % of max_entries."""
+        self._count = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        excess = self._count - int(self.max_entries * 0.9)
+        if excess <= 0:
+            return
+        deleted = self._db.execute(
+            "DELETE FROM embeddings WHERE (model, normalize, text_hash) IN ("
+            " SELECT model, normalize, text_hash FROM embeddings ORDER BY last_used LIMIT ?)",
+            (excess,),
+        ).rowcount
+        self._db.commit()
+        self._count -= deleted
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "entries": self._count}
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
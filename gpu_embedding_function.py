@@ -1,12 +1,38 @@
 """
 Custom GPU-Enabled Embedding Function for ChromaDB
 Workaround for ChromaDB's SentenceTransformerEmbeddingFunction device parameter bug
+
+Inputs are sorted by token length before encoding so each batch holds
+similarly sized texts (less padding); with num_workers > 1 large inputs are
+fanned out over a SentenceTransformer multi-process pool.  Results are
+always returned in the original input order.
+
+A persistent EmbeddingCache (see embedding_cache.py) is consulted first, so
+texts embedded by an earlier index run never reach the model again.  The
+shared (query-time) functions skip it unless EMBED_CACHE_QUERIES=1: a
+per-query SQLite commit would cost every search a disk sync and serialise
+concurrent requests on the write lock.
+
+torch and sentence-transformers are imported when the first model is
+loaded, not when this module is imported.  RemoteEmbeddingFunction is the
+same interface backed by the shared embedding process (embed_service.py).
 """
 
-import torch
-from sentence_transformers import SentenceTransformer
+import os, math, atexit, threading
+import numpy as np
 from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
-from typing import cast
+from typing import List, Union, cast
+from embedding_cache import EmbeddingCache, DEFAULT_CACHE_PATH
+from embed_service import EmbedClient, SERVICE_TIMEOUT
+
+DEFAULT_BATCH_SIZE  = int(os.getenv("EMBED_BATCH_SIZE", 64))
+DEFAULT_NUM_WORKERS = int(os.getenv("EMBED_WORKERS", 0))   # 0/1 = single process
+EMBED_CACHE_QUERIES = os.getenv("EMBED_CACHE_QUERIES", "0") == "1"   # cache query embeddings too
+
+def default_device() -> str:
+    """'cuda' if a GPU is available, else 'cpu' (imports torch on first call)."""
+    import torch
+    return "cuda" if torch.cuda.is_available() else "cpu"
 
 class GPUSentenceTransformerEmbeddingFunction(EmbeddingFunction[Documents]):
     """
@@ -14,7 +40,9 @@ class GPUSentenceTransformerEmbeddingFunction(EmbeddingFunction[Documents]):
     This works around ChromaDB's bug where the device parameter is ignored.
     """
     
-    def __init__(self, model_name: str, device: str = None, normalize_embeddings: bool = False):
+    def __init__(self, model_name: str, device: str = None, normalize_embeddings: bool = False,
+                 batch_size: int = DEFAULT_BATCH_SIZE, num_workers: int = DEFAULT_NUM_WORKERS,
+                 cache: Union[EmbeddingCache, str, os.PathLike, None] = DEFAULT_CACHE_PATH):
         """
         Initialize the embedding function.
         
@@ -22,13 +50,22 @@ class GPUSentenceTransformerEmbeddingFunction(EmbeddingFunction[Documents]):
             model_name: Name of the SentenceTransformer model
             device: Device to use ('cuda', 'cpu', or None for auto-detection)
             normalize_embeddings: Whether to normalize embeddings
+            batch_size: Texts per forward pass
+            num_workers: Encoder processes for large inputs (0/1 = in-process)
+            cache: EmbeddingCache, path to its SQLite file, or None/"" to disable
         """
+        from sentence_transformers import SentenceTransformer
         if device is None:
-            device = "cuda" if torch.cuda.is_available() else "cpu"
+            device = default_device()
         
         self.model_name = model_name
         self.device = device
         self.normalize_embeddings = normalize_embeddings
+        self.batch_size = max(1, batch_size)
+        self.num_workers = num_workers
+        self._pool = None
+        self.cache = EmbeddingCache(cache) if isinstance(cache, (str, os.PathLike)) and cache \
+            else (cache or None)
         
         # Initialize the model with the specified device
         self.model = SentenceTransformer(model_name, device=device)
@@ -36,6 +73,10 @@ class GPUSentenceTransformerEmbeddingFunction(EmbeddingFunction[Documents]):
         print(f"[GPU Embedding Function] Model: {model_name}")
         print(f"[GPU Embedding Function] Device: {self.model.device}")
         print(f"[GPU Embedding Function] Normalize: {normalize_embeddings}")
+        if self.cache is not None:
+            print(f"[GPU Embedding Function] Cache: {self.cache.path}")
+        if num_workers > 1:
+            print(f"[GPU Embedding Function] Workers: {num_workers} (batch {self.batch_size})")
     
     def __call__(self, input: Documents) -> Embeddings:
         """
@@ -47,15 +88,86 @@ class GPUSentenceTransformerEmbeddingFunction(EmbeddingFunction[Documents]):
         Returns:
             List of embeddings
         """
-        # Encode using the SentenceTransformer model
-        embeddings = self.model.encode(
-            input,
-            normalize_embeddings=self.normalize_embeddings,
-            convert_to_numpy=True
-        )
-        
-        # Convert to list format expected by ChromaDB
-        return cast(Embeddings, embeddings.tolist())
+        texts = list(input)
+        if not texts:
+            return cast(Embeddings, [])
+        if self.cache is None:
+            return cast(Embeddings, self._encode(texts).tolist())
+
+        cached = self.cache.get_many(self.model_name, self.normalize_embeddings, texts)
+        todo = list({t: None for t, v in zip(texts, cached) if v is None})   # unique misses
+        if todo:
+            fresh = self._encode(todo)
+            self.cache.put_many(self.model_name, self.normalize_embeddings, todo, fresh)
+            by_text = dict(zip(todo, fresh))
+            cached = [v if v is not None else by_text[t] for t, v in zip(texts, cached)]
+        return cast(Embeddings, np.vstack(cached).tolist())
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        """Run the model over `texts`; rows are returned in input order."""
+        # Longest first, so every batch is padded to a similar length
+        order = np.argsort(-self._token_lengths(texts), kind="stable")
+        sorted_texts = [texts[i] for i in order]
+
+        if self.num_workers > 1 and len(texts) >= self.batch_size * self.num_workers:
+            # contiguous, batch-aligned slices keep the length buckets intact
+            per_worker = math.ceil(len(texts) / (self.num_workers * 4))
+            chunk_size = max(1, math.ceil(per_worker / self.batch_size)) * self.batch_size
+            encoded = self.model.encode_multi_process(
+                sorted_texts, self._get_pool(),
+                batch_size=self.batch_size,
+                chunk_size=chunk_size,
+                normalize_embeddings=self.normalize_embeddings
+            )
+        else:
+            encoded = self.model.encode(
+                sorted_texts,
+                batch_size=self.batch_size,
+                normalize_embeddings=self.normalize_embeddings,
+                convert_to_numpy=True
+            )
+
+        # Undo the length sort
+        embeddings = np.empty_like(encoded)
+        embeddings[order] = encoded
+        return embeddings
+
+    def _token_lengths(self, texts: List[str]) -> np.ndarray:
+        """Token count per text (character count if the model has no tokenizer)."""
+        tokenizer = getattr(self.model, "tokenizer", None)
+        if tokenizer is None:
+            return np.fromiter((len(t) for t in texts), dtype=np.int64, count=len(texts))
+        ids = tokenizer(texts, add_special_tokens=False, truncation=True,
+                        max_length=getattr(self.model, "max_seq_length", None) or 512)["input_ids"]
+        return np.fromiter((len(x) for x in ids), dtype=np.int64, count=len(ids))
+
+    def _get_pool(self):
+        """Start the multi-process pool on first use (one torch process per worker)."""
+        if self._pool is None:
+            if self.device == "cpu":
+                devices = ["cpu"] * self.num_workers
+                # split the cores between workers instead of oversubscribing them
+                threads = str(max(1, (os.cpu_count() or 1) // self.num_workers))
+                prev = os.environ.get("OMP_NUM_THREADS")
+                os.environ["OMP_NUM_THREADS"] = threads
+                try:
+                    self._pool = self.model.start_multi_process_pool(target_devices=devices)
+                finally:
+                    if prev is None:
+                        os.environ.pop("OMP_NUM_THREADS", None)
+                    else:
+                        os.environ["OMP_NUM_THREADS"] = prev
+            else:
+                self._pool = self.model.start_multi_process_pool()
+            atexit.register(self.close)
+        return self._pool
+
+    def close(self) -> None:
+        """Stop the worker pool, if one was started."""
+        if self._pool is not None:
+            from sentence_transformers import SentenceTransformer
+            SentenceTransformer.stop_multi_process_pool(self._pool)
+            self._pool = None
     
     def get_model_info(self) -> dict:
         """Get information about the model."""
@@ -63,10 +175,65 @@ class GPUSentenceTransformerEmbeddingFunction(EmbeddingFunction[Documents]):
             "model_name": self.model_name,
             "device": str(self.model.device),
             "normalize_embeddings": self.normalize_embeddings,
+            "batch_size": self.batch_size,
+            "num_workers": self.num_workers,
+            "cache": self.cache.stats() if self.cache is not None else None,
             "embedding_dim": self.model.get_sentence_embedding_dimension()
         }
 
 
+class RemoteEmbeddingFunction(EmbeddingFunction[Documents]):
+    """Chroma embedding function that forwards texts to the embedding service."""
+
+    def __init__(self, model_name: str, address: str, normalize_embeddings: bool = False,
+                 timeout: float = SERVICE_TIMEOUT):
+        self.model_name = model_name
+        self.address = address
+        self.normalize_embeddings = normalize_embeddings
+        self.cache = None                       # the service owns the embedding cache
+        self.client = EmbedClient(address, timeout)
+
+    def __call__(self, input: Documents) -> Embeddings:
+        texts = list(input)
+        if not texts:
+            return cast(Embeddings, [])
+        return cast(Embeddings, list(self.client.embed(self.model_name,
+                                                       self.normalize_embeddings, texts)))
+
+    def ping(self) -> dict:
+        return self.client.ping()
+
+    def close(self) -> None:
+        self.client.close()
+
+
+# Process-wide registry: one model instance per (model, device, normalize)
+_SHARED: dict = {}
+_SHARED_LOCK = threading.Lock()
+
+def get_shared_embedding_function(model_name: str, device: str = None,
+                                  normalize_embeddings: bool = False) -> GPUSentenceTransformerEmbeddingFunction:
+    """
+    Return the process-wide embedding function for this configuration,
+    loading the model on first use.  Collections that use the same model
+    share one instance (and one copy of its weights).  These serve queries,
+    so they use the embedding cache only with EMBED_CACHE_QUERIES=1.
+    """
+    if device is None:
+        device = default_device()
+    key = (model_name, device, bool(normalize_embeddings))
+    with _SHARED_LOCK:
+        fn = _SHARED.get(key)
+        if fn is None:
+            fn = _SHARED[key] = GPUSentenceTransformerEmbeddingFunction(
+                model_name=model_name,
+                device=device,
+                normalize_embeddings=normalize_embeddings,
+                cache=DEFAULT_CACHE_PATH if EMBED_CACHE_QUERIES else None
+            )
+        return fn
+
+
 # Alternative: Direct replacement function
 def create_gpu_embedding_function(model_name: str = "all-MiniLM-L6-v2", device: str = None):
     """
@@ -80,7 +247,7 @@ def create_gpu_embedding_function(model_name: str = "all-MiniLM-L6-v2", device:
         GPUSentenceTransformerEmbeddingFunction instance
     """
     if device is None:
-        device = "cuda" if torch.cuda.is_available() else "cpu"
+        device = default_device()
     
     return GPUSentenceTransformerEmbeddingFunction(
         model_name=model_name,
@@ -1,26 +1,35 @@
 """
 index_json.py  –  Build / refresh the JSON Data Chroma collection
 ------------------------------------------------------------------
-1. Extract text from JSON files (description_text and title fields)
+1. Extract text from JSON / JSON Lines files (description_text and title fields)
+   – parsed incrementally, one item at a time, so file size does not matter
 2. Chunk (overlapping) and embed with all-MiniLM-L6-v2
-3. Upsert into persistent Chroma collection "json_vectors"
+3. Upsert into persistent Chroma collection "json_vectors" in fixed-size
+   batches (peak memory ≈ one batch of chunks)
+   Incremental: a manifest (index_manifest.json inside CHROMA_PATH) lets
+   unchanged files be skipped; pass --rebuild for a clean rebuild.
+   Each run builds and validates a new index version, then flips
+   CHROMA_PATH/CURRENT (see index_versions.py).
+   A BM25 index over the same chunk IDs is kept next to it for hybrid search.
    Each chunk receives:
        title           (from JSON)     ✓
        description     (from JSON)     ✓
-       json_id         (generated)     ✓
-   plus chunk_idx, file_path
+       json_id         (generated)     ✓  "<path under SOURCE_DIR>_<item_index>"
+   plus chunk_idx, char_start/char_end (offsets into title + description), file_path
+torch, chromadb and the model are only loaded when some file needs indexing.
 """
 
 from __future__ import annotations
-import os, re, json, uuid, shutil
+import os, json, time, argparse
 from pathlib import Path
-from typing import Dict, List, Tuple
-import torch
+from typing import Dict, Iterator, List, Tuple
 from tqdm import tqdm
-from sentence_transformers import SentenceTransformer
-import chromadb
-from chromadb.utils import embedding_functions as emb_f
-from gpu_embedding_function import GPUSentenceTransformerEmbeddingFunction
+from index_manifest import IndexManifest, MANIFEST_NAME, sync_file, remove_missing
+from index_versions import active_version, new_version, promote, collect_garbage, root_lock
+from lexical_index import BM25Index, lexical_index_path
+from vector_store import sync_matrix, matrix_dtype, DTYPES
+from stage_timing import StageStats, STATS_NAME
+from chunking import chunk_text, chunker_params
 
 # ────────────────────────── CONFIG ────────────────────────── #
 SOURCE_DIR      = Path(r"json_data")          # JSON files directory
@@ -29,29 +38,92 @@ CHUNK_OVERLAP   = 20
 EMBED_MODEL     = "all-MiniLM-L6-v2"
 CHROMA_PATH     = Path(r"chromadb_data")
 COLLECTION_NAME = "json_chunks"
-
-# Delete existing collection folder?  (uncomment for clean rebuild) 
-# WARNING: This will delete ALL collections in the directory!
-if CHROMA_PATH.exists(): shutil.rmtree(CHROMA_PATH)
+JSON_PATTERNS   = ("*.json", "*.jsonl", "*.ndjson")
+BATCH_SIZE      = int(os.getenv("INDEX_BATCH_SIZE", 256))   # chunks per embed/upsert
+MATRIX_DTYPE    = os.getenv("INDEX_MATRIX", "")             # int8 / float16 export ("" = off)
+READ_BLOCK      = 1 << 20                                   # bytes per read while streaming
+CHUNK_ID_SCHEME = 2          # 2: IDs from the path under SOURCE_DIR (1: file stem, collided)
 
 # ────────────────────────── JSON Processing ────────────────────────── #
-def extract_json_data(path: Path) -> List[Dict]:
-    """Extract data from JSON file. Handles both single objects and arrays."""
+def _iter_json_values(f, what: str) -> Iterator:
+    """
+    Yield consecutive JSON values from a text stream – the elements of a
+    top-level array (what="array") or a sequence of top-level values
+    (what="values": one object, concatenated objects, JSON Lines).
+    Only the unread tail and the current value are held in memory.
+    """
+    decoder = json.JSONDecoder()
+    buf, pos, eof = "", 0, False
+    while True:
+        # skip whitespace and (inside an array) the separating commas
+        while True:
+            while pos < len(buf) and (buf[pos].isspace() or (what == "array" and buf[pos] == ",")):
+                pos += 1
+            if pos < len(buf) or eof:
+                break
+            buf, pos = f.read(READ_BLOCK), 0
+            eof = not buf
+        if pos >= len(buf):
+            if what == "array":
+                raise ValueError("unterminated top-level array")
+            return
+        if what == "array" and buf[pos] == "]":
+            return
+        try:
+            value, end = decoder.raw_decode(buf, pos)
+            complete = end < len(buf) or eof     # a number may continue in the next block
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            complete = False
+        if not complete:
+            more = f.read(READ_BLOCK)
+            eof = not more
+            buf, pos = buf[pos:] + more, 0
+            continue
+        yield value
+        pos = end
+
+def iter_json_items(path: Path) -> Iterator[Dict]:
+    """
+    Stream the items of a JSON file without loading it: a top-level array
+    yields its elements, a single object yields itself, and JSON Lines /
+    concatenated objects yield one item per value.  Non-object items are
+    skipped with a warning.
+    """
     try:
         with open(path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
-        # If it's a single object, wrap it in a list
-        if isinstance(data, dict):
-            return [data]
-        elif isinstance(data, list):
-            return data
-        else:
-            print(f"[WARN] {path.name}: JSON data is not a dict or list")
-            return []
-    except Exception as e:
+            head = f.read(1)
+            while head.isspace():
+                head = f.read(1)
+            if not head:
+                return
+            if head == "[":
+                values = _iter_json_values(f, "array")
+            else:
+                f.seek(0)
+                values = _iter_json_values(f, "values")
+            for value in values:
+                if isinstance(value, dict):
+                    yield value
+                else:
+                    print(f"[WARN] {path.name}: skipping non-object item ({type(value).__name__})")
+    except (OSError, ValueError) as e:
         print(f"[ERROR] JSON read error {path.name}: {e}")
-        return []
+
+def extract_json_data(path: Path) -> List[Dict]:
+    """Extract data from JSON file. Handles both single objects and arrays."""
+    return list(iter_json_items(path))
+
+def json_doc_id(file_path: Path) -> str:
+    """
+    Document key of a JSON file: its path under SOURCE_DIR ('kb/faq.jsonl'),
+    unique where the stem alone is not (a/faq.json vs b/faq.json, faq.jsonl).
+    """
+    try:
+        return file_path.relative_to(SOURCE_DIR).as_posix()
+    except ValueError:                           # not under SOURCE_DIR
+        return file_path.as_posix()
 
 def process_json_item(item: Dict, item_index: int, file_path: Path) -> Tuple[str, Dict]:
     """Process a single JSON item and return (text_content, metadata)."""
@@ -66,7 +138,7 @@ def process_json_item(item: Dict, item_index: int, file_path: Path) -> Tuple[str
     metadata = {
         'title': title,
         'description': description_text,
-        'json_id': f"{file_path.stem}_{item_index}",
+        'json_id': f"{json_doc_id(file_path)}_{item_index}",
         'file_path': str(file_path),
         'item_index': item_index
     }
@@ -78,101 +150,233 @@ def process_json_item(item: Dict, item_index: int, file_path: Path) -> Tuple[str
     
     return text_content, metadata
 
-# ────────────────────────── Chunking ─────────────────────────── #
-def chunk_words(words: List[str], size: int, overlap: int) -> List[List[str]]:
-    """Split words into overlapping chunks."""
-    if len(words) <= size:
-        return [words]
-    
-    step = size - overlap
-    chunks = []
-    for i in range(0, len(words), step):
-        chunk = words[i:i+size]
-        if chunk:  # Only add non-empty chunks
-            chunks.append(chunk)
-        if i + size >= len(words):  # Stop if we've covered all words
-            break
-    
-    return chunks
+def iter_json_chunks(json_file: Path) -> Iterator[Tuple[str, str, Dict]]:
+    """Yield (chunk_id, chunk_text, metadata) for every chunk of every item."""
+    for item_index, json_item in enumerate(iter_json_items(json_file)):
+        text_content, base_metadata = process_json_item(json_item, item_index, json_file)
+
+        if not text_content.strip():
+            print(f"[WARN] {json_file.name} item {item_index}: empty content – skipped.")
+            continue
+
+        # Chunk by character offsets into text_content (see chunking.py)
+        chunks = list(chunk_text(text_content, CHUNK_SIZE, CHUNK_OVERLAP,
+                                 model_name=EMBED_MODEL))
+        if not chunks:
+            print(f"[WARN] {json_file.name} item {item_index}: produced 0 chunks – skipped.")
+            continue
+
+        # IDs are deterministic so a re-index overwrites the previous version
+        # of the item in place
+        for chunk_idx, (start, end, text) in enumerate(chunks):
+            yield (f"{base_metadata['json_id']}_chunk_{chunk_idx}", text, {
+                **base_metadata,
+                "chunk_idx": chunk_idx,
+                "total_chunks": len(chunks),
+                "char_start": start,
+                "char_end": end
+            })
+
+class UpsertBatcher:
+    """
+    Collects chunks from any number of files, embeds them with `emb_fn` and
+    upserts them `batch_size` at a time.  A finished file is handed to
+    `on_file_done` only after the batch holding its last chunk has been written.
+    """
+
+    def __init__(self, collection, emb_fn, batch_size: int, stats: StageStats,
+                 on_file_done, lexical=None):
+        self.collection = collection
+        self.emb_fn = emb_fn
+        self.batch_size = max(1, batch_size)
+        self.stats = stats
+        self.on_file_done = on_file_done
+        self.lexical = lexical
+        self._ids: List[str] = []
+        self._texts: List[str] = []
+        self._metas: List[Dict] = []
+        self._buffered_ids: set = set()
+        self._finished: List = []
+
+    def add(self, chunk_id: str, text: str, metadata: Dict) -> None:
+        if chunk_id in self._buffered_ids:
+            self.flush()                       # same ID twice in one upsert is an error
+        self._ids.append(chunk_id)
+        self._texts.append(text)
+        self._metas.append(metadata)
+        self._buffered_ids.add(chunk_id)
+        if len(self._ids) >= self.batch_size:
+            self.flush()
+
+    def file_done(self, file_info) -> None:
+        self._finished.append(file_info)
+        if not self._ids:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._ids:
+            n = len(self._ids)
+            with self.stats.time("embed", items=n):
+                embeddings = self.emb_fn(self._texts)
+            with self.stats.time("upsert", items=n):
+                self.collection.upsert(ids=self._ids, documents=self._texts,
+                                       metadatas=self._metas, embeddings=embeddings)
+            if self.lexical is not None:
+                with self.stats.time("lexical", items=n):
+                    self.lexical.add(self._ids, self._texts)
+            self._ids, self._texts, self._metas = [], [], []
+            self._buffered_ids.clear()
+        finished, self._finished = self._finished, []
+        for file_info in finished:
+            self.on_file_done(file_info)
 
 # ───────────────── MAIN ─────────────────
-def main() -> None:
+def parse_args(argv=None) -> argparse.Namespace:
+    ap = argparse.ArgumentParser(description="Build / refresh the JSON Chroma collection")
+    ap.add_argument("--rebuild", action="store_true",
+                    help="re-index every file into a fresh version (the live one keeps serving)")
+    ap.add_argument("--matrix", choices=[*DTYPES, "off"], default=MATRIX_DTYPE or "off",
+                    help="also export a memory-mapped matrix for rag's matrix backend")
+    ap.add_argument("--batch-size", type=int, default=BATCH_SIZE,
+                    help="chunks per embed/upsert batch")
+    return ap.parse_args(argv)
+
+def main(rebuild: bool = False, batch_size: int = BATCH_SIZE,
+         matrix: str | None = MATRIX_DTYPE) -> None:
+    if matrix and matrix not in DTYPES:
+        raise SystemExit(f"[ERROR] INDEX_MATRIX must be one of {', '.join(DTYPES)}, "
+                         f"not {matrix!r}")
+    with root_lock(CHROMA_PATH):                 # one build per index root at a time
+        _index(rebuild, batch_size, matrix)
+
+def _index(rebuild: bool, batch_size: int, matrix: str | None) -> None:
+    wall0 = time.perf_counter()
+
     # Create source directory if it doesn't exist
     SOURCE_DIR.mkdir(exist_ok=True)
     
     # Check if source directory has JSON files (search recursively)
-    json_files = list(SOURCE_DIR.rglob("*.json"))
+    json_files = sorted({p for pattern in JSON_PATTERNS for p in SOURCE_DIR.rglob(pattern)})
     if not json_files:
         print(f"[ERROR] No JSON files found in {SOURCE_DIR} (searched recursively)")
         print(f"Please place your JSON files in the '{SOURCE_DIR}' directory or its subdirectories")
         return
 
-    DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
-    print(f"[INDEX] Using device: {DEVICE}")
+    live = active_version(CHROMA_PATH)
+    version = None
+    if rebuild:                                  # start empty: every file is "new"
+        collect_garbage(CHROMA_PATH)
+        version = new_version(CHROMA_PATH)
+        print(f"[INDEX] --rebuild: building {version.name} from scratch")
+    manifest = IndexManifest((version or live) / MANIFEST_NAME, {
+        "chunk_size"   : CHUNK_SIZE,
+        "chunk_overlap": CHUNK_OVERLAP,
+        "chunker"      : chunker_params(),
+        "embed_model"  : EMBED_MODEL,
+        # bumping this re-indexes every file once; sync_file then deletes the
+        # chunks stored under the old IDs
+        "chunk_ids"    : CHUNK_ID_SCHEME,
+    })
+    todo = []
+    for json_file in json_files:
+        fresh, digest = manifest.check(json_file)
+        if not fresh:
+            todo.append((json_file, digest))
+    if version is None:
+        if not todo and not manifest.missing(json_files) and \
+                lexical_index_path(live, COLLECTION_NAME).exists() and \
+                matrix_dtype(live, COLLECTION_NAME) == (matrix or None):
+            manifest.save()                      # keep re-stamped mtimes
+            print(f"[INDEX] Found {len(json_files)} JSON files, all unchanged – nothing to do.")
+            return
+        # never write into the live version: update a copy, flip when done
+        collect_garbage(CHROMA_PATH)             # leftovers of interrupted runs
+        version = new_version(CHROMA_PATH, copy_from=live, share=True)
+        manifest.relocate(version / MANIFEST_NAME)
+        print(f"[INDEX] Building {version.name} from {live.name}")
+    lexical_path = lexical_index_path(version, COLLECTION_NAME)
+
+    # only now pay for torch, chromadb and the model
+    import chromadb
+    from gpu_embedding_function import GPUSentenceTransformerEmbeddingFunction, default_device
+    device = default_device()
+    print(f"[INDEX] Using device: {device}")
     
     # Initialize ChromaDB client and collection
-    client = chromadb.PersistentClient(path=str(CHROMA_PATH))
+    emb_fn = GPUSentenceTransformerEmbeddingFunction(
+        model_name=EMBED_MODEL,
+        device=device
+    )
+    client = chromadb.PersistentClient(path=str(version))
     collection = client.get_or_create_collection(
         COLLECTION_NAME,
-        embedding_function=GPUSentenceTransformerEmbeddingFunction(
-            model_name=EMBED_MODEL,
-            device=DEVICE
-        )
+        embedding_function=emb_fn
     )
 
-    print(f"[INDEX] Found {len(json_files)} JSON files to process")
+    lexical = BM25Index.open_for_update(lexical_path, collection)
+    removed = remove_missing(collection, manifest, json_files, lexical=lexical)
 
-    for json_file in tqdm(json_files, desc="Processing JSON files"):
-        json_items = extract_json_data(json_file)
-        
-        if not json_items:
-            print(f"[WARN] {json_file.name}: no valid JSON data – skipped.")
-            continue
+    print(f"[INDEX] Found {len(json_files)} JSON files: {len(todo)} new/changed, "
+          f"{len(json_files) - len(todo)} unchanged, {removed} removed")
+
+    def commit(file_info) -> None:
+        json_file, digest, file_ids = file_info
+        sync_file(collection, manifest, json_file, digest, file_ids,
+                  doc_id=json_doc_id(json_file), lexical=lexical)
 
-        print(f"[INFO] Processing {len(json_items)} items from {json_file.name}")
-
-        for item_index, json_item in enumerate(json_items):
-            text_content, base_metadata = process_json_item(json_item, item_index, json_file)
-            
-            if not text_content.strip():
-                print(f"[WARN] {json_file.name} item {item_index}: empty content – skipped.")
-                continue
-
-            # Split into words for chunking
-            words = re.findall(r"\S+", text_content)
-            if not words:
-                print(f"[WARN] {json_file.name} item {item_index}: 0 words – skipped.")
-                continue
-
-            # Create chunks
-            word_chunks = chunk_words(words, CHUNK_SIZE, CHUNK_OVERLAP)
-            if not word_chunks:
-                print(f"[WARN] {json_file.name} item {item_index}: produced 0 chunks – skipped.")
-                continue
-
-            chunk_texts = [" ".join(chunk) for chunk in word_chunks]
-
-            # Build per-chunk metadata
-            metadatas = []
-            chunk_ids = []
-            for chunk_idx in range(len(chunk_texts)):
-                chunk_metadata = {
-                    **base_metadata,
-                    "chunk_idx": chunk_idx,
-                    "total_chunks": len(chunk_texts)
-                }
-                metadatas.append(chunk_metadata)
-                chunk_ids.append(f"{base_metadata['json_id']}_chunk_{chunk_idx}_{uuid.uuid4().hex[:8]}")
-
-            # Upsert chunks into collection
-            collection.upsert(
-                ids=chunk_ids,
-                documents=chunk_texts,
-                metadatas=metadatas
-            )
+    stats = StageStats(units={"parse": "items", "embed": "chunks", "upsert": "chunks",
+                              "lexical": "chunks", "matrix": "chunks"})
+    batcher = UpsertBatcher(collection, emb_fn, batch_size, stats, commit, lexical)
+    items = tqdm(desc="Indexing JSON items", unit="item")
+    try:
+        for json_file, digest in todo:
+            file_ids: List[str] = []
+            n_items, last_item = 0, -1
+            t0 = time.perf_counter()
+            for chunk_id, text, metadata in iter_json_chunks(json_file):
+                if metadata["item_index"] != last_item:
+                    last_item = metadata["item_index"]
+                    n_items += 1
+                    items.update()
+                file_ids.append(chunk_id)
+                t1 = time.perf_counter()
+                batcher.add(chunk_id, text, metadata)
+                t0 += time.perf_counter() - t1      # parse time excludes upserts
+            stats.add("parse", time.perf_counter() - t0, n_items)
+
+            if not file_ids:
+                print(f"[WARN] {json_file.name}: no valid JSON data – skipped.")
+            batcher.file_done((json_file, digest, file_ids))
+        batcher.flush()
+    finally:
+        items.close()
+        manifest.save()
+        lexical.save(lexical_path)
 
+    if matrix:
+        with stats.time("matrix", collection.count()):
+            sync_matrix(collection, version, COLLECTION_NAME, matrix)
+    else:                                        # drop a copy inherited from the live version
+        sync_matrix(collection, version, COLLECTION_NAME, None)
+
+    wall = time.perf_counter() - wall0
+    n_items = stats.items["parse"]
     print(f"✓ Indexed {collection.count()} chunks into '{COLLECTION_NAME}'.")
-    print(f"✓ Collection stored at: {CHROMA_PATH}")
+    print(f"✓ Collection stored at: {version}")
+    print(stats.report(wall))
+    stats.save(version / STATS_NAME, wall)
+    promote(CHROMA_PATH, version, collection, manifest, lexical)
+    print(f"[STATS] throughput {n_items} items in {wall:.1f}s = "
+          f"{n_items / wall if wall > 0 else 0:.1f} items/s")
+    if emb_fn.cache is not None:
+        c = emb_fn.cache.stats()
+        print(f"[STATS] embedding cache: {c['hits']} hits, {c['misses']} misses, "
+              f"{c['entries']} entries")
+
+def cli(argv=None) -> None:
+    args = parse_args(argv)
+    main(rebuild=args.rebuild, batch_size=args.batch_size,
+         matrix=None if args.matrix == "off" else args.matrix)
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    cli()
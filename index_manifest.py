@@ -0,0 +1,150 @@
+"""
+index_manifest.py  –  Per-file manifest for incremental re-indexing
+------------------------------------------------------------------
+The indexers keep one JSON manifest next to their Chroma collection.
+Every source file that has been indexed gets an entry with:
+    size, mtime          (cheap change detection)
+    sha256               (authoritative change detection)
+    params               (chunking parameters + embed model)
+    doc_id, extra        (sop_id / JSON path and caller-supplied signature)
+    ids                  (chunk IDs the file produced)
+A file is re-processed only if its content, its parameters or its
+signature changed; chunks of changed or removed files are deleted by ID.
+"""
+
+from __future__ import annotations
+import os, json, hashlib, tempfile
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+MANIFEST_NAME = "index_manifest.json"
+MANIFEST_VERSION = 1
+_HASH_BLOCK = 1 << 20
+
+
+def file_digest(path: Path) -> str:
+    """SHA-256 of the file contents, read in 1 MiB blocks."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(_HASH_BLOCK), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class IndexManifest:
+    """Load / query / update the manifest stored at `path`."""
+
+    def __init__(self, path: Path, params: Dict):
+        self.path = Path(path)
+        self.params = dict(params)
+        self.entries: Dict[str, Dict] = {}
+        self._dirty = False
+        if self.path.exists():
+            try:
+                data = json.loads(self.path.read_text(encoding="utf-8"))
+                if data.get("version") == MANIFEST_VERSION:
+                    self.entries = data.get("files", {})
+            except (OSError, ValueError) as e:
+                print(f"[WARN] Manifest {self.path.name} unreadable ({e}) – full re-index.")
+
+    @staticmethod
+    def key(file_path: Path) -> str:
+        return str(file_path)
+
+    def entry(self, file_path: Path) -> Dict:
+        return self.entries.get(self.key(file_path), {})
+
+    def check(self, file_path: Path, extra: Optional[str] = None) -> Tuple[bool, str]:
+        """
+        Return (up_to_date, sha256).  The file is only hashed when size or
+        mtime differ from the manifest; a touched-but-identical file is
+        re-stamped and still counts as up to date.
+        """
+        st = file_path.stat()
+        entry = self.entry(file_path)
+        same_params = bool(entry) and entry.get("params") == self.params \
+            and entry.get("extra") == extra
+        if same_params and entry["size"] == st.st_size and entry["mtime"] == st.st_mtime_ns:
+            return True, entry["sha256"]
+
+        digest = file_digest(file_path)
+        if same_params and entry["sha256"] == digest:
+            entry["size"], entry["mtime"] = st.st_size, st.st_mtime_ns
+            self._dirty = True
+            return True, digest
+        return False, digest
+
+    def chunk_ids(self, file_path: Path) -> List[str]:
+        return list(self.entry(file_path).get("ids", []))
+
+    def record(self, file_path: Path, digest: str, ids: List[str],
+               doc_id: Optional[str] = None, extra: Optional[str] = None) -> None:
+        st = file_path.stat()
+        self.entries[self.key(file_path)] = {
+            "size"  : st.st_size,
+            "mtime" : st.st_mtime_ns,
+            "sha256": digest,
+            "params": self.params,
+            "doc_id": doc_id,
+            "extra" : extra,
+            "ids"   : list(ids),
+        }
+        self._dirty = True
+
+    def missing(self, present: Iterable[Path]) -> List[str]:
+        """Manifest keys whose files are no longer in `present`."""
+        keep = {self.key(p) for p in present}
+        return [k for k in self.entries if k not in keep]
+
+    def forget(self, key: str) -> List[str]:
+        """Drop an entry and return the chunk IDs it owned."""
+        self._dirty = True
+        return list(self.entries.pop(key, {}).get("ids", []))
+
+    def relocate(self, path: Path) -> None:
+        """Save to `path` from now on (a new index version), entries included."""
+        self.path = Path(path)
+        self._dirty = True
+
+    def save(self) -> None:
+        """Atomically rewrite the manifest (no-op if nothing changed)."""
+        if not self._dirty:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.path.parent, prefix=".manifest-")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"version": MANIFEST_VERSION, "files": self.entries}, f)
+        os.replace(tmp, self.path)
+        self._dirty = False
+
+
+def sync_file(collection, manifest: IndexManifest, file_path: Path,
+              digest: str, ids: List[str], doc_id: Optional[str] = None,
+              extra: Optional[str] = None, lexical=None) -> int:
+    """
+    Call after the new chunks of `file_path` have been upserted: deletes the
+    chunks the previous version produced that are not in `ids` (from the
+    collection and, if given, the lexical index) and records the new state.
+    Returns the number of stale chunks deleted.
+    """
+    stale = sorted(set(manifest.chunk_ids(file_path)) - set(ids))
+    if stale:
+        collection.delete(ids=stale)
+        if lexical is not None:
+            lexical.remove(stale)
+    manifest.record(file_path, digest, ids, doc_id=doc_id, extra=extra)
+    return len(stale)
+
+
+def remove_missing(collection, manifest: IndexManifest, present: Iterable[Path],
+                   lexical=None) -> int:
+    """Delete chunks of files that disappeared from the source tree."""
+    removed = 0
+    for key in manifest.missing(present):
+        stale = manifest.forget(key)
+        if stale:
+            collection.delete(ids=stale)
+            if lexical is not None:
+                lexical.remove(stale)
+        removed += 1
+    return removed
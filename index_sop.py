@@ -1,29 +1,47 @@
 """
 index_sops.py  –  Build / refresh the Company-SOP Chroma collection
 ------------------------------------------------------------------
-1. Extract text (PDF, DOCX, TXT)  – OCRs image-only PDFs
+1. Extract text (PDF, DOCX, TXT)  – OCRs PDF pages that have no text layer
+   (in parallel, cached by content hash in OCR_CACHE_DIR)
 2. Merge metadata from YAML (front-matter) + CSV sheet
 3. Chunk (overlapping) and embed with all-MiniLM-L6-v2
 4. Upsert into persistent Chroma collection "sop_vectors"
+   Incremental: a manifest (index_manifest.json inside CHROMA_PATH) lets
+   unchanged files be skipped; pass --rebuild for a clean rebuild.
+   Every run builds a new index version next to the live one, validates it
+   and flips CHROMA_PATH/CURRENT – the app keeps serving throughout
+   (see index_versions.py).
+   A BM25 index over the same chunk IDs is kept next to it for hybrid search.
    Each chunk receives:
        title       (canonical)   ✓
        sop_id      (canonical)   ✓
        department  (canonical)   ✓
-   plus legacy keys (sop_title, …) and chunk_idx, file_path
+   plus legacy keys (sop_title, …) and chunk_idx, char_start/char_end
+   (offsets into the extracted body, see chunking.py), file_path
+   Chunk IDs are "<sop_id>_<file key>_<chunk_idx>" – unique per source file
+   even when several files share a sop_id (see chunk_id_prefix).
+Steps 1–3 (minus embedding) run in a process pool; chunks from many files
+are packed into fixed-size batches for a single embed + upsert stage.
+torch, chromadb and the model are only loaded once the manifest shows there
+is something to index – a run with nothing new exits in well under a second.
 """
 
 from __future__ import annotations
-import os, re, csv, yaml, uuid, tempfile, shutil
+import os, csv, json, time, yaml, hashlib, argparse, tempfile
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 from pathlib import Path
 from typing import Dict, List, Tuple
 import pdfplumber 
 import docx
-import torch
 from tqdm import tqdm
-from sentence_transformers import SentenceTransformer
-import chromadb
-from chromadb.utils import embedding_functions as emb_f
-from gpu_embedding_function import GPUSentenceTransformerEmbeddingFunction
+from index_manifest import (IndexManifest, MANIFEST_NAME, sync_file, remove_missing,
+                            file_digest)
+from index_versions import active_version, new_version, promote, collect_garbage, root_lock
+from stage_timing import StageStats, STATS_NAME, timed
+from chunking import chunk_text, chunker_params
+from cluster_router import load_cluster_labels, CENTROIDS_NAME, CLUSTER_KEY, UNASSIGNED
+from lexical_index import BM25Index, lexical_index_path
+from vector_store import sync_matrix, matrix_dtype, DTYPES
 
 # ────────────────────────── CONFIG ────────────────────────── #
 SOURCE_DIR      = Path(os.getenv("SOURCE_DIR", "sop_documents"))  # configurable via env var
@@ -34,43 +52,100 @@ CHUNK_OVERLAP   = 20
 EMBED_MODEL     = "all-MiniLM-L6-v2"
 CHROMA_PATH     = Path(r".\chroma_sops")
 COLLECTION_NAME = "sop_vectors"
+# pipeline: extraction workers → bounded queue → one embed/upsert stage
+WORKERS          = int(os.getenv("INDEX_WORKERS", os.cpu_count() or 1))
+QUEUE_DEPTH      = int(os.getenv("INDEX_QUEUE_DEPTH", 2 * WORKERS))  # docs in flight
+EMBED_BATCH_SIZE = int(os.getenv("INDEX_BATCH_SIZE", 256))          # chunks per upsert
+# bump when every chunk needs new metadata: the next run re-indexes all files
+# 2: every chunk carries cluster_k (older chunks lack it and routed search,
+#    which filters on it, would never return them)
+# 3: chunk IDs include a key of the source file (2: "<sop_id>_<idx>" collided
+#    for files sharing a sop_id, e.g. SOP1_refunds / SOP1_refunds_appendix)
+METADATA_SCHEMA  = 3
+# memory-mapped export for rag's matrix backend (vector_store.py): int8 / float16 / "" = off
+MATRIX_DTYPE     = os.getenv("INDEX_MATRIX", "")
+# OCR: pages without a text layer only, cached by PDF content hash
+# pages OCR'd in parallel per PDF; 0 = CPU count / extraction workers, so that
+# WORKERS PDFs OCR'd at once never start more than ~one Tesseract per core
+OCR_JOBS         = int(os.getenv("OCR_JOBS", 0))
+OCR_CACHE_DIR    = Path(os.getenv("OCR_CACHE_DIR", SOURCE_DIR / "ocr_cache"))
 
-# Delete existing collection folder?  (uncomment for clean rebuild) 
-if CHROMA_PATH.exists(): shutil.rmtree(CHROMA_PATH)
 
 # ────────────────────── OCR helper (optional) ───────────────────── #
-def ocr_pdf_to_tmp(src_pdf: Path) -> Path | None:
-    """Force-OCR the PDF with ocrmypdf and return path to the OCR'd copy."""
+OCR_PARAMS = {"version": 1, "deskew": True}        # bump to invalidate cached OCR
+
+def ocr_jobs(workers: int) -> int:
+    """OCR_JOBS, or this process's share of the CPUs when extracting with `workers`."""
+    return OCR_JOBS if OCR_JOBS > 0 else max(1, (os.cpu_count() or 1) // max(1, workers))
+
+def ocr_pages(src_pdf: Path, pages: List[int], jobs: int | None = None) -> Dict[int, str] | None:
+    """
+    OCR only `pages` (1-based) of the PDF with ocrmypdf, `jobs` pages in
+    parallel (default ocr_jobs(1)), and return {page: text}.  Output goes to
+    a private temp dir.
+    """
     try:
         import ocrmypdf
     except ImportError:
         print("[ERROR] ocrmypdf not installed – skipping OCR.")
         return None
-    tmp_pdf = Path(tempfile.gettempdir()) / f"{src_pdf.stem}_ocr.pdf"
-    if tmp_pdf.exists():
-        tmp_pdf.unlink()
-    try:
-        ocrmypdf.ocr(
-            str(src_pdf), str(tmp_pdf),
-            force_ocr=True, deskew=True,
-            output_type="pdf", progress_bar=False
-        )
-        return tmp_pdf
-    except Exception as e:
-        print(f"[ERROR] OCR failed for {src_pdf.name}: {e}")
-        return None
+    with tempfile.TemporaryDirectory(prefix="sop-ocr-") as tmp:
+        out_pdf = Path(tmp) / "ocr.pdf"
+        try:
+            ocrmypdf.ocr(
+                str(src_pdf), str(out_pdf),
+                pages=",".join(map(str, pages)), jobs=jobs or ocr_jobs(1),
+                force_ocr=True, deskew=OCR_PARAMS["deskew"],
+                output_type="pdf", progress_bar=False
+            )
+            with pdfplumber.open(out_pdf) as pdf:
+                return {p: pdf.pages[p - 1].extract_text() or "" for p in pages}
+        except Exception as e:
+            print(f"[ERROR] OCR failed for {src_pdf.name}: {e}")
+            return None
+
+def ocr_pages_cached(src_pdf: Path, pages: List[int], digest: str | None = None,
+                     jobs: int | None = None) -> Dict[int, str]:
+    """
+    ocr_pages() behind an on-disk cache keyed by the PDF's SHA-256, so an
+    unchanged scan is never OCR'd twice (not even after --rebuild).  Pass
+    the manifest's `digest` to avoid hashing the file again.
+    """
+    cache_file = OCR_CACHE_DIR / f"{digest or file_digest(src_pdf)}.json"
+    if cache_file.exists():
+        try:
+            data = json.loads(cache_file.read_text(encoding="utf-8"))
+            cached = {int(p): t for p, t in data["pages"].items()}
+            if data.get("params") == OCR_PARAMS and all(p in cached for p in pages):
+                return cached
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[WARN] OCR cache {cache_file.name} unreadable ({e}) – re-running OCR.")
+
+    print(f"[INFO] {src_pdf.name}: {len(pages)} page(s) without text – running OCR …")
+    result = ocr_pages(src_pdf, pages, jobs)
+    if result is None:
+        return {}
+    OCR_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=OCR_CACHE_DIR, prefix=".ocr-")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump({"params": OCR_PARAMS, "file": src_pdf.name,
+                   "pages": {str(p): t for p, t in result.items()}}, f)
+    os.replace(tmp, cache_file)
+    return result
 
 # ────────────────────────── Extraction ────────────────────────── #
-def _extract_pdf(path: Path) -> str:
-    def _plumber(p: Path) -> str:
-        with pdfplumber.open(p) as pdf:
-            return "\n".join(page.extract_text() or "" for page in pdf.pages)
-    text = _plumber(path).strip()
-    if text:
-        return text
-    print(f"[INFO] {path.name}: no text – running OCR …")
-    ocr_path = ocr_pdf_to_tmp(path)
-    return _plumber(ocr_path).strip() if ocr_path else ""
+def _extract_pdf(path: Path, timings: Dict[str, float], digest: str | None = None) -> str:
+    with pdfplumber.open(path) as pdf:
+        texts = [page.extract_text() or "" for page in pdf.pages]
+    blank = [i + 1 for i, t in enumerate(texts) if not t.strip()]
+    if blank:                                  # scanned pages only, not the whole file
+        with timed(timings, "ocr"):
+            ocr_text = ocr_pages_cached(path, blank, digest, _WORKER_OCR_JOBS)
+        timings["ocr_pages"] = len(blank)
+        for page_no, text in ocr_text.items():
+            if page_no <= len(texts):
+                texts[page_no - 1] = text
+    return "\n".join(texts).strip()
 
 def _extract_docx(path: Path) -> str:
     try:
@@ -79,9 +154,14 @@ def _extract_docx(path: Path) -> str:
         print(f"[WARN] DOCX read error {path.name}: {e}")
         return ""
 
-def extract_text(path: Path) -> str:
+def extract_text(path: Path, timings: Dict[str, float] | None = None,
+                 digest: str | None = None) -> str:
+    """
+    Plain text of one document; OCR seconds / pages go to `timings` if given.
+    `digest` (the file's SHA-256, if already known) keys the OCR cache.
+    """
     ext = path.suffix.lower()
-    if ext == ".pdf":  return _extract_pdf(path)
+    if ext == ".pdf":  return _extract_pdf(path, {} if timings is None else timings, digest)
     if ext == ".docx": return _extract_docx(path)
     if ext == ".txt":
         try:            return path.read_text(encoding="utf-8")
@@ -107,77 +187,330 @@ def csv_meta_table(csv_path: Path) -> Dict[str, Dict]:
     with csv_path.open(encoding="utf-8", newline="") as f:
         return {row["sop_id"]: row for row in csv.DictReader(f)}
 
-# ────────────────────────── Chunking ─────────────────────────── #
-def chunk_words(words: List[str], size: int, overlap: int) -> List[List[str]]:
-    step = size - overlap
-    return [words[i:i+size] for i in range(0, max(len(words)-overlap, 0), step)]
+def chunk_id_prefix(sop_id: str, file_path: Path) -> str:
+    """
+    '<sop_id>_<8 hex chars of the path under SOURCE_DIR>': chunk IDs of two
+    files never collide, even if their sop_id (front-matter or name prefix)
+    is the same.
+    """
+    try:
+        rel = file_path.relative_to(SOURCE_DIR).as_posix()
+    except ValueError:                           # not under SOURCE_DIR
+        rel = file_path.as_posix()
+    return f"{sop_id}_{hashlib.sha1(rel.encode('utf-8')).hexdigest()[:8]}"
+
+def _csv_signature(csv_meta: Dict[str, Dict], sop_id) -> str | None:
+    """Stable fingerprint of the CSV row for `sop_id` (re-index on edits)."""
+    row = csv_meta.get(str(sop_id)) if sop_id is not None else None
+    return json.dumps(row, sort_keys=True) if row else None
+
+# ────────────────── Extraction stage (worker) ─────────────────── #
+_WORKER_CSV_META: Dict[str, Dict] = {}
+_WORKER_OCR_JOBS: int | None = None              # None = ocr_jobs(1)
+
+def _init_worker(csv_meta: Dict[str, Dict], ocr_jobs: int | None = None) -> None:
+    global _WORKER_CSV_META, _WORKER_OCR_JOBS
+    _WORKER_CSV_META = csv_meta
+    _WORKER_OCR_JOBS = ocr_jobs
+
+def prepare_document(file_path: Path, digest: str | None = None) -> Dict:
+    """
+    Extract → front-matter/CSV metadata → chunk one file.  Runs in a pool
+    worker; returns plain data so it pickles back cheaply.  `digest` is the
+    manifest's SHA-256 of the file (reused as the OCR cache key).
+    """
+    csv_meta = _WORKER_CSV_META
+    doc: Dict = {"file_path": file_path, "sop_id": None, "chunks": [], "meta": {}}
+
+    timings: Dict[str, float] = {}
+    t0 = time.perf_counter()
+    raw_text = extract_text(file_path, timings, digest)
+    t1 = time.perf_counter()
+    # OCR is reported as its own stage, not as part of extract
+    doc["timings"] = {"extract": t1 - t0 - timings.get("ocr", 0.0)}
+    if "ocr" in timings:
+        doc["timings"]["ocr"] = timings["ocr"]
+        doc["ocr_pages"] = timings["ocr_pages"]
+    if not raw_text.strip():
+        print(f"[WARN] {file_path.name}: empty – skipped.")
+        return doc
+
+    fm, body = frontmatter(raw_text)
+    sop_id = fm.get("sop_id") or file_path.stem.split("_")[0]
+
+    meta: Dict = {**csv_meta.get(str(sop_id), {}), **fm}
+    meta.setdefault("sop_id", sop_id)
+
+    title = (meta.get("title") or meta.get("sop_title") or
+             meta.get("sop_name") or meta.get("name") or file_path.stem)
+    meta["title"]     = title
+    meta["sop_title"] = title        # legacy key
+    meta.setdefault("department",
+                    csv_meta.get(str(sop_id), {}).get("department", "Unknown"))
+
+    (TEXT_DIR / f"{file_path.stem}.txt").write_text(body, encoding="utf-8")
+
+    # offsets are into `body` (= the audit copy in TEXT_DIR)
+    spans, chunks = [], []
+    for start, end, text in chunk_text(body, CHUNK_SIZE, CHUNK_OVERLAP,
+                                       model_name=EMBED_MODEL):
+        spans.append((start, end))
+        chunks.append(text)
+    if not chunks:
+        print(f"[WARN] {file_path.name}: produced 0 chunks – skipped.")
+    doc.update(sop_id=str(sop_id), meta=meta, chunks=chunks, spans=spans)
+    doc["timings"]["chunk"] = time.perf_counter() - t1
+    return doc
+
+def _prepared_documents(files: List[Tuple[Path, str]], csv_meta: Dict[str, Dict],
+                        workers: int, queue_depth: int):
+    """Yield prepare_document() results for (path, digest) pairs as they
+    complete, at most `queue_depth` documents in flight (bounds memory when
+    embedding lags).  The CPUs are split between workers for OCR."""
+    if workers <= 1:
+        _init_worker(csv_meta, ocr_jobs(1))
+        yield from (prepare_document(fp, digest) for fp, digest in files)
+        return
+    pending_files = iter(files)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(csv_meta, ocr_jobs(workers))) as pool:
+        in_flight = set()
+        while True:
+            while len(in_flight) < queue_depth:
+                nxt = next(pending_files, None)
+                if nxt is None:
+                    break
+                in_flight.add(pool.submit(prepare_document, *nxt))
+            if not in_flight:
+                return
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for fut in done:
+                yield fut.result()
+
+# ────────────────── Embedding stage (main process) ─────────────────── #
+class EmbedStage:
+    """
+    Packs chunks from many documents into fixed-size batches, embeds each
+    batch in one call and upserts it.  A document is committed to the
+    manifest (stale chunks deleted) once all of its chunks are written.
+    """
+
+    def __init__(self, collection, emb_fn, batch_size: int,
+                 stats: StageStats, on_doc_done, lexical: BM25Index | None = None):
+        self.collection  = collection
+        self.lexical     = lexical
+        self.emb_fn      = emb_fn
+        self.batch_size  = max(1, batch_size)
+        self.stats       = stats
+        self.on_doc_done = on_doc_done
+        self._buf: List[Tuple[str, str, Dict, str]] = []   # (id, text, meta, doc_key)
+        self._remaining: Dict[str, int] = {}
+        self._buffered_ids: set = set()
+
+    def add(self, doc_key: str, ids: List[str], texts: List[str],
+            metadatas: List[Dict]) -> None:
+        if self._buffered_ids.intersection(ids):     # same file twice: keep last write
+            self.close()
+        self._remaining[doc_key] = self._remaining.get(doc_key, 0) + len(ids)
+        self._buffered_ids.update(ids)
+        self._buf.extend((i, t, m, doc_key) for i, t, m in zip(ids, texts, metadatas))
+        while len(self._buf) >= self.batch_size:
+            self._flush(self.batch_size)
+
+    def close(self) -> None:
+        while self._buf:
+            self._flush(self.batch_size)
+
+    def _flush(self, n: int) -> None:
+        batch, self._buf = self._buf[:n], self._buf[n:]
+        ids, texts, metas, keys = map(list, zip(*batch))
+        self._buffered_ids.difference_update(ids)
+        with self.stats.time("embed", items=len(batch)):
+            embeddings = self.emb_fn(texts)
+        with self.stats.time("upsert", items=len(batch)):
+            self.collection.upsert(ids=ids, embeddings=embeddings,
+                                   documents=texts, metadatas=metas)
+        if self.lexical is not None:
+            with self.stats.time("lexical", items=len(batch)):
+                self.lexical.add(ids, texts)
+        for key in keys:
+            self._remaining[key] -= 1
+            if self._remaining[key] == 0:
+                del self._remaining[key]
+                self.on_doc_done(key)
 
 # ───────────────── MAIN ─────────────────
-def main() -> None:
+def parse_args(argv=None) -> argparse.Namespace:
+    ap = argparse.ArgumentParser(description="Build / refresh the SOP Chroma collection")
+    ap.add_argument("--rebuild", action="store_true",
+                    help="re-index every file into a fresh version (the live one keeps serving)")
+    ap.add_argument("--matrix", choices=[*DTYPES, "off"], default=MATRIX_DTYPE or "off",
+                    help="also export a memory-mapped matrix for rag's matrix backend")
+    ap.add_argument("--workers", type=int, default=WORKERS,
+                    help="extraction processes (<=1 runs inline)")
+    ap.add_argument("--queue-depth", type=int, default=QUEUE_DEPTH,
+                    help="max documents extracted but not yet embedded")
+    ap.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE,
+                    help="chunks per embedding/upsert batch")
+    return ap.parse_args(argv)
+
+def main(rebuild: bool = False, workers: int = WORKERS,
+         queue_depth: int = QUEUE_DEPTH, batch_size: int = EMBED_BATCH_SIZE,
+         matrix: str | None = MATRIX_DTYPE) -> None:
+    if matrix and matrix not in DTYPES:
+        raise SystemExit(f"[ERROR] INDEX_MATRIX must be one of {', '.join(DTYPES)}, "
+                         f"not {matrix!r}")
+    with root_lock(CHROMA_PATH):                 # one build per index root at a time
+        _index(rebuild, workers, queue_depth, batch_size, matrix)
+
+def _index(rebuild: bool, workers: int, queue_depth: int, batch_size: int,
+           matrix: str | None) -> None:
+    wall0 = time.perf_counter()
     TEXT_DIR.mkdir(exist_ok=True)
 
     csv_meta = csv_meta_table(CSV_META_PATH)
-    DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
-    print(f"[INDEX] Using device: {DEVICE}")
-    client = chromadb.PersistentClient(path=str(CHROMA_PATH))
-    collection = client.get_or_create_collection(
-        COLLECTION_NAME,
-        embedding_function=GPUSentenceTransformerEmbeddingFunction(
-            model_name=EMBED_MODEL,
-            device=DEVICE
-        )
-    )
-
+    live = active_version(CHROMA_PATH)
+    version = None
+    if rebuild:                                  # start empty: every file is "new"
+        collect_garbage(CHROMA_PATH)
+        version = new_version(CHROMA_PATH)
+        print(f"[INDEX] --rebuild: building {version.name} from scratch")
+    manifest = IndexManifest((version or live) / MANIFEST_NAME, {
+        "chunk_size"   : CHUNK_SIZE,
+        "chunk_overlap": CHUNK_OVERLAP,
+        "chunker"      : chunker_params(),
+        "embed_model"  : EMBED_MODEL,
+        "metadata"     : METADATA_SCHEMA,
+    })
     files = [p for p in SOURCE_DIR.iterdir()
              if p.is_file() and p.suffix.lower() in (".pdf", ".docx", ".txt")]
 
-    for file_path in tqdm(files, desc="Vectorising SOPs"):
-        raw_text = extract_text(file_path)
-        if not raw_text.strip():
-            print(f"[WARN] {file_path.name}: empty – skipped.")
-            continue
+    todo: Dict[str, Tuple[Path, str]] = {}
+    for file_path in files:
+        sig = _csv_signature(csv_meta, manifest.entry(file_path).get("doc_id"))
+        fresh, digest = manifest.check(file_path, extra=sig)
+        if not fresh:
+            todo[manifest.key(file_path)] = (file_path, digest)
+    if version is None:
+        if not todo and not manifest.missing(files) and \
+                lexical_index_path(live, COLLECTION_NAME).exists() and \
+                matrix_dtype(live, COLLECTION_NAME) == (matrix or None):
+            manifest.save()                      # keep re-stamped mtimes
+            print(f"[INDEX] {len(files)} unchanged – nothing to do.")
+            return
+        # never write into the live version: update a copy, flip when done
+        collect_garbage(CHROMA_PATH)             # leftovers of interrupted runs
+        version = new_version(CHROMA_PATH, copy_from=live, share=True)
+        manifest.relocate(version / MANIFEST_NAME)
+        print(f"[INDEX] Building {version.name} from {live.name}")
+    lexical_path = lexical_index_path(version, COLLECTION_NAME)
+
+    # only now pay for torch, chromadb and the model
+    import chromadb
+    from gpu_embedding_function import GPUSentenceTransformerEmbeddingFunction, default_device
+    device = default_device()
+    print(f"[INDEX] Using device: {device}")
+    emb_fn = GPUSentenceTransformerEmbeddingFunction(
+        model_name=EMBED_MODEL,
+        device=device
+    )
+    client = chromadb.PersistentClient(path=str(version))
+    collection = client.get_or_create_collection(
+        COLLECTION_NAME,
+        embedding_function=emb_fn
+    )
 
-        fm, body = frontmatter(raw_text)
-        sop_id = fm.get("sop_id") or file_path.stem.split("_")[0]
+    lexical = BM25Index.open_for_update(lexical_path, collection)
+    # keep known cluster labels on re-indexed SOPs; new ones stay UNASSIGNED
+    # (always searched by routed retrieval) until sop_clustering.py --assign-new
+    cluster_labels = load_cluster_labels(version / CENTROIDS_NAME)
 
-        meta: Dict = {**csv_meta.get(str(sop_id), {}), **fm}
-        meta.setdefault("sop_id", sop_id)
+    removed = remove_missing(collection, manifest, files, lexical=lexical)
+    print(f"[INDEX] {len(todo)} new/changed, {len(files) - len(todo)} unchanged, "
+          f"{removed} removed")
 
-        title = (meta.get("title") or meta.get("sop_title") or
-                 meta.get("sop_name") or meta.get("name") or file_path.stem)
-        meta["title"]     = title
-        meta["sop_title"] = title        # legacy key
-        meta.setdefault("department",
-                        csv_meta.get(str(sop_id), {}).get("department", "Unknown"))
+    # chunk ID → file that owns it; IDs are per file, so a clash means two
+    # files would overwrite each other's chunks – never allowed
+    id_owners = {cid: k for k, e in manifest.entries.items() for cid in e.get("ids", [])}
+    # sop_id → first file using it (several files may share one, e.g. appendices)
+    sop_files = {e.get("doc_id"): k for k, e in manifest.entries.items() if e.get("doc_id")}
+    committed: Dict[str, Tuple[List[str], str]] = {}   # doc_key → (ids, sop_id)
 
-        (TEXT_DIR / f"{file_path.stem}.txt").write_text(body, encoding="utf-8")
+    def commit(doc_key: str) -> None:
+        file_path, digest = todo[doc_key]
+        ids, sop_id = committed.pop(doc_key, ([], None))
+        sync_file(collection, manifest, file_path, digest, ids, doc_id=sop_id,
+                  extra=_csv_signature(csv_meta, sop_id), lexical=lexical)
 
-        words = re.findall(r"\S+", body)
-        if not words:
-            print(f"[WARN] {file_path.name}: 0 words – skipped.")
-            continue
+    stats = StageStats(units={"extract": "files", "ocr": "pages", "chunk": "files",
+                              "embed": "chunks", "upsert": "chunks",
+                              "lexical": "chunks", "matrix": "chunks"})
+    embed_stage = EmbedStage(collection, emb_fn, batch_size, stats, commit, lexical)
+    try:
+        docs = _prepared_documents(list(todo.values()), csv_meta,
+                                   workers, max(1, queue_depth))
+        for doc in tqdm(docs, total=len(todo), desc="Vectorising SOPs"):
+            for stage, secs in doc["timings"].items():
+                stats.add(stage, secs, items=doc["ocr_pages"] if stage == "ocr" else 1)
+            file_path, chunk_texts = doc["file_path"], doc["chunks"]
+            doc_key = manifest.key(file_path)
+            if not chunk_texts:
+                commit(doc_key)
+                continue
 
-        word_chunks = chunk_words(words, CHUNK_SIZE, CHUNK_OVERLAP)
-        if not word_chunks:                          # <── NEW guard
-            print(f"[WARN] {file_path.name}: produced 0 chunks – skipped.")
-            continue
+            sop_id = doc["sop_id"]
+            other = sop_files.setdefault(sop_id, doc_key)
+            if other != doc_key:
+                print(f"[INFO] {file_path.name}: shares sop_id '{sop_id}' with "
+                      f"{Path(other).name} (clustered as one SOP).")
 
-        chunk_texts = [" ".join(c) for c in word_chunks]
+            # ----- build per-chunk metadata
+            metadatas = [{
+                **doc["meta"],
+                "chunk_idx" : idx,
+                "char_start": start,
+                "char_end"  : end,
+                CLUSTER_KEY : cluster_labels.get(sop_id, UNASSIGNED),
+                "file_path" : str(file_path)
+            } for idx, (start, end) in enumerate(doc["spans"])]
 
-        # ----- build per-chunk metadata
-        metadatas = [{
-            **meta,
-            "chunk_idx": idx,
-            "file_path": str(file_path)
-        } for idx in range(len(chunk_texts))]
+            # deterministic IDs → upsert replaces the previous version in place
+            prefix = chunk_id_prefix(sop_id, file_path)
+            ids = [f"{prefix}_{idx}" for idx in range(len(chunk_texts))]
+            clash = next((cid for cid in ids if id_owners.get(cid, doc_key) != doc_key), None)
+            if clash is not None:
+                raise SystemExit(f"[ERROR] {file_path.name}: chunk ID '{clash}' already belongs "
+                                 f"to {Path(id_owners[clash]).name} – refusing to overwrite "
+                                 f"it; live index unchanged.")
+            id_owners.update((cid, doc_key) for cid in ids)
+            committed[doc_key] = (ids, sop_id)
+            embed_stage.add(doc_key, ids, chunk_texts, metadatas)
+        embed_stage.close()
+    finally:
+        manifest.save()
+        lexical.save(lexical_path)
 
-        collection.upsert(                         # <── embeddings removed
-            ids       =[f"{sop_id}_{idx}_{uuid.uuid4()}" for idx in range(len(chunk_texts))],
-            documents =chunk_texts,
-            metadatas =metadatas
-        )
+    if matrix:
+        with stats.time("matrix", collection.count()):
+            sync_matrix(collection, version, COLLECTION_NAME, matrix)
+    else:                                        # drop a copy inherited from the live version
+        sync_matrix(collection, version, COLLECTION_NAME, None)
 
     print(f"✓ Indexed {collection.count()} chunks into '{COLLECTION_NAME}'.")
+    wall = time.perf_counter() - wall0
+    print(stats.report(wall))
+    stats.save(version / STATS_NAME, wall)
+    promote(CHROMA_PATH, version, collection, manifest, lexical)
+    if emb_fn.cache is not None:
+        c = emb_fn.cache.stats()
+        print(f"[STATS] embedding cache: {c['hits']} hits, {c['misses']} misses, "
+              f"{c['entries']} entries")
+
+def cli(argv=None) -> None:
+    args = parse_args(argv)
+    main(rebuild=args.rebuild, workers=args.workers,
+         queue_depth=args.queue_depth, batch_size=args.batch_size,
+         matrix=None if args.matrix == "off" else args.matrix)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    cli()
@@ -0,0 +1,259 @@
+"""
+index_versions.py  –  Versioned index directories behind an atomic pointer
+------------------------------------------------------------------
+An index root (CHROMA_PATH, e.g. chroma_sops/) keeps complete index
+versions side by side plus a pointer file naming the live one:
+
+    chroma_sops/
+        CURRENT                           "20261017-142501-118022"
+        versions/20261017-142501-118022/  chroma.sqlite3, index_manifest.json, bm25_*.json.gz,
+                                          matrix_*/ (vector_store.py), …
+        versions/20261016-090012-540317/  previous version (kept for lagging readers)
+
+The indexers (and sop_clustering.py) never touch the live version: they
+build a shadow version (empty for --rebuild, otherwise a copy of the live
+one), validate it and only then replace CURRENT – os.replace, atomic on
+POSIX and Windows.  An incremental copy hard-links the files this project
+only ever replaces (manifest, BM25 index, matrix export, centroids) and
+clones Chroma's, which are edited in place – copy-on-write where the
+filesystem can (btrfs, XFS), a plain copy elsewhere.  A build holds root_lock() (<root>/.lock) throughout,
+so a second run waits instead of garbage-collecting its shadow version.
+rag.py polls the pointer and swaps its cached collection while requests
+already running finish on the old one.  Versions beyond KEEP_VERSIONS are
+garbage-collected after each publish.
+
+A root without CURRENT is a legacy single-directory index and is served as
+is; the first versioned build copies it and the next collections remove it.
+"""
+
+from __future__ import annotations
+import os, sys, time, shutil, tempfile
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, List
+
+from vector_store import MatrixStore
+
+POINTER_NAME  = "CURRENT"
+VERSIONS_DIR  = "versions"
+LOCK_NAME     = ".lock"
+LOCK_POLL_S   = 1.0                                        # Windows: retry interval
+KEEP_VERSIONS = int(os.getenv("INDEX_KEEP_VERSIONS", 2))   # live + previous
+# top-level entries whose files are only ever replaced (temp file + os.replace),
+# never rewritten, so versions can share them: index_manifest.py, lexical_index.py,
+# vector_store.py, cluster_router.py
+SHAREABLE = ("index_manifest.json", "bm25_", "matrix_", "cluster_centroids.npz")
+_FICLONE  = 0x40049409                                      # Linux reflink ioctl
+
+
+def active_version(root: str | Path) -> Path:
+    """Directory of the live index under `root` (root itself for a legacy index)."""
+    root = Path(root)
+    try:
+        name = (root / POINTER_NAME).read_text(encoding="utf-8").strip()
+    except OSError:
+        return root
+    return root / VERSIONS_DIR / name if name else root
+
+def _lock_file(f, wait: bool) -> bool:
+    """Exclusive OS lock on open file `f`; False if busy and not `wait`."""
+    if os.name == "nt":
+        import msvcrt
+        while True:
+            try:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+                return True
+            except OSError:
+                if not wait:
+                    return False
+                time.sleep(LOCK_POLL_S)
+    import fcntl
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | (0 if wait else fcntl.LOCK_NB))
+        return True
+    except BlockingIOError:
+        return False
+
+def _unlock_file(f) -> None:
+    if os.name == "nt":
+        import msvcrt
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        import fcntl
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+@contextmanager
+def root_lock(root: str | Path) -> Iterator[None]:
+    """
+    Hold the exclusive build lock of `root` (waiting for another holder).
+    Everything that creates, publishes or collects versions runs under it;
+    the OS drops the lock if the process dies, so no stale lock is left.
+    """
+    root = Path(root)
+    root.mkdir(parents=True, exist_ok=True)
+    with open(root / LOCK_NAME, "a+b") as f:
+        if not _lock_file(f, wait=False):
+            print(f"[INDEX] {root} is being built by another run – waiting for it …")
+            _lock_file(f, wait=True)
+        try:
+            yield
+        finally:
+            _unlock_file(f)
+
+def _root_entry(name: str) -> bool:
+    """CURRENT, versions/ and dotfiles (.lock, build state) belong to the root, not an index."""
+    return name in (POINTER_NAME, VERSIONS_DIR) or name.startswith(".")
+
+def _legacy_entries(root: Path) -> List[Path]:
+    """Top-level files of a pre-versioning index (everything but the root's own entries)."""
+    if not root.is_dir():
+        return []
+    return [p for p in root.iterdir() if not _root_entry(p.name)]
+
+def _clone_file(src: str, dst: str) -> str:
+    """Copy `src` to `dst` – a copy-on-write clone if the filesystem supports one."""
+    if sys.platform.startswith("linux"):
+        import fcntl
+        try:
+            with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+                fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+            shutil.copystat(src, dst)
+            return dst
+        except OSError:
+            pass                                 # ext4, tmpfs, other devices, …
+    return shutil.copy2(src, dst)
+
+def new_version(root: str | Path, copy_from: Path | None = None,
+                share: bool = False) -> Path:
+    """
+    Create a shadow version directory: a copy of `copy_from` (incremental
+    runs) or empty (rebuilds).  With `share`, SHAREABLE files are hard-linked
+    instead of copied (POSIX; Windows cannot delete a link whose file a reader
+    has open).  Names sort by creation time.
+    """
+    root = Path(root)
+    now = time.time()
+    name = f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(now))}-{int(now * 1e6) % 10**6:06d}"
+    path = root / VERSIONS_DIR / name
+    if copy_from is not None and copy_from.is_dir():
+        legacy = copy_from == root
+        share = share and os.name != "nt"
+
+        def copy(src: str, dst: str) -> str:
+            top = Path(src).relative_to(copy_from).parts[0]
+            if share and top.startswith(SHAREABLE):
+                try:
+                    os.link(src, dst)
+                    return dst
+                except OSError:
+                    pass
+            return _clone_file(src, dst)
+
+        shutil.copytree(copy_from, path, copy_function=copy, ignore=lambda d, names:
+                        [n for n in names if legacy and Path(d) == root
+                         and _root_entry(n)])
+    else:
+        path.mkdir(parents=True)
+    return path
+
+def validate(collection, manifest=None, lexical=None, matrix=None,
+             by_text: bool = True) -> List[str]:
+    """
+    Problems that make a freshly built version unfit to go live (empty list
+    = fine): chunk counts must match the manifest (if given), the lexical
+    index and the matrix export, and a smoke query with a stored chunk's
+    text (its vector, for the matrix or without `by_text`) must find that
+    chunk again.  by_text=False suits callers without the embedding model.
+    """
+    problems = []
+    count = collection.count()
+    if manifest is not None:
+        expected = len({cid for e in manifest.entries.values() for cid in e.get("ids", [])})
+        if count != expected:
+            problems.append(f"collection holds {count} chunks, manifest lists {expected}")
+    if lexical is not None and len(lexical) != count:
+        problems.append(f"lexical index holds {len(lexical)} chunks, collection {count}")
+    if matrix is not None and matrix.count() != count:
+        problems.append(f"matrix export holds {matrix.count()} chunks, collection {count}")
+    if count:
+        sample = collection.get(limit=1, include=["documents", "embeddings"])
+        query = {"query_texts": sample["documents"]} if by_text else \
+            {"query_embeddings": sample["embeddings"]}
+        hit = collection.query(**query, n_results=1, include=["distances"])
+        if not hit["ids"][0] or hit["distances"][0][0] > 1e-2:
+            problems.append("smoke query did not find a stored chunk by its own "
+                            + ("text" if by_text else "vector"))
+        if matrix is not None and matrix.count():
+            hit = matrix.query(query_embeddings=sample["embeddings"], n_results=1,
+                               include=["distances"])
+            if not hit["ids"][0] or hit["distances"][0][0] > 1e-2:
+                problems.append("matrix smoke query did not find a stored chunk")
+    return problems
+
+def publish(root: str | Path, version: Path) -> None:
+    """Point CURRENT at `version` (atomic replace; readers see old or new, never neither)."""
+    root = Path(root)
+    fd, tmp = tempfile.mkstemp(dir=root, prefix=".current-")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(version.name)
+    os.replace(tmp, root / POINTER_NAME)
+    print(f"[INDEX] Live version is now {version.name}")
+
+def discard(version: Path) -> None:
+    """Remove a shadow version that failed to build or validate."""
+    shutil.rmtree(version, ignore_errors=True)
+
+def promote(root: str | Path, version: Path, collection, manifest=None,
+            lexical=None, by_text: bool = True) -> None:
+    """Make a finished version live if it validates; otherwise drop it and exit."""
+    try:
+        matrix = MatrixStore.open(version, collection.name)
+    except (OSError, ValueError, KeyError) as e:
+        problems = [f"matrix export unreadable ({e})"]
+    else:
+        problems = validate(collection, manifest, lexical, matrix, by_text)
+        if matrix is not None:
+            matrix.close()
+    if problems:
+        for problem in problems:
+            print(f"[ERROR] {version.name}: {problem}")
+        discard(version)
+        raise SystemExit(f"[INDEX] {version.name} failed validation – live index unchanged.")
+    publish(root, version)
+    collect_garbage(root)
+
+def collect_garbage(root: str | Path, keep: int = KEEP_VERSIONS) -> List[str]:
+    """
+    Delete everything but the live version and the `keep - 1` versions
+    before it (a migrated legacy index counts as the oldest).  Versions
+    newer than the live one are leftovers of interrupted builds – call this
+    only under root_lock(), which no build in progress lets go of.  Files
+    still open elsewhere (Windows) are reported and retried next time.
+    Returns the names removed.
+    """
+    root = Path(root)
+    live = active_version(root)
+    if live == root:
+        return []
+    versions = root / VERSIONS_DIR
+    older = sorted((p for p in versions.iterdir() if p.is_dir() and p.name < live.name),
+                   reverse=True)
+    doomed = [p for p in versions.iterdir() if p.is_dir() and p.name > live.name]
+    doomed += older[max(0, keep - 1):]
+    if len(older) >= max(0, keep - 1):
+        doomed += _legacy_entries(root)
+    removed = []
+    for path in doomed:
+        try:
+            if path.is_dir():
+                shutil.rmtree(path)
+            else:
+                path.unlink()
+            removed.append(path.name)
+        except OSError as e:
+            print(f"[WARN] Could not remove old index {path.name} ({e}) – retrying next run.")
+    if removed:
+        print(f"[INDEX] Removed {len(removed)} old index version(s)/file(s)")
+    return removed
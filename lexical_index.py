@@ -0,0 +1,205 @@
+"""
+lexical_index.py  –  Compact BM25 inverted index over Chroma chunk IDs
+------------------------------------------------------------------
+Complements vector search for exact tokens (SOP IDs, CDT codes such as
+D0120, form names).  The indexers keep it in step with the collection and
+persist it next to the Chroma files as  bm25_<collection>.json.gz ;
+rag.py loads it once per process and fuses its ranking with the vector
+ranking (reciprocal rank fusion).
+
+Documents are numbered internally; postings are  term → {doc_no: tf}.
+Removal needs a forward index (doc_no → terms), which is only built when
+something is actually removed (i.e. by the indexers, never by rag).
+"""
+
+from __future__ import annotations
+import os, re, gzip, json, math, tempfile
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+INDEX_VERSION = 1
+_TOKEN = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+
+
+def lexical_index_path(persist_dir: str | Path, collection: str) -> Path:
+    return Path(persist_dir) / f"bm25_{collection}.json.gz"
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-cased alphanumeric tokens; compounds like 'SOP-123' also yield their parts."""
+    out = []
+    for tok in _TOKEN.findall(text.lower()):
+        out.append(tok)
+        if not tok.isalnum():
+            out.extend(p for p in re.split(r"[-_./]", tok) if p)
+    return out
+
+
+class BM25Index:
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1, self.b = k1, b
+        self.ids: List[Optional[str]] = []          # doc_no → chunk id (None = removed)
+        self.doc_len: List[int] = []
+        self.postings: Dict[str, Dict[int, int]] = {}
+        self._no: Dict[str, int] = {}
+        self._forward: Optional[Dict[int, List[str]]] = None
+        self._term_arrays: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self._len_array: Optional[np.ndarray] = None
+        self._total_len = 0
+        self._dirty = False
+
+    def __len__(self) -> int:
+        return len(self._no)
+
+    # ───────────── mutation (indexers) ─────────────
+    def add(self, ids: Sequence[str], texts: Sequence[str]) -> None:
+        """Add (or replace) chunks."""
+        self.remove([i for i in ids if i in self._no])
+        for cid, text in zip(ids, texts):
+            tf = Counter(tokenize(text))
+            no = len(self.ids)
+            self.ids.append(cid)
+            self._no[cid] = no
+            length = sum(tf.values())
+            self.doc_len.append(length)
+            self._total_len += length
+            for term, count in tf.items():
+                self.postings.setdefault(term, {})[no] = count
+            if self._forward is not None:
+                self._forward[no] = list(tf)
+        self._invalidate()
+
+    def remove(self, ids: Iterable[str]) -> None:
+        nos = [self._no.pop(i) for i in ids if i in self._no]
+        if not nos:
+            return
+        forward = self._forward_index()
+        for no in nos:
+            for term in forward.pop(no, ()):
+                plist = self.postings.get(term)
+                if plist is not None:
+                    plist.pop(no, None)
+                    if not plist:
+                        del self.postings[term]
+            self._total_len -= self.doc_len[no]
+            self.ids[no] = None
+            self.doc_len[no] = 0
+        self._invalidate()
+
+    def _forward_index(self) -> Dict[int, List[str]]:
+        if self._forward is None:
+            forward: Dict[int, List[str]] = defaultdict(list)
+            for term, plist in self.postings.items():
+                for no in plist:
+                    forward[no].append(term)
+            self._forward = dict(forward)
+        return self._forward
+
+    def _invalidate(self) -> None:
+        self._dirty = True
+        self._term_arrays.clear()
+        self._len_array = None
+
+    # ───────────── query (rag) ─────────────
+    def search(self, query: str, k: int) -> List[Tuple[str, float]]:
+        """Top-k (chunk_id, bm25 score), best first."""
+        n = len(self._no)
+        terms = set(tokenize(query))
+        if not n or not terms or k <= 0:
+            return []
+        if self._len_array is None:
+            self._len_array = np.asarray(self.doc_len, dtype=np.float32)
+        avgdl = max(self._total_len / n, 1e-9)
+        norm = self.k1 * (1 - self.b + self.b * self._len_array / avgdl)
+
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        for term in terms:
+            arrays = self._arrays_for(term)
+            if arrays is None:
+                continue
+            docs, tfs = arrays
+            df = len(docs)
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            scores[docs] += idf * tfs * (self.k1 + 1) / (tfs + norm[docs])
+
+        k = min(k, int(np.count_nonzero(scores)))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.ids[i], float(scores[i])) for i in top]
+
+    def _arrays_for(self, term: str):
+        arrays = self._term_arrays.get(term)
+        if arrays is None:
+            plist = self.postings.get(term)
+            if not plist:
+                return None
+            arrays = (np.fromiter(plist.keys(), dtype=np.int64, count=len(plist)),
+                      np.fromiter(plist.values(), dtype=np.float32, count=len(plist)))
+            self._term_arrays[term] = arrays
+        return arrays
+
+    # ───────────── persistence ─────────────
+    def save(self, path: str | Path) -> None:
+        """Write a compacted copy (removed docs dropped, doc numbers dense)."""
+        path = Path(path)
+        if not self._dirty and path.exists():
+            return
+        remap, ids, lens = {}, [], []
+        for no, cid in enumerate(self.ids):
+            if cid is not None:
+                remap[no] = len(ids)
+                ids.append(cid)
+                lens.append(self.doc_len[no])
+        postings = {}
+        for term, plist in self.postings.items():
+            flat = []
+            for no, tf in plist.items():
+                flat += (remap[no], tf)
+            postings[term] = flat
+        data = {"version": INDEX_VERSION, "k1": self.k1, "b": self.b,
+                "ids": ids, "doc_len": lens, "postings": postings}
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".bm25-")
+        with os.fdopen(fd, "wb") as raw, gzip.open(raw, "wt", encoding="utf-8") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp, path)
+        self._dirty = False
+
+    @classmethod
+    def load(cls, path: str | Path) -> "BM25Index":
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != INDEX_VERSION:
+            raise ValueError(f"unsupported lexical index version {data.get('version')}")
+        idx = cls(data["k1"], data["b"])
+        idx.ids = data["ids"]
+        idx.doc_len = data["doc_len"]
+        idx._no = {cid: no for no, cid in enumerate(idx.ids)}
+        idx._total_len = sum(idx.doc_len)
+        idx.postings = {term: dict(zip(flat[::2], flat[1::2]))
+                        for term, flat in data["postings"].items()}
+        return idx
+
+    @classmethod
+    def open_for_update(cls, path: Path, collection, batch: int = 1000) -> "BM25Index":
+        """
+        Load the persisted index, or (if missing / unreadable) rebuild it from
+        the documents already stored in `collection`.
+        """
+        if path.exists():
+            try:
+                return cls.load(path)
+            except (OSError, ValueError) as e:
+                print(f"[WARN] Lexical index {path.name} unreadable ({e}) – rebuilding.")
+        idx = cls()
+        idx._dirty = True                          # write even if the collection is empty
+        total = collection.count()
+        for offset in range(0, total, batch):
+            out = collection.get(include=["documents"], limit=batch, offset=offset)
+            idx.add(out["ids"], out["documents"])
+        return idx
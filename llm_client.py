@@ -0,0 +1,169 @@
+"""
+llm_client.py  –  Pooled, concurrency-limited Ollama client
+------------------------------------------------------------------
+• one keep-alive requests.Session shared by all threads
+• at most `max_concurrent` generations run against Ollama at once; up to
+  `max_waiting` more wait in a queue, anything beyond that – or anything
+  that waits longer than `wait_timeout` – fails fast with LLMOverloadedError
+• single-flight: concurrent requests for the same (model, prompt, options)
+  share one generation; every caller receives the full token stream
+Generations always use Ollama's streaming API, so blocking and streaming
+callers can share a flight.
+"""
+
+from __future__ import annotations
+import json, time, hashlib, threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class LLMOverloadedError(RuntimeError):
+    """Raised when the generation queue is full or a request waited too long."""
+
+
+class _Flight:
+    """One in-progress generation and the fragments produced so far."""
+
+    def __init__(self):
+        self.parts: List[str] = []
+        self.started = False
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.consumers = 0
+        self.future = None
+        self.cond = threading.Condition()
+
+
+class OllamaClient:
+    def __init__(self, url: str, max_concurrent: int = 2, max_waiting: int = 32,
+                 wait_timeout: float = 30.0, timeout: float = 90.0):
+        self.url = url
+        self.max_waiting = max_waiting
+        self.wait_timeout = wait_timeout
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrent)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # the executor's worker count is the concurrency limit, its queue the wait queue
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent,
+                                            thread_name_prefix="llm")
+        self._flights: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self.coalesced = 0
+        self.rejected = 0
+
+    # ───────────── public API ─────────────
+    def stream(self, prompt: str, model: str, options: Optional[dict] = None) -> Iterator[str]:
+        """
+        Join (or start) the generation for this prompt and return an
+        iterator over its fragments.  Raises LLMOverloadedError right away
+        if the wait queue is full.
+        """
+        payload = {"model": model, "prompt": prompt, "stream": True,
+                   "options": options or {}}
+        key = hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                if self._queued >= self.max_waiting:
+                    self.rejected += 1
+                    raise LLMOverloadedError(
+                        f"LLM busy: {self._running} generating, {self._queued} waiting")
+                flight = _Flight()
+                self._flights[key] = flight
+                self._queued += 1
+                flight.future = self._executor.submit(self._run, key, flight, payload)
+            else:
+                self.coalesced += 1
+            flight.consumers += 1
+        return self._follow(key, flight)
+
+    def generate(self, prompt: str, model: str, options: Optional[dict] = None) -> str:
+        return "".join(self.stream(prompt, model, options))
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"running": self._running, "queued": self._queued,
+                    "coalesced": self.coalesced, "rejected": self.rejected}
+
+    # ───────────── internals ─────────────
+    def _follow(self, key: str, flight: _Flight) -> Iterator[str]:
+        deadline = time.monotonic() + self.wait_timeout
+        i = 0
+        try:
+            while True:
+                with flight.cond:
+                    while i >= len(flight.parts) and not flight.done:
+                        if flight.started:
+                            flight.cond.wait()
+                            continue
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._abandon(key, flight)
+                            break
+                        flight.cond.wait(remaining)
+                    new, done, error = flight.parts[i:], flight.done, flight.error
+                for part in new:
+                    yield part
+                i += len(new)
+                if done and i >= len(flight.parts):
+                    if error is not None:
+                        raise error
+                    return
+        finally:
+            with flight.cond:
+                flight.consumers -= 1      # _run stops early once nobody listens
+
+    def _abandon(self, key: str, flight: _Flight) -> None:
+        """Called with flight.cond held when the wait timeout expires."""
+        if flight.future.cancel():
+            with self._lock:
+                self._queued -= 1
+                self.rejected += 1
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            flight.error = LLMOverloadedError(
+                f"LLM busy: waited more than {self.wait_timeout:.0f}s for a free slot")
+            flight.done = True
+            flight.cond.notify_all()
+        # else: it started in the meantime – keep waiting for tokens
+
+    def _run(self, key: str, flight: _Flight, payload: dict) -> None:
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+        with flight.cond:
+            flight.started = True
+            flight.cond.notify_all()
+        try:
+            with self.session.post(self.url, json=payload, timeout=self.timeout,
+                                   stream=True) as r:
+                r.raise_for_status()
+                for line in r.iter_lines():
+                    if not line:
+                        continue
+                    part = json.loads(line)
+                    with flight.cond:
+                        if part.get("response"):
+                            flight.parts.append(part["response"])
+                            flight.cond.notify_all()
+                        if flight.consumers == 0:
+                            break          # every caller went away – free the slot
+                    if part.get("done"):
+                        break
+        except (requests.RequestException, ValueError) as e:
+            flight.error = e
+        finally:
+            with self._lock:
+                self._running -= 1
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            with flight.cond:
+                flight.done = True
+                flight.cond.notify_all()
@@ -0,0 +1,216 @@
+"""
+metrics.py  –  Minimal Prometheus metrics (text exposition format 0.0.4)
+------------------------------------------------------------------
+Counters, gauges and histograms with labels, thread-safe, no dependencies.
+app.py records every request here and serves `render()` on GET /metrics.
+
+    REQUESTS.inc(endpoint="/search", domain="sop", status="200")
+    with IN_FLIGHT.track(endpoint="/search"):
+        ...
+    STAGE_SECONDS.observe(0.012, stage="embed", domain="sop")
+
+Values are per process: with several workers, scrape each one (or let
+Prometheus sum over the `instance` label).
+"""
+
+from __future__ import annotations
+import json, math, threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+LabelKey = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", r"\\").replace("\n", r"\n").replace('"', r'\"')
+
+def _fmt(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, doc: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelKey:
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name}: expected labels {self.labels}, got {tuple(labels)}")
+        return tuple(str(labels[l]) for l in self.labels)
+
+    def _labelstr(self, key: LabelKey, extra: str = "") -> str:
+        parts = [f'{l}="{_escape(v)}"' for l, v in zip(self.labels, key)]
+        if extra:
+            parts.append(extra)
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, doc, labels=()):
+        super().__init__(name, doc, labels)
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return super().render() + [f"{self.name}{self._labelstr(k)} {_fmt(v)}" for k, v in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track(self, **labels) -> Iterator[None]:
+        """+1 while the block runs."""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, doc, labels=(), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[LabelKey, List[float]] = {}   # bucket counts…, sum, count
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    row[i] += 1
+                    break
+            row[-2] += value
+            row[-1] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        lines = super().render()
+        for key, row in items:
+            cumulative = 0.0
+            for bound, n in zip(self.buckets, row):
+                cumulative += n
+                le = self._labelstr(key, 'le="%s"' % _fmt(bound))
+                lines.append(f"{self.name}_bucket{le} {_fmt(cumulative)}")
+            le = self._labelstr(key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{le} {_fmt(row[-1])}")
+            lines.append(f"{self.name}_sum{self._labelstr(key)} {_fmt(row[-2])}")
+            lines.append(f"{self.name}_count{self._labelstr(key)} {_fmt(row[-1])}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# ─────────────────────────── app metrics ─────────────────────────── #
+REGISTRY = Registry()
+REQUESTS = REGISTRY.register(Counter(
+    "rag_requests_total", "Search requests by endpoint, domain and HTTP status.",
+    ("endpoint", "domain", "status")))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "rag_request_seconds", "End-to-end search request latency.", ("endpoint", "domain")))
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "rag_stage_seconds", "Time per pipeline stage (embed, vector, lexical, fetch, "
+    "retrieve, rerank, prompt, llm).", ("stage", "domain")))
+ERRORS = REGISTRY.register(Counter(
+    "rag_errors_total", "Failed search requests by exception type.",
+    ("endpoint", "domain", "error")))
+CACHE_HITS = REGISTRY.register(Counter(
+    "rag_answer_cache_hits_total", "Answers served from the answer cache.", ("domain", "kind")))
+RERANK_TIMEOUTS = REGISTRY.register(Counter(
+    "rag_rerank_timeouts_total", "Reranks skipped because they ran over budget.", ("domain",)))
+IN_FLIGHT = REGISTRY.register(Gauge(
+    "rag_in_flight_requests", "Search requests currently being processed.", ("endpoint",)))
+LLM_STATE = REGISTRY.register(Gauge(
+    "rag_llm_generations", "LLM client: generations running / queued, and totals of "
+    "rejected / coalesced requests.", ("state",)))
+INDEX_STAGE_SECONDS = REGISTRY.register(Gauge(
+    "rag_index_stage_seconds", "Busy seconds per stage of the last indexer run.",
+    ("domain", "stage")))
+INDEX_STAGE_ITEMS = REGISTRY.register(Gauge(
+    "rag_index_stage_items", "Items processed per stage of the last indexer run.",
+    ("domain", "stage")))
+
+
+def record_search(endpoint: str, domain: str, status: int, seconds: float,
+                  info: dict | None = None, error: BaseException | None = None) -> None:
+    """Book one finished request: status, latency, stage timings, cache hit, error."""
+    REQUESTS.inc(endpoint=endpoint, domain=domain, status=str(status))
+    REQUEST_SECONDS.observe(seconds, endpoint=endpoint, domain=domain)
+    if error is not None:
+        ERRORS.inc(endpoint=endpoint, domain=domain, error=type(error).__name__)
+    if not info:
+        return
+    if info.get("cached"):
+        CACHE_HITS.inc(domain=domain, kind=info["cached"])
+    for stage, secs in (info.get("timings") or {}).items():
+        if stage == "rerank_timeout":
+            RERANK_TIMEOUTS.inc(domain=domain)
+        elif isinstance(secs, (int, float)):
+            STAGE_SECONDS.observe(secs, stage=stage, domain=domain)
+
+def load_index_stats(domain: str, path: Path) -> None:
+    """Publish the stage timings an indexer wrote to `path` (see StageStats.save)."""
+    try:
+        stats = json.loads(Path(path).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return
+    for stage, row in stats.get("stages", {}).items():
+        INDEX_STAGE_SECONDS.set(row.get("seconds", 0.0), domain=domain, stage=stage)
+        INDEX_STAGE_ITEMS.set(row.get("items", 0), domain=domain, stage=stage)
+    INDEX_STAGE_SECONDS.set(stats.get("wall", 0.0), domain=domain, stage="wall")
+
+def server_timing(timings: dict) -> str:
+    """`Server-Timing` header value (milliseconds) for a stage-timings dict."""
+    return ", ".join(f"{stage};dur={secs * 1000:.1f}" for stage, secs in timings.items()
+                     if isinstance(secs, (int, float)) and not isinstance(secs, bool))
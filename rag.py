@@ -1,29 +1,85 @@
 """
 RAG ENGINE – multi-collection, meta-key-mapping version
+
+Importing this module is cheap: chromadb, torch and the embedding models
+are loaded by the first get_collection() call (or warm_up()).
 """
-import json, requests
-from typing import List, Dict
-import torch
-import chromadb
-from chromadb.utils import embedding_functions as emb_f
+from __future__ import annotations
+import os, json, time, threading, requests
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import List, Dict, Iterator, TYPE_CHECKING
+import numpy as np
 from pathlib import Path
-from gpu_embedding_function import GPUSentenceTransformerEmbeddingFunction
+from answer_cache import AnswerCache
+from llm_client import OllamaClient, LLMOverloadedError
+from index_manifest import MANIFEST_NAME
+from index_versions import active_version
+from lexical_index import BM25Index, lexical_index_path
+from reranker import CrossEncoderReranker
+from cluster_router import ClusterRouter, CENTROIDS_NAME
+from stage_timing import timed
+from embed_batcher import MicroBatcher
+from vector_store import MatrixStore
+from context_packer import pack_context, render_passage, get_counter, CONTEXT_TOKENIZER
+
+if TYPE_CHECKING:                             # loaded lazily in get_collection()
+    import chromadb
+    from gpu_embedding_function import (GPUSentenceTransformerEmbeddingFunction,
+                                        RemoteEmbeddingFunction)
 
 # ───────────────── CONFIG ─────────────────
 BASE_DIR = Path(__file__).resolve().parent  # < added: project root for rag.py
-DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
-print(f"[RAG] Using device: {DEVICE}")
 OLLAMA_URL   = "http://localhost:11434/api/generate"
 OLLAMA_MODEL = "qwen3:latest"
 N_CHUNKS     = 4
-CHUNK_CHAR_LIMIT     = 1024
 MAX_TOKENS_GENERATED = 4096  # max tokens for LLM response
+OLLAMA_MAX_CONCURRENT = int(os.getenv("OLLAMA_MAX_CONCURRENT", 2))    # generations at once
+OLLAMA_MAX_WAITING    = int(os.getenv("OLLAMA_MAX_WAITING", 32))      # queued before 503
+OLLAMA_WAIT_TIMEOUT   = float(os.getenv("OLLAMA_WAIT_TIMEOUT", 30))   # seconds in queue
+# answer cache: exact normalised-query hits (+ near-duplicates above ANSWER_CACHE_SIM, opt-in)
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", 512))      # entries (0 = off)
+ANSWER_CACHE_TTL  = float(os.getenv("ANSWER_CACHE_TTL", 3600))    # seconds
+ANSWER_CACHE_SIM  = float(os.getenv("ANSWER_CACHE_SIM", 0))       # cosine; 0 = exact only
+# hybrid retrieval: BM25 ranking fused with the vector ranking (reciprocal rank fusion)
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "1") != "0"
+HYBRID_FETCH  = int(os.getenv("HYBRID_FETCH", 5))     # candidates per ranking = n_results × this
+RRF_K         = int(os.getenv("RRF_K", 60))
+# optional cross-encoder rerank of an over-fetched pool (e.g. cross-encoder/ms-marco-MiniLM-L-6-v2)
+RERANK_MODEL      = os.getenv("RERANK_MODEL", "")            # "" = off
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", 40))   # pool size scored per query
+RERANK_BUDGET_MS  = float(os.getenv("RERANK_BUDGET_MS", 300)) # else keep vector order
+RERANK_DEVICE     = os.getenv("RERANK_DEVICE", "cpu")
+# optional cluster routing: search only the ROUTE_CLUSTERS clusters nearest to the query
+# (needs cluster_centroids.npz from sop_clustering.py; falls back to full search)
+ROUTED_SEARCH  = os.getenv("ROUTED_SEARCH", "0") == "1"
+ROUTE_CLUSTERS = int(os.getenv("ROUTE_CLUSTERS", 3))
+ROUTE_MIN_SIM  = float(os.getenv("ROUTE_MIN_SIM", 0.2))     # best centroid cosine
+ROUTE_MARGIN   = float(os.getenv("ROUTE_MARGIN", 0.01))     # kept vs dropped cluster
+# concurrent query embeddings are encoded together: up to EMBED_MICROBATCH per forward
+# pass, waiting at most EMBED_MICROBATCH_WAIT_MS for company (0/1 = one pass per query)
+EMBED_MICROBATCH         = int(os.getenv("EMBED_MICROBATCH", 32))
+EMBED_MICROBATCH_WAIT_MS = float(os.getenv("EMBED_MICROBATCH_WAIT_MS", 2))
+# production (serve.py): embed via the shared embedding process instead of loading the
+# model in every worker – unix:/path/to.sock or host:port ("" = in-process model)
+EMBED_SERVICE = os.getenv("EMBED_SERVICE", "")
+# zero-downtime rebuilds: the indexers publish new index versions (index_versions.py);
+# each domain's pointer is re-read every INDEX_REFRESH seconds and a new version is
+# opened and warmed in the background, then swapped in.  The old client is closed
+# INDEX_RETIRE seconds later, once requests still using it have finished.
+INDEX_REFRESH_S = float(os.getenv("INDEX_REFRESH", 2))
+INDEX_RETIRE_S  = float(os.getenv("INDEX_RETIRE", 60))
+SWAP_RETRY_S    = 30                          # after a version failed to open
+# per-domain vector backend ("backend" in DB_CFG): "chroma", or "matrix" = the
+# memory-mapped export written by the indexers with --matrix (vector_store.py);
+# a domain without an export falls back to Chroma
 
 DB_CFG = {
     "sop": {
         "persist_dir"   : str(BASE_DIR / "chroma_sops"),
         "collection"    : "sop_vectors",
         "embed_model"   : "all-MiniLM-L6-v2",
+        "backend"       : os.getenv("SOP_BACKEND", "chroma"),
         "system_prompt" : (
             "You are a helpful assistant for our dental office staff.\n"
             "Answer with step by step instructions formatted in markdown, pulling information from the relevant results.\n"
@@ -41,6 +97,7 @@ DB_CFG = {
         "persist_dir"   : str(BASE_DIR / "chromadb_data"),
         "collection"    : "json_chunks",
         "embed_model"   : "all-MiniLM-L6-v2",
+        "backend"       : os.getenv("SUPPORT_BACKEND", "chroma"),
         "system_prompt" : (
             "You are a customer-support assistant.\n"
             "Answer with step by step instructions formatted in markdown.\n"
@@ -55,25 +112,248 @@ DB_CFG = {
     }
 }
 
+# pseudo-domain: search every collection in DB_CFG and merge the results
+ALL_DOMAINS = "all"
+ALL_DOMAINS_SYSTEM_PROMPT = (
+    "You are a helpful assistant for our dental office staff.\n"
+    "The excerpts come from both our SOPs and our support articles.\n"
+    "Answer with step by step instructions formatted in markdown, pulling information from the relevant results.\n"
+    "If the answer is not present reply "
+    "\"I could not find an answer in the SOPs or support articles.\""
+)
+
+def is_valid_domain(domain: str) -> bool:
+    return domain in DB_CFG or domain == ALL_DOMAINS
+
 # ───────────── build & cache collections ─────────────
-_COLLECTION_CACHE: dict[str, chromadb.api.models.Collection] = {}
+# domain → (index version dir, collection, client) currently served; for the matrix
+# backend the MatrixStore is both collection and client
+_COLLECTION_CACHE: dict[str, tuple[Path, chromadb.Collection | MatrixStore,
+                                   chromadb.ClientAPI | MatrixStore]] = {}
+_EMBEDDER_CACHE: dict[str, GPUSentenceTransformerEmbeddingFunction] = {}
+_BATCHERS: dict[str, MicroBatcher] = {}      # domain → query batcher, one per model
+_REMOTE_EMBEDDERS: dict[str, RemoteEmbeddingFunction] = {}
+_WARMED: set[str] = set()                    # domains that answered a warm-up query
+_DISABLED: set[str] = set()                  # domains with no index built yet
+_RERANK_WARMED = False
+_LIVE_CHECK: dict[str, tuple[float, Path]] = {}   # domain → (next check, live version dir)
+_SWAPPING: set[str] = set()
+
+_COLLECTION_LOCK = threading.Lock()
+
+@lru_cache(maxsize=None)
+def get_device() -> str:
+    """Embedding device, probed (torch import + CUDA check) on first use."""
+    from gpu_embedding_function import default_device
+    device = default_device()
+    print(f"[RAG] Using device: {device}")
+    return device
+
+def _live_dir(domain: str) -> Path:
+    """Version the domain's pointer names, re-read at most every INDEX_REFRESH_S."""
+    now = time.monotonic()
+    checked = _LIVE_CHECK.get(domain)
+    if checked is None or now >= checked[0]:
+        checked = _LIVE_CHECK[domain] = (now + INDEX_REFRESH_S,
+                                         active_version(DB_CFG[domain]["persist_dir"]))
+    return checked[1]
+
+def index_dir(domain: str) -> Path:
+    """Index version the domain is served from (the live one before first use)."""
+    served = _COLLECTION_CACHE.get(domain)
+    return served[0] if served else _live_dir(domain)
+
+def _load_embedder(domain: str) -> None:
+    """Attach the domain's (shared) embedding function and query batcher – once."""
+    if domain in _EMBEDDER_CACHE:
+        return
+    from gpu_embedding_function import get_shared_embedding_function, RemoteEmbeddingFunction
+    cfg = DB_CFG[domain]
+    if EMBED_SERVICE:                        # the service batches across all workers
+        emb_fn = _REMOTE_EMBEDDERS.setdefault(
+            cfg["embed_model"], RemoteEmbeddingFunction(cfg["embed_model"], EMBED_SERVICE))
+    else:
+        emb_fn = get_shared_embedding_function(cfg["embed_model"], get_device())
+    _EMBEDDER_CACHE[domain] = emb_fn
+    if EMBED_MICROBATCH > 1 and not EMBED_SERVICE:
+        shared = next((b for d, b in _BATCHERS.items() if _EMBEDDER_CACHE[d] is emb_fn),
+                      None)
+        _BATCHERS[domain] = shared or MicroBatcher(
+            emb_fn, EMBED_MICROBATCH, EMBED_MICROBATCH_WAIT_MS / 1000,
+            name=f"embed-batch-{cfg['embed_model']}")
+
+def _embedder(domain: str) -> GPUSentenceTransformerEmbeddingFunction:
+    """The domain's embedding function, loaded without opening its collection."""
+    if domain not in _EMBEDDER_CACHE:
+        with _COLLECTION_LOCK:
+            _load_embedder(domain)
+    return _EMBEDDER_CACHE[domain]
+
+def _open_collection(domain: str, path: Path) -> tuple[Path, chromadb.Collection | MatrixStore,
+                                                      chromadb.ClientAPI | MatrixStore]:
+    cfg = DB_CFG[domain]
+    if cfg.get("backend", "chroma") == "matrix":
+        store = MatrixStore.open(path, cfg["collection"], _EMBEDDER_CACHE[domain])
+        if store is not None:
+            print(f"[RAG] '{domain}' uses the matrix backend "
+                  f"({store.count()} × {store.dim} {store.dtype})")
+            return path, store, store
+        print(f"[WARN] '{domain}': no matrix export in {path.name} "
+              f"(index with --matrix) – using Chroma.")
+    import chromadb
+    client = chromadb.PersistentClient(path=str(path))
+    collection = client.get_collection(
+        name=DB_CFG[domain]["collection"], embedding_function=_EMBEDDER_CACHE[domain]
+    )
+    return path, collection, client
 
 def get_collection(domain: str):
+    """
+    The domain's collection.  Opened on first use; afterwards a newly
+    published index version is swapped in by a background thread (_swap)
+    while this keeps returning the version being served.
+    """
     if domain not in DB_CFG:
         raise ValueError(f"Unknown domain '{domain}'.")
-    if domain in _COLLECTION_CACHE:
-        return _COLLECTION_CACHE[domain]
+    served = _COLLECTION_CACHE.get(domain)
+    if served is None:
+        with _COLLECTION_LOCK:
+            served = _COLLECTION_CACHE.get(domain)
+            if served is None:                   # no other thread got here first
+                _load_embedder(domain)
+                served = _COLLECTION_CACHE[domain] = _open_collection(domain, _live_dir(domain))
+        return served[1]
 
-    cfg = DB_CFG[domain]
-    emb_fn = GPUSentenceTransformerEmbeddingFunction(
-        model_name=cfg["embed_model"],
-        device=DEVICE
-    )
-    client = chromadb.PersistentClient(path=cfg["persist_dir"])
-    _COLLECTION_CACHE[domain] = client.get_collection(
-        name=cfg["collection"], embedding_function=emb_fn
-    )
-    return _COLLECTION_CACHE[domain]
+    live = _live_dir(domain)
+    if live != served[0] and domain not in _SWAPPING:
+        with _COLLECTION_LOCK:
+            if domain in _SWAPPING:
+                return served[1]
+            _SWAPPING.add(domain)
+        threading.Thread(target=_swap, args=(domain, live), daemon=True,
+                         name=f"index-swap-{domain}").start()
+    return served[1]
+
+def _swap(domain: str, path: Path) -> None:
+    """
+    Open the new version and warm it (HNSW + BM25 loaded by one query) while
+    requests keep using the old one, then serve it.  The old client is
+    closed INDEX_RETIRE_S later; a version that fails to open is retried
+    after SWAP_RETRY_S.
+    """
+    old_path, _, old_client = _COLLECTION_CACHE[domain]
+    t0 = time.perf_counter()
+    try:
+        new = _open_collection(domain, path)
+        new[1].query(query_embeddings=[embed_query(domain, "warm-up")], n_results=1)
+        get_lexical_index(domain, path)
+    except Exception as e:
+        print(f"[RAG] Could not switch '{domain}' to {path.name} ({e}) – "
+              f"still serving {old_path.name}")
+        _LIVE_CHECK[domain] = (time.monotonic() + SWAP_RETRY_S, old_path)
+        _SWAPPING.discard(domain)
+        return
+    _COLLECTION_CACHE[domain] = new
+    _SWAPPING.discard(domain)
+    print(f"[RAG] '{domain}' now served from {path.name} "
+          f"(opened and warmed in {time.perf_counter() - t0:.2f}s)")
+
+    time.sleep(INDEX_RETIRE_S)                   # let in-flight requests finish
+    for cache in (_LEXICAL_CACHE, _ROUTER_CACHE):
+        for key in [k for k in cache if k.parent == old_path]:
+            cache.pop(key, None)
+    if hasattr(old_client, "close"):             # chromadb ≥ 1.x, MatrixStore
+        old_client.close()
+
+def _disable(domain: str, reason: str) -> None:
+    if domain not in _DISABLED:
+        _DISABLED.add(domain)
+        print(f"[RAG] '{domain}' has no index yet ({reason}) – disabled until one is built")
+
+def warm_up(domains: list[str] | None = None) -> dict[str, float]:
+    """
+    Open the collections of `domains` (default: every domain not warmed up
+    yet), load their models and run one dummy query so the first real
+    request pays no start-up cost.  A domain whose index was never built is
+    marked disabled (see readiness).  Returns seconds per domain; failures
+    are reported, not raised.
+    """
+    global _RERANK_WARMED
+    timings = {}
+    for domain in (domains if domains is not None else
+                   [d for d in DB_CFG if d not in _WARMED]):
+        if not _live_dir(domain).is_dir():
+            _disable(domain, f"no {DB_CFG[domain]['persist_dir']}")
+            continue
+        t0 = time.perf_counter()
+        try:
+            get_collection(domain).query(
+                query_embeddings=[embed_query(domain, "warm-up")], n_results=1
+            )
+        except Exception as e:
+            if "does not exist" in str(e):     # chromadb: collection never created
+                _disable(domain, f"no collection '{DB_CFG[domain]['collection']}'")
+            else:
+                print(f"[RAG] Warm-up failed for '{domain}': {e}")
+            continue
+        token_counter(domain).count("warm-up")          # load the prompt tokenizer
+        timings[domain] = time.perf_counter() - t0
+        _DISABLED.discard(domain)
+        _WARMED.add(domain)
+        print(f"[RAG] Warmed up '{domain}' in {timings[domain]:.2f}s")
+    if RERANKER is not None and not _RERANK_WARMED:
+        t0 = time.perf_counter()
+        try:
+            RERANKER.warm_up()
+            _RERANK_WARMED = True
+            timings["rerank"] = time.perf_counter() - t0
+            print(f"[RAG] Warmed up reranker in {timings['rerank']:.2f}s")
+        except Exception as e:
+            print(f"[RAG] Reranker warm-up failed: {e}")
+    return timings
+
+def readiness() -> dict[str, str]:
+    """
+    Domain → "ready" (collection open and its model answered a query),
+    "disabled" (no index built yet: not required for readiness) or
+    "starting" (not warmed up yet, or its warm-up failed).
+    """
+    return {domain: "ready" if domain in _WARMED else
+                    "disabled" if domain in _DISABLED else "starting"
+            for domain in DB_CFG}
+
+def is_ready(states: dict[str, str] | None = None) -> bool:
+    """Every built domain is warmed up, and at least one is."""
+    states = readiness() if states is None else states
+    return "ready" in states.values() and "starting" not in states.values()
+
+def embed_query(domain: str, query: str) -> np.ndarray:
+    """
+    Embed one query with the domain's model (so it can be reused).  For
+    ALL_DOMAINS the first configured domain's model is used.  Goes through
+    the domain's MicroBatcher, so concurrent requests share forward passes.
+    """
+    if domain == ALL_DOMAINS:
+        domain = next(iter(DB_CFG))
+    embedder = _embedder(domain)
+    batcher = _BATCHERS.get(domain)
+    if batcher is not None:
+        return batcher.embed(query)
+    return np.asarray(embedder([query])[0], dtype=np.float32)
+
+def index_version(domain: str) -> str:
+    """
+    Cheap fingerprint of the domain's on-disk index: the indexers rewrite
+    their manifest whenever they change the collection.  Used to invalidate
+    cached answers.
+    """
+    if domain == ALL_DOMAINS:
+        return "|".join(index_version(d) for d in DB_CFG)
+    path = index_dir(domain)
+    try:
+        return f"{path.name}:{(path / MANIFEST_NAME).stat().st_mtime_ns}"
+    except OSError:
+        return "-"
 
 # ───────────── utility: pick first present alias ─────────────
 def pick(meta: dict, aliases: list[str], default="Unknown"):
@@ -83,25 +363,163 @@ def pick(meta: dict, aliases: list[str], default="Unknown"):
     return default
 
 # ───────────── retrieval ─────────────
-def search_similar_chunks(domain: str, query: str,
-                          n_results: int = N_CHUNKS) -> list[dict]:
-    result = get_collection(domain).query(
-        query_texts=[query],
-        n_results=n_results,
-        include=["documents", "metadatas", "distances"]
-    )
-    if not result.get("documents") or not result["documents"][0]:
+_SEARCH_POOL = ThreadPoolExecutor(max_workers=max(2, 2 * len(DB_CFG)),
+                                  thread_name_prefix="search")
+
+def _space(collection) -> str:
+    meta = collection.metadata or {}
+    return meta.get("hnsw:space") or \
+        ((getattr(collection, "configuration", None) or {}).get("hnsw") or {}).get("space", "l2")
+
+def _similarity(collection, distances: list[float]) -> list[float]:
+    """
+    Convert Chroma distances to cosine similarity so scores from collections
+    with different distance spaces can be ranked together.  (Our models emit
+    unit-length vectors, for which squared L2 = 2 - 2·cos.)
+    """
+    if _space(collection) == "l2":
+        return [1 - d / 2 for d in distances]
+    return [1 - d for d in distances]          # cosine, ip
+
+def _distances(collection, query_embedding: np.ndarray, embeddings) -> list[float]:
+    """Chroma-compatible distances for chunks fetched by ID (lexical-only hits)."""
+    q = np.asarray(query_embedding, dtype=np.float32)
+    e = np.asarray(embeddings, dtype=np.float32)
+    space = _space(collection)
+    if space == "l2":
+        return [float(d) for d in ((e - q) ** 2).sum(axis=1)]
+    if space == "cosine":
+        norms = np.linalg.norm(e, axis=1) * (np.linalg.norm(q) or 1.0)
+        return [float(d) for d in 1 - (e @ q) / np.maximum(norms, 1e-12)]
+    return [float(d) for d in 1 - e @ q]       # ip
+
+_LEXICAL_CACHE: dict[Path, tuple[int, BM25Index | None]] = {}   # by file
+_LEXICAL_LOCK = threading.Lock()
+
+def get_lexical_index(domain: str, version: Path | None = None) -> BM25Index | None:
+    """
+    The BM25 index of the served index version (or `version`), reloaded
+    when the file is rewritten.  None if hybrid search is off or the
+    collection has no lexical index yet.
+    """
+    if not HYBRID_SEARCH:
+        return None
+    path = lexical_index_path(version or index_dir(domain), DB_CFG[domain]["collection"])
+    try:
+        mtime = path.stat().st_mtime_ns
+    except OSError:
+        return None
+    cached = _LEXICAL_CACHE.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with _LEXICAL_LOCK:
+        cached = _LEXICAL_CACHE.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        try:
+            index = BM25Index.load(path)
+        except (OSError, ValueError) as e:
+            print(f"[RAG] Lexical index for '{domain}' unreadable ({e}) – vector search only.")
+            index = None
+        _LEXICAL_CACHE[path] = (mtime, index)
+    return index
+
+_ROUTER_CACHE: dict[Path, tuple[int, ClusterRouter | None]] = {}   # by file
+
+def get_router(domain: str) -> ClusterRouter | None:
+    """The domain's cluster router (reloaded when re-clustered), or None."""
+    if not ROUTED_SEARCH:
+        return None
+    path = index_dir(domain) / CENTROIDS_NAME
+    try:
+        mtime = path.stat().st_mtime_ns
+    except OSError:
+        return None
+    cached = _ROUTER_CACHE.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    try:
+        router = ClusterRouter.load(path, nprobe=ROUTE_CLUSTERS,
+                                    min_sim=ROUTE_MIN_SIM, min_margin=ROUTE_MARGIN)
+    except (OSError, KeyError, ValueError) as e:
+        print(f"[RAG] Cluster centroids for '{domain}' unreadable ({e}) – full search.")
+        router = None
+    _ROUTER_CACHE[path] = (mtime, router)
+    return router
+
+def _vector_query(domain: str, collection, query_embedding: np.ndarray, n: int) -> dict:
+    """
+    collection.query, restricted to the nearest clusters when routing is on
+    and confident; a routed query that finds fewer than `n` chunks is
+    repeated over the whole collection.
+    """
+    include = ["documents", "metadatas", "distances"]
+    router = get_router(domain)
+    clusters = router.route(query_embedding) if router is not None else None
+    if clusters is not None:
+        result = collection.query(query_embeddings=[query_embedding], n_results=n,
+                                  where=ClusterRouter.where(clusters), include=include)
+        if len(result["ids"][0]) >= n:
+            return result
+    return collection.query(query_embeddings=[query_embedding], n_results=n,
+                            include=include)
+
+def _rrf(*rankings: list[str]) -> list[str]:
+    """Reciprocal rank fusion: score(id) = Σ 1 / (RRF_K + rank)."""
+    fused: dict[str, float] = {}
+    for ranking in rankings:
+        for rank, cid in enumerate(ranking, start=1):
+            fused[cid] = fused.get(cid, 0.0) + 1.0 / (RRF_K + rank)
+    return sorted(fused, key=fused.get, reverse=True)
+
+def _query_collection(domain: str, query: str, query_embedding: np.ndarray,
+                      n_results: int, timings: dict | None = None) -> list[dict]:
+    timings = {} if timings is None else timings
+    collection = get_collection(domain)
+    lexical = get_lexical_index(domain) if query else None
+    fetch = n_results * HYBRID_FETCH if lexical is not None else n_results
+    with timed(timings, "vector"):
+        result = _vector_query(domain, collection, query_embedding, fetch)
+    found = {}
+    if result.get("documents") and result["documents"][0]:
+        for cid, doc, meta, dist in zip(result["ids"][0], result["documents"][0],
+                                        result["metadatas"][0], result["distances"][0]):
+            found[cid] = (doc, meta, dist)
+    order = list(found)
+
+    if lexical is not None:
+        with timed(timings, "lexical"):
+            lexical_ids = [cid for cid, _ in lexical.search(query, fetch)]
+        order = _rrf(order, lexical_ids)[:n_results]
+        extra = [cid for cid in order if cid not in found]
+        if extra:                              # lexical-only hits: fetch text + vector
+            with timed(timings, "fetch"):
+                got = collection.get(ids=extra,
+                                     include=["documents", "metadatas", "embeddings"])
+            if got["ids"]:
+                dists = _distances(collection, query_embedding, got["embeddings"])
+                for cid, doc, meta, dist in zip(got["ids"], got["documents"],
+                                                got["metadatas"], dists):
+                    found[cid] = (doc, meta or {}, dist)
+            order = [cid for cid in order if cid in found]   # index ahead of collection
+    order = order[:n_results]
+    if not order:
         return []
 
     meta_map = DB_CFG[domain]["meta_map"]
+    scores = _similarity(collection, [found[cid][2] for cid in order])
 
     packaged = []
-    for doc, meta, dist in zip(result["documents"][0],
-                               result["metadatas"][0],
-                               result["distances"][0]):
+    for cid, score in zip(order, scores):
+        doc, meta, dist = found[cid]
         packaged.append({
+            "chunk_id"  : cid,
+            "domain"    : domain,
             "chunk"     : doc,
+            "span"      : (meta["char_start"], meta["char_end"])   # offsets in its document
+                          if "char_start" in meta and "char_end" in meta else None,
             "relevance" : max(0, 1 - dist),
+            "score"     : score,
             "meta"      : {
                 "title"     : pick(meta, meta_map["title"]),
                 "id"        : pick(meta, meta_map["id"], "N/A"),
@@ -110,54 +528,260 @@ def search_similar_chunks(domain: str, query: str,
         })
     return packaged
 
+def _search_all_domains(query: str, n_results: int,
+                        query_embedding: np.ndarray | None,
+                        timings: dict) -> list[dict]:
+    """
+    Federated search: embed the query once per distinct model, query every
+    collection concurrently and interleave the per-domain rankings by rank
+    (RRF over the domain lists; ties go to the higher vector score), so
+    lexical-only hits keep the place hybrid fusion gave them.  Collections
+    run in parallel, so each stage is timed as the slowest domain's.
+    Domains readiness() reports as disabled (no index) are skipped, and a
+    domain that fails is logged and left out: the others still answer.
+    """
+    embeddings: dict[int, np.ndarray] = {}
+    if query_embedding is not None:            # computed with the first domain's model
+        embeddings[id(_embedder(next(iter(DB_CFG))))] = query_embedding
+
+    jobs = []
+    for domain in DB_CFG:
+        if domain in _DISABLED:
+            continue
+        try:
+            key = id(_embedder(domain))        # shared registry → same model, same key
+            if key not in embeddings:
+                with timed(timings, "embed"):
+                    embeddings[key] = embed_query(domain, query)
+        except Exception as e:
+            print(f"[RAG] Search failed for '{domain}': {e}")
+            continue
+        job_timings: dict = {}
+        jobs.append((domain, _SEARCH_POOL.submit(_query_collection, domain, query,
+                                                 embeddings[key], n_results, job_timings),
+                     job_timings))
+
+    merged = []                                # (rank within its domain, hit)
+    for domain, job, job_timings in jobs:
+        try:
+            merged.extend(enumerate(job.result()))
+        except Exception as e:                 # one broken collection must not sink the rest
+            print(f"[RAG] Search failed for '{domain}': {e}")
+        for stage, secs in job_timings.items():
+            timings[stage] = max(timings.get(stage, 0.0), secs)
+    merged.sort(key=lambda entry: (entry[0], -entry[1]["score"]))
+    return [hit for _, hit in merged[:n_results]]
+
+RERANKER = CrossEncoderReranker(RERANK_MODEL, device=RERANK_DEVICE) if RERANK_MODEL else None
+
+def _rerank(query: str, hits: list[dict], n_results: int, timings: dict) -> list[dict]:
+    """Keep the cross-encoder's best `n_results`; vector order if over budget."""
+    ranked, spent = RERANKER.rerank(query, [h["chunk"] for h in hits], n_results,
+                                    RERANK_BUDGET_MS / 1000)
+    timings["rerank"] = spent
+    if ranked is None:
+        timings["rerank_timeout"] = True
+        print(f"[RAG] Rerank over budget ({spent * 1000:.0f} ms) – using vector order")
+        return hits[:n_results]
+    out = []
+    for i, score in ranked:
+        out.append(dict(hits[i], rerank_score=score))
+    return out
+
+def search_similar_chunks(domain: str, query: str,
+                          n_results: int = N_CHUNKS,
+                          query_embedding: np.ndarray | None = None,
+                          timings: dict | None = None) -> list[dict]:
+    """
+    Top `n_results` chunks for `query`.  With RERANK_MODEL set, a pool of
+    RERANK_CANDIDATES is retrieved and reordered by the cross-encoder.
+    Stage durations (seconds) are written to `timings` if given: embed,
+    vector (Chroma query or matrix scan), lexical (BM25), fetch (lexical-only hits),
+    retrieve (all of the above) and rerank.
+    """
+    timings = {} if timings is None else timings
+    pool = max(n_results, RERANK_CANDIDATES) if RERANKER is not None else n_results
+    t0 = time.perf_counter()
+    if domain == ALL_DOMAINS:
+        hits = _search_all_domains(query, pool, query_embedding, timings)
+    else:
+        if query_embedding is None:
+            with timed(timings, "embed"):
+                query_embedding = embed_query(domain, query)
+        hits = _query_collection(domain, query, query_embedding, pool, timings)
+    timings["retrieve"] = time.perf_counter() - t0
+    if RERANKER is None or len(hits) <= 1:
+        return hits[:n_results]
+    return _rerank(query, hits, n_results, timings)
+
 # ───────────── LLM call ─────────────
+LLM = OllamaClient(OLLAMA_URL,
+                   max_concurrent=OLLAMA_MAX_CONCURRENT,
+                   max_waiting=OLLAMA_MAX_WAITING,
+                   wait_timeout=OLLAMA_WAIT_TIMEOUT,
+                   timeout=90)
+LLM_OPTIONS = {"temperature":1,"top_p":0.9,"max_tokens":MAX_TOKENS_GENERATED}
+
 def query_ollama(prompt: str, model: str = OLLAMA_MODEL) -> str:
-    payload = {
-        "model"  : model,
-        "prompt" : prompt,
-        "stream" : False,
-        "options": {"temperature":1,"top_p":0.9,"max_tokens":MAX_TOKENS_GENERATED}
-    }
+    """Blocking generation.  Raises LLMOverloadedError when the LLM queue is full."""
     try:
-        r = requests.post(OLLAMA_URL, json=payload, timeout=90)
-        r.raise_for_status()
-        return r.json().get("response", "")
+        return LLM.generate(prompt, model, LLM_OPTIONS)
     except requests.RequestException as e:
         return f"[LLM error] {e}"
 
+def query_ollama_stream(prompt: str, model: str = OLLAMA_MODEL,
+                        status: dict | None = None) -> Iterator[str]:
+    """
+    Yield response fragments as Ollama generates them.  A failure mid-stream
+    yields one "[LLM error] …" fragment and sets status["error"] (if given).
+    """
+    fragments = LLM.stream(prompt, model, LLM_OPTIONS)   # may raise LLMOverloadedError
+    try:
+        yield from fragments
+    except (requests.RequestException, ValueError) as e:
+        if status is not None:
+            status["error"] = str(e)
+        yield f"[LLM error] {e}"
+
+# ───────────── answer cache ─────────────
+ANSWER_CACHE = AnswerCache(max_entries=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL,
+                           threshold=ANSWER_CACHE_SIM)
+
 # ───────────── main RAG driver ─────────────
-def rag_inference(domain: str, user_query: str,
-                  n_chunks: int = N_CHUNKS):
-    retrieved = search_similar_chunks(domain, user_query, n_chunks)
-    if not retrieved:
-        return "No relevant information found in the database.", []
+NO_RESULTS = "No relevant information found in the database."
+
+def _cache_lookup(domain: str, user_query: str, info: dict):
+    """Return (cached_entry | None, version, query_emb | None)."""
+    if ANSWER_CACHE_SIZE <= 0:
+        return None, "", None
+    version = index_version(domain)
+    query_emb = None
+    hit, kind = ANSWER_CACHE.get(domain, user_query, version)
+    if hit is None and ANSWER_CACHE.semantic:
+        with timed(info["timings"], "embed"):
+            query_emb = embed_query(domain, user_query)
+        hit, kind = ANSWER_CACHE.get(domain, user_query, version, query_emb)
+    info["cached"] = kind
+    return hit, version, query_emb
 
+def _cache_store(domain: str, user_query: str, version: str, answer: str,
+                 source_cards: list, query_emb) -> None:
+    if ANSWER_CACHE_SIZE > 0 and not answer.startswith("[LLM error]"):
+        ANSWER_CACHE.put(domain, user_query, version, answer, source_cards, query_emb)
+
+def token_counter(domain: str):
+    """Counter for the prompt budget: CONTEXT_TOKENIZER, else the domain's embedding model."""
+    if domain == ALL_DOMAINS:
+        domain = next(iter(DB_CFG))
+    return get_counter(CONTEXT_TOKENIZER or DB_CFG[domain]["embed_model"])
+
+def build_prompt(domain: str, user_query: str, retrieved: list[dict],
+                 stats: dict | None = None):
+    """
+    Return (prompt, source_cards) for the retrieved chunks, packed into the
+    token budget by context_packer (one source card per passage).  Packing
+    counts (merged, duplicates, tokens, …) are written to `stats` if given.
+    """
+    passages, packed = pack_context(retrieved, counter=token_counter(domain))
+    if stats is not None:
+        stats.update(packed)
     context, source_cards = [], []
-    for hit in retrieved:
-        meta = hit["meta"]
-        rel  = round(hit["relevance"] * 100, 1)
-        chunk = hit["chunk"][:CHUNK_CHAR_LIMIT]
-        preview = (chunk[:200]+"…") if len(chunk) > 200 else chunk
+    for number, passage in enumerate(passages, start=1):
+        meta = passage.meta
+        preview = (passage.text[:200]+"…") if len(passage.text) > 200 else passage.text
 
-        context.append(f"SOURCE: {meta['title']} | Relevance: {rel}%\n{chunk}")
+        context.append(render_passage(number, passage))
         source_cards.append({
             "title"     : meta["title"],
-            "relevance" : rel,
+            "relevance" : round(passage.relevance * 100, 1),
             "preview"   : preview,
             "id"        : meta["id"],
-            "department": meta["department"]
+            "department": meta["department"],
+            "domain"    : passage.domain
         })
-    system_prompt = DB_CFG[domain]["system_prompt"] + (
+    base_prompt = ALL_DOMAINS_SYSTEM_PROMPT if domain == ALL_DOMAINS \
+        else DB_CFG[domain]["system_prompt"]
+    system_prompt = base_prompt + (
         "\n\n—  Please format your answer in GitHub-flavoured **Markdown**.  "
         "Use headings, bullet lists, and bold text when helpful.  "
         "Do NOT wrap the entire answer in a code block."
     )
+    excerpts = "\n\n".join(context)
     prompt = (
         f"/no_think\n{system_prompt}\n\n"
-        f"EXCERPTS:\n{context}\n"
+        f"EXCERPTS:\n\n{excerpts}\n\n"
         f"User question: {user_query}\n"
         f"Answer:"
     )
+    return prompt, source_cards
+
+def rag_inference(domain: str, user_query: str,
+                  n_chunks: int = N_CHUNKS):
+    """
+    Answer `user_query` from the `domain` collection.
+    Returns (answer, source_cards, info) where info["cached"] is None,
+    "exact" or "semantic", info["timings"] holds seconds per stage
+    (see search_similar_chunks, plus prompt and llm) and info["context"]
+    the prompt packing counts (see build_prompt).
+    """
+    info = {"cached": None, "timings": {}}
+    hit, version, query_emb = _cache_lookup(domain, user_query, info)
+    if hit is not None:
+        return hit.answer, hit.sources, info
+
+    retrieved = search_similar_chunks(domain, user_query, n_chunks, query_emb,
+                                      timings=info["timings"])
+    if not retrieved:
+        return NO_RESULTS, [], info
+
+    with timed(info["timings"], "prompt"):
+        prompt, source_cards = build_prompt(domain, user_query, retrieved,
+                                            info.setdefault("context", {}))
+    with timed(info["timings"], "llm"):
+        answer = query_ollama(prompt).strip()
+    _cache_store(domain, user_query, version, answer, source_cards, query_emb)
+    return answer, source_cards, info
+
+def rag_inference_stream(domain: str, user_query: str,
+                         n_chunks: int = N_CHUNKS) -> Iterator[dict]:
+    """
+    Streaming variant of rag_inference.  Yields events:
+        {"type": "sources", "sources": [...], "cached": ..., "timings": {...}}
+                                                               right after retrieval
+        {"type": "token",   "text": "..."}                     as the LLM generates
+        {"type": "done", "timings": {...}}      timings incl. llm_first_token and llm
+    """
+    info = {"cached": None, "timings": {}}
+    hit, version, query_emb = _cache_lookup(domain, user_query, info)
+    if hit is not None:
+        yield {"type": "sources", "sources": hit.sources, "cached": info["cached"]}
+        yield {"type": "token", "text": hit.answer}
+        yield {"type": "done", "timings": info["timings"]}
+        return
+
+    retrieved = search_similar_chunks(domain, user_query, n_chunks, query_emb,
+                                      timings=info["timings"])
+    if not retrieved:
+        yield {"type": "sources", "sources": [], "cached": None, "timings": info["timings"]}
+        yield {"type": "token", "text": NO_RESULTS}
+        yield {"type": "done", "timings": info["timings"]}
+        return
+
+    with timed(info["timings"], "prompt"):
+        prompt, source_cards = build_prompt(domain, user_query, retrieved,
+                                            info.setdefault("context", {}))
+    yield {"type": "sources", "sources": source_cards, "cached": None,
+           "timings": dict(info["timings"])}
 
-    answer = query_ollama(prompt)
-    return answer.strip(), source_cards
\ No newline at end of file
+    parts, llm = [], {}
+    t0 = time.perf_counter()
+    for text in query_ollama_stream(prompt, status=llm):
+        if not parts:
+            info["timings"]["llm_first_token"] = time.perf_counter() - t0
+        parts.append(text)
+        yield {"type": "token", "text": text}
+    info["timings"]["llm"] = time.perf_counter() - t0
+    if "error" not in llm:                       # never cache a cut-off answer
+        _cache_store(domain, user_query, version, "".join(parts).strip(),
+                     source_cards, query_emb)
+    yield {"type": "done", "timings": info["timings"]}
@@ -0,0 +1,75 @@
+"""
+reranker.py  –  Latency-budgeted cross-encoder reranking
+------------------------------------------------------------------
+The bi-encoder ranks chunks by vector distance; a cross-encoder reads the
+query and the chunk together and orders them far more accurately.  rag.py
+over-fetches a candidate pool, and `rerank()` scores every (query, chunk)
+pair in one batched forward pass and keeps the best few.
+
+Every call has a time budget.  Scoring runs on a single worker thread (one
+forward pass at a time – concurrent passes only fight over the CPU cores);
+if the result is not back in time – model still loading, queue busy, a slow
+box – the caller keeps the vector order and the pass finishes in the
+background, so the next request finds the model warm.
+"""
+
+from __future__ import annotations
+import time, threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import List, Optional, Sequence, Tuple
+
+
+class CrossEncoderReranker:
+    def __init__(self, model_name: str, device: str = "cpu",
+                 max_length: int = 256, batch_size: int = 64):
+        self.model_name = model_name
+        self.device = device
+        self.max_length = max_length
+        self.batch_size = batch_size
+        self._model = None
+        self._load_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rerank")
+        self.timeouts = 0
+
+    @property
+    def loaded(self) -> bool:
+        return self._model is not None
+
+    def _get_model(self):
+        if self._model is None:
+            with self._load_lock:
+                if self._model is None:
+                    from sentence_transformers import CrossEncoder
+                    print(f"[RERANK] Loading {self.model_name} on {self.device}")
+                    self._model = CrossEncoder(self.model_name, device=self.device,
+                                               max_length=self.max_length)
+        return self._model
+
+    def score(self, query: str, passages: Sequence[str]) -> List[float]:
+        """Cross-encoder relevance of each passage to `query` (blocking, no budget)."""
+        if not passages:
+            return []
+        scores = self._get_model().predict([(query, p) for p in passages],
+                                           batch_size=self.batch_size,
+                                           show_progress_bar=False)
+        return [float(s) for s in scores]
+
+    def rerank(self, query: str, passages: Sequence[str], top_k: int,
+               budget: float) -> Tuple[Optional[List[Tuple[int, float]]], float]:
+        """
+        Return ([(passage_index, score), …] best first, seconds spent), or
+        (None, seconds) if `budget` seconds ran out – keep the original order then.
+        """
+        t0 = time.perf_counter()
+        future = self._executor.submit(self.score, query, list(passages))
+        try:
+            scores = future.result(timeout=max(budget, 0))
+        except FutureTimeout:
+            future.cancel()                    # drop it if it never got to run
+            self.timeouts += 1
+            return None, time.perf_counter() - t0
+        order = sorted(range(len(scores)), key=scores.__getitem__, reverse=True)
+        return [(i, scores[i]) for i in order[:top_k]], time.perf_counter() - t0
+
+    def warm_up(self) -> None:
+        self.score("warm-up", ["warm-up"])
@@ -0,0 +1,120 @@
+"""
+serve.py  –  Production launcher: multi-worker web server + shared embedding process
+------------------------------------------------------------------
+    python serve.py                      # gunicorn, cores/2 workers, port 5000
+    python serve.py --workers 8 --threads 4 --bind 0.0.0.0:8080
+    python serve.py --server waitress    # Windows (one process, many threads)
+
+With more than one worker, embedding runs in ONE separate process
+(embed_service.py) that every worker talks to over a Unix socket (TCP on
+Windows), so the model is loaded once however many workers there are, and
+queries from all workers are batched together.  The launcher starts that
+process first, waits until it answers, restarts it if it dies and stops it
+on shutdown.
+
+Workers warm up in the background; point the load balancer's health checks
+at GET /healthz (process alive) and GET /readyz (models and collections
+loaded – 503 until then).
+"""
+
+from __future__ import annotations
+import os, sys, time, signal, argparse, subprocess
+from pathlib import Path
+
+from embed_service import DEFAULT_ADDRESS, wait_until_up, EmbedServiceError
+
+BASE_DIR = Path(__file__).resolve().parent
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    ap = argparse.ArgumentParser(description="Run the search app in production mode")
+    ap.add_argument("--bind", default=os.getenv("BIND", "0.0.0.0:5000"), help="host:port")
+    ap.add_argument("--server", choices=["gunicorn", "waitress"],
+                    default="waitress" if os.name == "nt" else "gunicorn")
+    ap.add_argument("--workers", type=int,
+                    default=int(os.getenv("WEB_WORKERS", max(2, (os.cpu_count() or 2) // 2))),
+                    help="worker processes (gunicorn only)")
+    ap.add_argument("--threads", type=int, default=int(os.getenv("WEB_THREADS", 8)),
+                    help="request threads per worker")
+    ap.add_argument("--timeout", type=int, default=180,
+                    help="seconds before a silent worker is restarted (gunicorn)")
+    ap.add_argument("--embed-service", choices=["auto", "on", "off"], default="auto",
+                    help="shared embedding process (auto: on with more than one worker)")
+    ap.add_argument("--embed-address", default=os.getenv("EMBED_SERVICE") or DEFAULT_ADDRESS,
+                    help="unix:/path/to.sock or host:port for the embedding process")
+    ap.add_argument("--preload", nargs="*", default=["all-MiniLM-L6-v2"],
+                    help="models the embedding process loads before workers start")
+    return ap.parse_args(argv)
+
+def server_command(args) -> list[str]:
+    if args.server == "gunicorn":
+        return [sys.executable, "-m", "gunicorn", "app:app",
+                "--bind", args.bind, "--workers", str(args.workers),
+                "--worker-class", "gthread", "--threads", str(args.threads),
+                "--timeout", str(args.timeout), "--graceful-timeout", "30"]
+    return [sys.executable, "-m", "waitress", "--listen", args.bind,
+            "--threads", str(args.threads), "app:app"]
+
+def start_embed_service(args) -> subprocess.Popen:
+    cmd = [sys.executable, str(BASE_DIR / "embed_service.py"),
+           "--address", args.embed_address]
+    if args.preload:
+        cmd += ["--preload", *args.preload]
+    proc = subprocess.Popen(cmd, cwd=BASE_DIR)
+    try:
+        info = wait_until_up(args.embed_address, timeout=300)
+    except EmbedServiceError:
+        proc.terminate()
+        raise SystemExit(f"[SERVE] Embedding service did not come up on {args.embed_address}")
+    print(f"[SERVE] Embedding service ready (pid {info.get('pid')}, "
+          f"models {info.get('models')})", flush=True)
+    return proc
+
+def _stop(proc: subprocess.Popen | None, timeout: float = 30) -> None:
+    if proc is None or proc.poll() is not None:
+        return
+    proc.terminate()
+    try:
+        proc.wait(timeout)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    workers = args.workers if args.server == "gunicorn" else 1
+    use_service = args.embed_service == "on" or (args.embed_service == "auto" and workers > 1)
+
+    env = dict(os.environ, RAG_WARMUP="1")
+    embed_proc = None
+    if use_service:
+        embed_proc = start_embed_service(args)
+        env["EMBED_SERVICE"] = args.embed_address
+    else:
+        env.pop("EMBED_SERVICE", None)
+
+    print(f"[SERVE] {args.server} on {args.bind}: {workers} worker(s) × {args.threads} "
+          f"threads, embedding {'shared via ' + args.embed_address if use_service else 'in-process'}",
+          flush=True)
+    web = subprocess.Popen(server_command(args), cwd=BASE_DIR, env=env)
+
+    stopping = False
+    def shutdown(signum, frame):
+        nonlocal stopping
+        stopping = True
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    try:
+        while not stopping and web.poll() is None:
+            if embed_proc is not None and embed_proc.poll() is not None:
+                print(f"[SERVE] Embedding service exited ({embed_proc.returncode}) – restarting",
+                      flush=True)
+                embed_proc = start_embed_service(args)    # workers reconnect on next call
+            time.sleep(1)
+    finally:
+        _stop(web)
+        _stop(embed_proc)
+    return web.returncode or 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,42 +7,87 @@ Assign each SOP to a K-Means cluster and persist the label in ChromaDB.
 • Assumes the collection already contains chunk-level documents with a
   'sop_id' key in their metadata (exactly what index_sops.py produces).
 • The cluster label is stored under metadata key 'cluster_k'.
+• Document vectors are streamed into one preallocated float32 matrix
+  (running sums per SOP), so 100k SOPs × 384 dims need ~150 MB.
+• Large corpora use MiniBatchKMeans; --k auto picks K by silhouette score,
+  fitting the candidate Ks in parallel.
+• Centroids are saved next to the collection (cluster_centroids.npz);
+  --assign-new labels SOPs indexed since the last fit without refitting.
+• Labels are written back in large batched updates that touch only chunks
+  whose label changed – into a copy of the live index version that is
+  validated and published like an indexer run (index_versions.py), under
+  the same lock.  An interrupted run leaves the live version untouched;
+  its fit is kept in <CHROMA_PATH>/.cluster_resume.npz (outside the
+  discarded copy), and --resume writes those labels without refitting.
+• scikit-learn, joblib and chromadb are imported when first needed, so
+  --help answers immediately.
 • Run:
       python cluster_sops_kmeans.py  --k 12  --csv report.csv
+      python cluster_sops_kmeans.py  --k auto --k-min 5 --k-max 40
+      python cluster_sops_kmeans.py  --assign-new
+      python cluster_sops_kmeans.py  --eval-routing 200 [--queries q.txt]
 """
 
 from __future__ import annotations
-import argparse, logging, csv, json, math, sys
+import argparse, logging, csv, json, math, os, sys, time, tempfile
+from array import array
 from pathlib import Path
-from collections import defaultdict
+from typing import TYPE_CHECKING
 
 import numpy as np
-from sklearn.cluster import KMeans
-import chromadb
 from tqdm import tqdm
+from cluster_router import ClusterRouter, CENTROIDS_NAME
+from index_versions import (active_version, new_version, promote, discard,
+                            collect_garbage, root_lock)
+from index_manifest import IndexManifest, MANIFEST_NAME
+from vector_store import update_clusters
+
+if TYPE_CHECKING:
+    import chromadb
 
 # ───────────────────────── CONFIGURABLE CONSTANTS ───────────────────────── #
 CHROMA_PATH     = Path("./chroma_sops")   # folder used by index_sops.py
 COLLECTION_NAME = "sop_vectors"           # same as in index_sops.py
 DEFAULT_K       = 10                      # fallback if --k not given
+EMBED_MODEL     = "all-MiniLM-L6-v2"      # same as in index_sops.py (for --queries)
 BATCH_SIZE      = 1000                # tune if collection is huge
+WRITE_BATCH     = 4000                    # chunks per collection.update during write-back
 CLUSTER_KEY     = "cluster_k"             # metadata key to write
+RESUME_NAME     = ".cluster_resume.npz"   # fit of the last unpublished run, in CHROMA_PATH
+MINIBATCH_MIN_DOCS = 20_000               # switch to MiniBatchKMeans above this
+SILHOUETTE_SAMPLE  = 10_000               # silhouette is O(n²) – score a sample
 # ─────────────────────────────────────────────────────────────────────────── #
 
 
-def parse_args() -> argparse.Namespace:
+def parse_args(argv=None) -> argparse.Namespace:
     ap = argparse.ArgumentParser(
         description="Cluster SOPs with K-Means and store labels in ChromaDB"
     )
-    ap.add_argument("-k", "--k", type=int, default=DEFAULT_K,
-                    help="number of clusters (K)")
+    ap.add_argument("-k", "--k", default=str(DEFAULT_K),
+                    help="number of clusters (K), or 'auto' to pick K by silhouette score")
+    ap.add_argument("--k-min", type=int, default=4, help="smallest K tried by --k auto")
+    ap.add_argument("--k-max", type=int, default=30, help="largest K tried by --k auto")
+    ap.add_argument("--algorithm", choices=["auto", "kmeans", "minibatch"], default="auto",
+                    help=f"'auto' = MiniBatchKMeans above {MINIBATCH_MIN_DOCS:,} SOPs")
+    ap.add_argument("--jobs", type=int, default=-1,
+                    help="parallel fits for --k auto (-1 = all cores)")
+    ap.add_argument("--assign-new", action="store_true",
+                    help="label SOPs missing from the saved centroids file without refitting")
+    ap.add_argument("--resume", action="store_true",
+                    help="write the labels of an interrupted run without refitting "
+                         "(else re-apply the live version's labels)")
+    ap.add_argument("--eval-routing", type=int, metavar="N", default=0,
+                    help="compare routed vs. full search (recall, latency) on N queries")
+    ap.add_argument("--queries", type=Path, default=None,
+                    help="with --eval-routing: text file, one query per line "
+                         "(default: N random chunk embeddings as queries)")
     ap.add_argument("--csv", type=Path, default=None,
                     help="optional path to write a CSV (sop_id,cluster)")
     ap.add_argument("--dry-run", action="store_true",
                     help="compute clusters but do NOT write back to DB")
     ap.add_argument("--verbose", "-v", action="count", default=0,
                     help="‐v or ‑vv for more logging")
-    return ap.parse_args()
+    return ap.parse_args(argv)
 
 
 def configure_logging(verbosity: int) -> None:
@@ -61,81 +106,270 @@ def configure_logging(verbosity: int) -> None:
 def fetch_all_chunks(col: chromadb.Collection, batch: int = BATCH_SIZE):
     """
     Generator that yields (ids, embeddings, metadatas) in batches.
-    Chroma >=0.4 supports limit/offset on get().
-    """
-    offset = 0
-    while True:
-        out = col.get(
-            include=["embeddings", "metadatas", "ids"],
-            limit=batch,
-            offset=offset,
-        )
-        if not out["ids"]:
-            break
+    All IDs are listed once, then fetched by ID – paging with a growing
+    offset rescans the skipped rows on every call (quadratic overall).
+    """
+    all_ids = col.get(include=[])["ids"]
+    for i in range(0, len(all_ids), batch):
+        out = col.get(ids=all_ids[i:i + batch], include=["embeddings", "metadatas"])
         yield out["ids"], out["embeddings"], out["metadatas"]
-        offset += batch
 
 
-def build_doc_vectors(col: chromadb.Collection) -> tuple[list[str], np.ndarray]:
+class ChunkLabels:
+    """
+    Every chunk seen while building the document vectors: its ID, the row of
+    its SOP and its current cluster label (-1 = none).  Lets write_back()
+    address chunks by ID and skip the ones that are already correct.
+    """
+
+    def __init__(self):
+        self.ids: list[str] = []
+        self.rows = array("i")
+        self.labels = array("i")
+
+    def add(self, chunk_id: str, row: int, label) -> None:
+        self.ids.append(chunk_id)
+        self.rows.append(row)
+        self.labels.append(int(label) if isinstance(label, (int, float)) else -1)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+
+def build_doc_vectors(col: chromadb.Collection) -> tuple[list[str], np.ndarray, ChunkLabels]:
     """
-    Return (list_of_sop_ids, 2-D ndarray with one row per SOP).
-    Each SOP vector is the mean of its chunk vectors.
+    Return (list_of_sop_ids, 2-D ndarray with one row per SOP, ChunkLabels).
+    Each SOP vector is the mean of its chunk vectors, accumulated as running
+    sums in a float32 matrix that grows by doubling.
     """
     logging.info("Fetching chunk embeddings from Chroma …")
-    vecs_by_doc: dict[str, list[np.ndarray]] = defaultdict(list)
+    rows: dict[str, int] = {}
+    sums: np.ndarray | None = None
+    counts = np.zeros(0, dtype=np.int32)
+    chunks = ChunkLabels()
 
     for ids, embs, metas in fetch_all_chunks(col):
-        for emb, meta in zip(embs, metas):
+        for chunk_id, emb, meta in zip(ids, embs, metas):
             if emb is None:                          # should not happen
                 continue
+            meta = meta or {}
             sop_id = meta.get("sop_id")
             if sop_id is None:
                 logging.warning("Chunk without sop_id metadata skipped.")
                 continue
-            vecs_by_doc[str(sop_id)].append(np.asarray(emb, dtype=np.float32))
-
-    if not vecs_by_doc:
+            row = rows.setdefault(str(sop_id), len(rows))
+            if sums is None:
+                sums = np.zeros((1024, len(emb)), dtype=np.float32)
+                counts = np.zeros(1024, dtype=np.int32)
+            elif row >= len(sums):
+                sums = np.concatenate([sums, np.zeros_like(sums)])
+                counts = np.concatenate([counts, np.zeros_like(counts)])
+            sums[row] += np.asarray(emb, dtype=np.float32)
+            counts[row] += 1
+            chunks.add(chunk_id, row, meta.get(CLUSTER_KEY))
+
+    if not rows:
         raise RuntimeError("No vectors with 'sop_id' found in collection.")
 
-    sop_ids = list(vecs_by_doc.keys())
-    doc_vecs = np.vstack([
-        np.mean(vecs, axis=0)
-        for vecs in vecs_by_doc.values()
-    ]).astype(np.float32)
+    n = len(rows)
+    doc_vecs = sums[:n]
+    doc_vecs /= counts[:n, None]
+    sop_ids = list(rows)                         # dict order == row order
 
-    logging.info("Prepared %d document-level vectors (dim=%d)",
-                 doc_vecs.shape[0], doc_vecs.shape[1])
-    return sop_ids, doc_vecs
+    logging.info("Prepared %d document-level vectors (dim=%d, %.0f MB)",
+                 doc_vecs.shape[0], doc_vecs.shape[1], sums.nbytes / 2**20)
+    return sop_ids, doc_vecs, chunks
 
 
-def cluster_vectors(X: np.ndarray, k: int) -> np.ndarray:
-    logging.info("Running K-Means with K=%d …", k)
-    model = KMeans(
+def _make_model(k: int, algorithm: str, n: int):
+    from sklearn.cluster import KMeans, MiniBatchKMeans
+    if algorithm == "minibatch" or (algorithm == "auto" and n > MINIBATCH_MIN_DOCS):
+        return MiniBatchKMeans(n_clusters=k, init="k-means++", n_init="auto",
+                               batch_size=4096, random_state=42)
+    return KMeans(
         n_clusters=k,
         init="k-means++",
         n_init="auto",        # scikit-learn ≥1.4 will default to 'auto'
         random_state=42,
         verbose=0,
     )
+
+
+def cluster_vectors(X: np.ndarray, k: int, algorithm: str = "auto"):
+    """Fit K clusters; return (labels, centroids)."""
+    model = _make_model(k, algorithm, len(X))
+    logging.info("Running %s with K=%d …", type(model).__name__, k)
     labels = model.fit_predict(X)
     logging.info("Done clustering.  label distribution: %s",
                  dict(zip(*np.unique(labels, return_counts=True))))
-    return labels
+    return labels, model.cluster_centers_.astype(np.float32)
+
+
+def _score_k(X: np.ndarray, k: int, algorithm: str, sample: np.ndarray):
+    from sklearn.metrics import silhouette_score
+    labels, centroids = cluster_vectors(X, k, algorithm)
+    if len(np.unique(labels[sample])) < 2:
+        return k, -1.0, labels, centroids
+    return k, float(silhouette_score(X[sample], labels[sample])), labels, centroids
+
+
+def choose_k(X: np.ndarray, k_min: int, k_max: int, algorithm: str = "auto",
+             jobs: int = -1):
+    """
+    Fit every K in [k_min, k_max] in parallel (joblib memory-maps X for the
+    workers instead of pickling a copy per task) and keep the one with the
+    best silhouette score on a fixed sample.  Returns (k, labels, centroids).
+    """
+    from joblib import Parallel, delayed
+    k_max = min(k_max, len(X) - 1)
+    if k_max < max(k_min, 2):
+        raise RuntimeError(f"Too few SOPs ({len(X)}) for K in [{k_min}, {k_max}].")
+    rng = np.random.default_rng(42)
+    sample = np.sort(rng.choice(len(X), size=min(len(X), SILHOUETTE_SAMPLE), replace=False))
+    ks = range(max(k_min, 2), k_max + 1)
+    logging.info("Trying K=%d…%d (%s jobs) …", ks.start, ks.stop - 1, jobs)
+    results = Parallel(n_jobs=jobs)(delayed(_score_k)(X, k, algorithm, sample) for k in ks)
+    for k, score, _, _ in results:
+        logging.info("  K=%-3d silhouette=%.4f", k, score)
+    k, score, labels, centroids = max(results, key=lambda r: r[1])
+    print(f"Best K={k} (silhouette {score:.4f})")
+    return k, labels, centroids
+
+
+def save_centroids(path: Path, centroids: np.ndarray, label_map: dict[str, int]) -> None:
+    """Persist centroids + current assignments (atomic write)."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".centroids-", suffix=".npz")
+    with os.fdopen(fd, "wb") as f:
+        np.savez(f, centroids=centroids.astype(np.float32),
+                 sop_ids=np.array(list(label_map), dtype=str),
+                 labels=np.array(list(label_map.values()), dtype=np.int32),
+                 key=CLUSTER_KEY, created=time.time())
+    os.replace(tmp, path)
+    logging.info("✓ centroids saved to %s", path)
+
+
+def load_centroids(path: Path) -> tuple[np.ndarray, dict[str, int]]:
+    with np.load(path) as data:
+        return (data["centroids"],
+                dict(zip(data["sop_ids"].tolist(), data["labels"].tolist())))
+
+
+def assign_to_centroids(X: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Nearest centroid (Euclidean, like K-Means) for every row of X."""
+    d = (X * X).sum(1)[:, None] - 2 * X @ centroids.T + (centroids * centroids).sum(1)[None, :]
+    return d.argmin(axis=1).astype(np.int32)
+
+
+def align_to_previous(labels: np.ndarray, centroids: np.ndarray,
+                      old_centroids: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    K-Means numbers clusters arbitrarily; renumber a refit so each cluster
+    keeps the id of the closest previous centroid (Hungarian matching).
+    Unchanged clusters then need no write-back at all.
+    """
+    from scipy.optimize import linear_sum_assignment
+    if old_centroids.shape[1] != centroids.shape[1] or len(old_centroids) > len(centroids):
+        return labels, centroids                 # different model / fewer clusters now
+    cost = ((centroids[:, None, :] - old_centroids[None, :, :]) ** 2).sum(-1)
+    new_idx, old_idx = linear_sum_assignment(cost)
+    mapping = np.full(len(centroids), -1)
+    mapping[new_idx] = old_idx
+    free = iter(sorted(set(range(len(centroids))) - set(old_idx.tolist())))
+    for i in np.flatnonzero(mapping < 0):        # more clusters than before
+        mapping[i] = next(free)
+    out = np.empty_like(centroids)
+    out[mapping] = centroids
+    return mapping[labels], out
 
 
 def write_back(col: chromadb.Collection,
+               sop_ids: list[str],
                label_map: dict[str, int],
-               key: str = CLUSTER_KEY) -> None:
+               chunks: ChunkLabels,
+               key: str = CLUSTER_KEY,
+               batch: int = WRITE_BATCH) -> int:
+    """
+    Set metadata[key] on every chunk whose label differs from label_map, by
+    chunk ID in batches of `batch` (update merges keys, the rest of the
+    metadata is untouched).  Already-correct chunks are skipped, so an
+    interrupted run simply continues where it stopped.  Returns #updated.
     """
-    Update every chunk whose sop_id is in label_map with metadata[key] = label.
+    row_label = np.array([label_map.get(sop_id, -1) for sop_id in sop_ids], dtype=np.int32)
+    wanted = row_label[np.frombuffer(chunks.rows, dtype=np.int32)]
+    current = np.frombuffer(chunks.labels, dtype=np.int32)
+    todo = np.flatnonzero((wanted != current) & (wanted >= 0))
+    logging.info("Persisting cluster labels: %d of %d chunks need an update …",
+                 len(todo), len(chunks))
+
+    with tqdm(total=len(todo), desc="Updating chunks", unit="chunk") as bar:
+        for i in range(0, len(todo), batch):
+            part = todo[i:i + batch]
+            col.update(ids=[chunks.ids[j] for j in part],
+                       metadatas=[{key: int(wanted[j])} for j in part])
+            bar.update(len(part))
+    logging.info("✓ wrote %d updates (%d already correct).",
+                 len(todo), len(chunks) - len(todo))
+    return len(todo)
+
+
+def eval_routing(col: chromadb.Collection, centroids: np.ndarray, chunks: ChunkLabels,
+                 n_queries: int, queries: Path | None = None, k: int = 4,
+                 nprobes: tuple[int, ...] = (1, 2, 3, 5)) -> list[dict]:
     """
-    logging.info("Persisting cluster labels back into Chroma …")
-    for sop_id, label in tqdm(label_map.items(), desc="Updating chunks"):
-        col.update(
-            where={"sop_id": sop_id},
-            set_metadata={key: int(label)}
-        )
-    logging.info("✓ wrote %d updates.", len(label_map))
+    Recall@k of routed search against full search, and query latency, for
+    several nprobe values (routing forced, no confidence fallback) plus the
+    default confidence settings.  Chunk-embedding queries are optimistic:
+    they sit inside a cluster by construction – prefer real --queries.
+    """
+    if queries is not None:
+        from gpu_embedding_function import GPUSentenceTransformerEmbeddingFunction
+        texts = [t.strip() for t in queries.read_text(encoding="utf-8").splitlines() if t.strip()]
+        texts = texts[:n_queries] if n_queries else texts
+        q_vecs = np.asarray(GPUSentenceTransformerEmbeddingFunction(EMBED_MODEL)(texts),
+                            dtype=np.float32)
+    else:
+        rng = np.random.default_rng(7)
+        pick = rng.choice(len(chunks), size=min(n_queries, len(chunks)), replace=False)
+        got = col.get(ids=[chunks.ids[i] for i in pick], include=["embeddings"])
+        q_vecs = np.asarray(got["embeddings"], dtype=np.float32)
+
+    def run(router: ClusterRouter | None):
+        found, times, fallbacks = [], [], 0
+        for q in q_vecs:
+            t0 = time.perf_counter()
+            clusters = router.route(q) if router is not None else None
+            res = None
+            if clusters is not None:
+                res = col.query(query_embeddings=[q], n_results=k, include=[],
+                                where=ClusterRouter.where(clusters))
+                if len(res["ids"][0]) < k:
+                    res = None
+            if res is None:
+                fallbacks += router is not None
+                res = col.query(query_embeddings=[q], n_results=k, include=[])
+            times.append(time.perf_counter() - t0)
+            found.append(res["ids"][0])
+        return found, np.array(times) * 1000, fallbacks
+
+    full, full_ms, _ = run(None)
+    rows = [{"mode": "full", "recall": 1.0, "mean_ms": full_ms.mean(),
+             "p95_ms": np.percentile(full_ms, 95), "fallback": 0.0}]
+    configs = [(f"nprobe={p}", ClusterRouter(centroids, p, min_sim=-1.0, min_margin=0.0))
+               for p in nprobes if p < len(centroids)]
+    configs.append(("default", ClusterRouter(centroids)))
+    for name, router in configs:
+        got, ms, fallbacks = run(router)
+        recall = np.mean([len(set(a) & set(b)) / max(len(b), 1) for a, b in zip(got, full)])
+        rows.append({"mode": name, "recall": float(recall), "mean_ms": ms.mean(),
+                     "p95_ms": np.percentile(ms, 95), "fallback": fallbacks / len(q_vecs)})
+
+    print(f"Routed vs. full search – {len(q_vecs)} queries, top-{k}, {len(centroids)} clusters")
+    print(f"{'mode':<12}{'recall':>8}{'mean ms':>10}{'p95 ms':>10}{'fallback':>10}")
+    for r in rows:
+        print(f"{r['mode']:<12}{r['recall']:>8.3f}{r['mean_ms']:>10.2f}"
+              f"{r['p95_ms']:>10.2f}{r['fallback']:>10.1%}")
+    return rows
 
 
 def write_csv(path: Path, label_map: dict[str, int]) -> None:
@@ -147,23 +381,89 @@ def write_csv(path: Path, label_map: dict[str, int]) -> None:
     logging.info("✓ CSV written.")
 
 
-def main() -> None:
-    args = parse_args()
+def main(argv=None) -> None:
+    args = parse_args(argv)
     configure_logging(args.verbose)
+    if args.eval_routing or args.dry_run:        # read-only: use the live version
+        cluster(args, active_version(CHROMA_PATH))
+        return
+
+    # never write into the live version: label a copy, publish it when done
+    with root_lock(CHROMA_PATH):
+        live = active_version(CHROMA_PATH)
+        collect_garbage(CHROMA_PATH)             # leftovers of interrupted runs
+        version = new_version(CHROMA_PATH, copy_from=live)
+        print(f"[INDEX] Clustering into {version.name} (copy of {live.name})")
+        resume_path = CHROMA_PATH / RESUME_NAME
+        try:
+            collection = cluster(args, version, resume_path)
+        except BaseException:
+            discard(version)                     # the fit survives in resume_path
+            raise
+        manifest_path = version / MANIFEST_NAME
+        promote(CHROMA_PATH, version, collection,
+                IndexManifest(manifest_path, {}) if manifest_path.exists() else None,
+                by_text=False)                   # no embedding model loaded here
+        resume_path.unlink(missing_ok=True)
+
+
+def cluster(args: argparse.Namespace, index_dir: Path, resume_path: Path | None = None):
+    """
+    Cluster (or evaluate routing on) the index version in `index_dir`; returns
+    its collection.  A new fit is saved to `resume_path` before any write, so
+    --resume can finish it if the run is interrupted.
+    """
+    import chromadb
 
-    client = chromadb.PersistentClient(path=str(CHROMA_PATH))
+    centroids_path = index_dir / CENTROIDS_NAME           # read by rag.py
+    client = chromadb.PersistentClient(path=str(index_dir))
     collection = client.get_collection(COLLECTION_NAME)
 
-    sop_ids, doc_vecs = build_doc_vectors(collection)
-    labels = cluster_vectors(doc_vecs, k=args.k)
-
-    label_map = dict(zip(sop_ids, labels))
+    sop_ids, doc_vecs, chunks = build_doc_vectors(collection)
+
+    if args.eval_routing:
+        if not centroids_path.exists():
+            sys.exit(f"No saved centroids at {centroids_path} – run a full clustering first.")
+        eval_routing(collection, load_centroids(centroids_path)[0], chunks,
+                     args.eval_routing, args.queries)
+        return collection
+
+    if args.assign_new or args.resume:
+        saved = centroids_path
+        if args.resume and resume_path is not None and resume_path.exists():
+            saved = resume_path                           # the interrupted run's fit
+        elif args.resume:
+            print("No interrupted run to resume – re-applying the live version's labels.")
+        if not saved.exists():
+            sys.exit(f"No saved centroids at {saved} – run a full clustering first.")
+        centroids, label_map = load_centroids(saved)
+        new_rows = [i for i, sop_id in enumerate(sop_ids) if sop_id not in label_map]
+        new_labels = assign_to_centroids(doc_vecs[new_rows], centroids) if new_rows else []
+        label_map = {sop_id: label_map[sop_id] for sop_id in sop_ids if sop_id in label_map}
+        label_map.update((sop_ids[i], int(lbl)) for i, lbl in zip(new_rows, new_labels))
+        print(f"Assigned {len(new_rows)} new SOP(s) to {len(centroids)} existing clusters.")
+    else:
+        if args.k == "auto":
+            _, labels, centroids = choose_k(doc_vecs, args.k_min, args.k_max,
+                                            args.algorithm, args.jobs)
+        else:
+            labels, centroids = cluster_vectors(doc_vecs, int(args.k), args.algorithm)
+        if centroids_path.exists():
+            labels, centroids = align_to_previous(labels, centroids,
+                                                  load_centroids(centroids_path)[0])
+        label_map = {sop_id: int(lbl) for sop_id, lbl in zip(sop_ids, labels)}
+        if resume_path is not None and not args.dry_run:
+            save_centroids(resume_path, centroids, label_map)
+    labels = list(label_map.values())
 
     if args.csv:
         write_csv(args.csv, label_map)
 
     if not args.dry_run:
-        write_back(collection, label_map)
+        save_centroids(centroids_path, centroids, label_map)
+        write_back(collection, sop_ids, label_map, chunks)
+        if update_clusters(index_dir, COLLECTION_NAME, label_map):
+            print("Updated cluster labels in the matrix export.")
     else:
         logging.warning("--dry-run supplied: no changes written to DB.")
 
@@ -173,6 +473,7 @@ def main() -> None:
         summary[int(lbl)] += 1
     print(json.dumps(summary, indent=2))
     print("Finished.")
+    return collection
 
 
 if __name__ == "__main__":
@@ -0,0 +1,88 @@
+"""
+stage_timing.py  –  Per-stage busy time / throughput accounting
+------------------------------------------------------------------
+Small helper used by the indexers to report where a run spends its time:
+
+    stats = StageStats()
+    with stats.time("embed", items=len(batch)):
+        ...
+    stats.add("extract", seconds=worker_secs, items=1)   # time measured elsewhere
+    print(stats.report(wall_seconds))
+    stats.save(persist_dir / STATS_NAME, wall_seconds)   # read by /metrics
+
+`timed()` does the same for a plain {stage: seconds} dict (rag.py's
+per-request timings).
+"""
+
+from __future__ import annotations
+import os, json, time, tempfile
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator
+
+STATS_NAME = "index_stats.json"
+
+
+@contextmanager
+def timed(timings: Dict[str, float], stage: str) -> Iterator[None]:
+    """Add the block's duration to timings[stage] (seconds)."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - t0
+
+
+class StageStats:
+    def __init__(self, units: Dict[str, str] | None = None):
+        self.seconds: Dict[str, float] = defaultdict(float)
+        self.items:   Dict[str, int]   = defaultdict(int)
+        self.units:   Dict[str, str]   = dict(units or {})
+
+    def add(self, stage: str, seconds: float = 0.0, items: int = 0) -> None:
+        self.seconds[stage] += seconds
+        self.items[stage]   += items
+
+    @contextmanager
+    def time(self, stage: str, items: int = 0) -> Iterator[None]:
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - t0, items)
+
+    def report(self, wall: float) -> str:
+        """
+        One line per stage: items, busy seconds and items per busy-second.
+        Stages running in a process pool accumulate busy time across workers,
+        so their rate is per worker; compare against wall time for the total.
+        """
+        lines = [f"[STATS] wall time {wall:.1f}s"]
+        for stage in self.seconds:
+            secs, n = self.seconds[stage], self.items[stage]
+            unit = self.units.get(stage, "items")
+            rate = n / secs if secs > 0 else float("inf")
+            lines.append(f"[STATS] {stage:<8} {n:>9} {unit:<7} {secs:>9.1f}s busy "
+                         f"{rate:>10.1f} {unit}/s")
+        return "\n".join(lines)
+
+    def as_dict(self, wall: float) -> Dict:
+        return {"wall": wall, "finished": time.time(),
+                "stages": {stage: {"seconds": self.seconds[stage], "items": self.items[stage],
+                                   "unit": self.units.get(stage, "items")}
+                           for stage in self.seconds}}
+
+    def save(self, path: Path, wall: float) -> None:
+        """
+        Write as_dict() atomically as JSON (the app exports it on /metrics).
+        A run that did no work leaves the previous run's file in place.
+        """
+        if not self.seconds:
+            return
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".stats-")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(self.as_dict(wall), f, indent=2)
+        os.replace(tmp, path)
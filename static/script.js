@@ -34,15 +34,17 @@ class SOPAssistant {
         this.showLoading(domain);
 
         try {
-            const response = await fetch('/search', {
+            const response = await fetch('/search/stream', {
                 method : 'POST',
                 headers: { 'Content-Type':'application/json' },
                 body   : JSON.stringify({ query, domain })
             });
-            const data = await response.json();
-
-            if (data.error) { this.showError(data.error); return; }
-            this.displayResults(data);
+            if (!response.ok || !response.body) {
+                const data = await response.json().catch(() => ({}));
+                if (data.error) { this.showError(data.error); return; }
+                return this.performPlainSearch(query, domain);
+            }
+            await this.consumeStream(response.body);
 
         } catch (error) {
             console.error('Search error:', error);
@@ -50,14 +52,65 @@ class SOPAssistant {
         }
     }
 
+    /* Non-streaming fallback (older browsers / proxies that buffer) */
+    async performPlainSearch(query, domain) {
+        const response = await fetch('/search', {
+            method : 'POST',
+            headers: { 'Content-Type':'application/json' },
+            body   : JSON.stringify({ query, domain })
+        });
+        const data = await response.json();
+
+        if (data.error) { this.showError(data.error); return; }
+        this.displayResults(data);
+    }
+
+    /* Reads NDJSON events: sources → token* → done */
+    async consumeStream(body) {
+        const reader  = body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '', answer = '', pending = false;
+
+        const render = () => {
+            pending = false;
+            this.renderAnswer(answer);
+        };
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream:true });
+
+            let nl;
+            while ((nl = buffer.indexOf('\n')) !== -1) {
+                const line = buffer.slice(0, nl).trim();
+                buffer = buffer.slice(nl + 1);
+                if (!line) continue;
+                const event = JSON.parse(line);
+
+                if (event.type === 'sources') {
+                    this.displaySources(event.sources);
+                } else if (event.type === 'token') {
+                    answer += event.text;
+                    if (!pending) { pending = true; requestAnimationFrame(render); }
+                } else if (event.type === 'error') {
+                    this.showError(event.error);
+                    return;
+                }
+            }
+        }
+        this.renderAnswer(answer);
+        this.newSearchSection.style.display = 'block';
+    }
+
     /* -------- UI HELPERS -------- */
     showLoading(domain) {
         this.resultsSection.style.display = 'block';
         this.loadingState.style.display   = 'block';
         this.loadingState.querySelector('p').innerText =
-            domain === 'support'
-                ? 'Searching through support articles...'
-                : 'Searching through SOPs...';
+            domain === 'support' ? 'Searching through support articles...'
+          : domain === 'all'     ? 'Searching through SOPs and support articles...'
+          :                        'Searching through SOPs...';
 
         this.answerDisplay.style.display    = 'none';
         this.sourcesDisplay.style.display   = 'none';
@@ -66,23 +119,26 @@ class SOPAssistant {
     }
 
     displayResults(data) {
+        this.renderAnswer(data.answer || '');
+        this.displaySources(data.sources);
+        this.newSearchSection.style.display = 'block';
+    }
+
+    renderAnswer(answerText) {
         this.loadingState.style.display = 'none';
 
-        /* ----- ANSWER -------- */
-        let answerText = data.answer || '';
         const idx = answerText.toLowerCase().indexOf('answer:');
         if (idx !== -1) answerText = answerText.slice(idx + 7);
 
         this.answerDisplay.style.display = 'block';
         document.getElementById('answerContent').innerHTML = this.formatAnswer(answerText);
+    }
 
-        /* ----- SOURCES -------- */
-        if (data.sources && data.sources.length) {
+    displaySources(sources) {
+        if (sources && sources.length) {
             this.sourcesDisplay.style.display = 'block';
-            document.getElementById('sourcesContent').innerHTML = this.formatSources(data.sources);
+            document.getElementById('sourcesContent').innerHTML = this.formatSources(sources);
         }
-
-        this.newSearchSection.style.display = 'block';
     }
 
     formatAnswer(answer) {
@@ -96,7 +152,7 @@ class SOPAssistant {
                     <div>
                         <div class="source-title">${source.title}</div>
                         <div class="source-meta">
-                            SOP ID: ${source.id || 'N/A'} | Department: ${source.department || 'N/A'}
+                            ${source.domain === 'support' ? 'Article' : 'SOP'} ID: ${source.id || 'N/A'} | Department: ${source.department || 'N/A'}
                         </div>
                     </div>
                     <div class="relevance-badge">${source.relevance}% relevant</div>
@@ -0,0 +1,125 @@
+"""
+stub_llm.py  –  Minimal stand-in for Ollama's /api/generate
+------------------------------------------------------------------
+For benchmarks and offline development: answers every prompt with
+`tokens` canned fragments after `latency` seconds (time to first token),
+one fragment every `token_latency` seconds.  Speaks both the streaming
+(NDJSON, chunked) and the non-streaming form of the API.
+
+    python stub_llm.py --port 11434 --latency 0.3 --tokens 40 --token-latency 0.02
+
+or, from Python:  server, url = start_stub_server(latency=0.1)
+"""
+
+from __future__ import annotations
+import sys, json, time, argparse, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Tuple
+
+WORDS = ("Open", " the", " patient", " ledger", ",", " select", " the", " visit",
+         " and", " follow", " the", " steps", " in", " the", " SOP", ".")
+
+
+class StubOllamaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, addr, latency: float = 0.2, tokens: int = 32,
+                 token_latency: float = 0.01):
+        super().__init__(addr, _Handler)
+        self.latency = latency
+        self.tokens = tokens
+        self.token_latency = token_latency
+        self.requests = 0
+        self.active = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)     # idle keep-alive closed: fine
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"requests": self.requests, "active": self.active, "peak": self.peak}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: StubOllamaServer
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        srv = self.server
+        with srv._lock:
+            srv.requests += 1
+            srv.active += 1
+            srv.peak = max(srv.peak, srv.active)
+        try:
+            time.sleep(srv.latency)
+            parts = [WORDS[i % len(WORDS)] for i in range(srv.tokens)]
+            if payload.get("stream", True):
+                self._stream(parts, payload.get("model", "stub"))
+            else:
+                self._json({"model": payload.get("model", "stub"),
+                            "response": "".join(parts), "done": True})
+        except (BrokenPipeError, ConnectionResetError):
+            pass                                    # client went away
+        finally:
+            with srv._lock:
+                srv.active -= 1
+
+    def do_GET(self):
+        if self.path.startswith("/api/tags"):
+            self._json({"models": [{"name": "stub"}]})
+        else:
+            self._json(self.server.stats())
+
+    def _stream(self, parts, model):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def write(obj):
+            data = (json.dumps(obj) + "\n").encode()
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+
+        for i, part in enumerate(parts):
+            if i:
+                time.sleep(self.server.token_latency)
+            write({"model": model, "response": part, "done": False})
+        write({"model": model, "response": "", "done": True})
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _json(self, obj):
+        data = json.dumps(obj).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_stub_server(port: int = 0, latency: float = 0.2, tokens: int = 32,
+                      token_latency: float = 0.01) -> Tuple[StubOllamaServer, str]:
+    """Serve in a daemon thread; returns (server, generate_url).  port=0 → any free port."""
+    server = StubOllamaServer(("127.0.0.1", port), latency, tokens, token_latency)
+    threading.Thread(target=server.serve_forever, daemon=True, name="stub-llm").start()
+    return server, f"http://127.0.0.1:{server.server_port}/api/generate"
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Stub Ollama server for benchmarks")
+    ap.add_argument("--port", type=int, default=11434)
+    ap.add_argument("--latency", type=float, default=0.2, help="seconds to first token")
+    ap.add_argument("--tokens", type=int, default=32, help="fragments per answer")
+    ap.add_argument("--token-latency", type=float, default=0.01, help="seconds between fragments")
+    args = ap.parse_args()
+    srv = StubOllamaServer(("127.0.0.1", args.port), args.latency, args.tokens, args.token_latency)
+    print(f"[STUB] Ollama stub on http://127.0.0.1:{args.port}/api/generate")
+    srv.serve_forever()
@@ -0,0 +1,363 @@
+"""
+vector_store.py  –  Memory-mapped matrix backend (exact NumPy top-k search)
+------------------------------------------------------------------
+For tens to hundreds of thousands of chunks a plain scan over one matrix is
+cheap, and it avoids the Chroma client's per-query overhead and its private
+in-memory HNSW copy in every server worker.  The indexers export the
+collection into the index version next to the Chroma files:
+
+    versions/<name>/matrix_<collection>/
+        meta.json          dtype, dim, count, distance space
+        vectors.npy        N × dim, unit-length, int8 (+ scales.npy) or float16
+        vectors_f32.npy    N × dim float32 – rescoring of int8 candidates only
+        ids.npy            chunk IDs (fixed-width bytes) + id_order.npy for lookups
+        clusters.npy       cluster_k per row (routed search)
+        records.jsonl      [document, metadata] per row + offsets.npy
+
+Every file is opened with mmap, so all workers on a host share one copy in
+the page cache and a worker's own memory stays small.  MatrixStore answers
+the subset of the Chroma collection API rag.py uses (query / get / count),
+so retrieval, hybrid fusion and hot swaps work unchanged.
+
+int8 rows are scaled per row (max |x| → 127); the int8 scan picks
+RESCORE_FACTOR × n candidates and their float32 rows give the final
+distances, so results match an exact float32 search.  float16 is scored
+directly (no rescoring file) – half the size of float32 but, on CPUs
+where NumPy converts float16 without SIMD, several times slower to scan
+than int8.
+"""
+
+from __future__ import annotations
+import os, json, mmap, shutil, tempfile, threading
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from cluster_router import CLUSTER_KEY, UNASSIGNED
+
+FORMAT_VERSION = 1
+DTYPES         = ("int8", "float16")
+SCAN_BLOCK     = 512                       # rows widened to float32 per step (L2-sized)
+RESCORE_FACTOR = int(os.getenv("MATRIX_RESCORE_FACTOR", 4))   # int8 candidates per result
+_DEFAULT_INCLUDE = ["metadatas", "documents", "distances"]   # as collection.query
+
+
+def matrix_path(persist_dir: str | Path, collection: str) -> Path:
+    return Path(persist_dir) / f"matrix_{collection}"
+
+
+def matrix_dtype(persist_dir: str | Path, collection: str) -> str | None:
+    """dtype of the matrix exported under `persist_dir` (None if there is none)."""
+    try:
+        info = json.loads((matrix_path(persist_dir, collection) / "meta.json")
+                          .read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    return info.get("dtype")
+
+
+def _normalise(vectors) -> np.ndarray:
+    v = np.asarray(vectors, dtype=np.float32)
+    return v / np.maximum(np.linalg.norm(v, axis=-1, keepdims=True), 1e-12)
+
+
+# ───────────────────────────── export ────────────────────────────── #
+def export_matrix(collection, dest: str | Path, dtype: str = "int8",
+                  batch: int = 1000) -> int:
+    """
+    Write every chunk of `collection` (embeddings, documents, metadata) to
+    the matrix directory `dest`, replacing it.  Built in a temp directory
+    next to it and renamed into place.  Returns the number of rows.
+    """
+    if dtype not in DTYPES:
+        raise ValueError(f"matrix dtype must be one of {DTYPES}, not {dtype!r}")
+    dest = Path(dest)
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    tmp = Path(tempfile.mkdtemp(dir=dest.parent, prefix=".matrix-"))
+    try:
+        total = collection.count()
+        ids: List[str] = []
+        offsets = [0]
+        clusters = np.full(total, UNASSIGNED, dtype=np.int32)
+        vectors = full = scales = None
+        with open(tmp / "records.jsonl", "wb") as records:
+            for offset in range(0, total, batch):
+                got = collection.get(include=["embeddings", "documents", "metadatas"],
+                                     limit=batch, offset=offset)
+                if not len(got["ids"]):
+                    break
+                emb = _normalise(got["embeddings"])
+                if vectors is None:            # dim known from the first batch
+                    shape = (total, emb.shape[1])
+                    full = np.lib.format.open_memmap(tmp / "vectors_f32.npy", "w+",
+                                                     np.float32, shape)
+                    vectors = np.lib.format.open_memmap(tmp / "vectors.npy", "w+",
+                                                        np.dtype(dtype), shape)
+                    if dtype == "int8":
+                        scales = np.lib.format.open_memmap(tmp / "scales.npy", "w+",
+                                                           np.float32, (total,))
+                rows = slice(len(ids), len(ids) + len(emb))
+                full[rows] = emb
+                if dtype == "int8":
+                    scale = np.maximum(np.abs(emb).max(axis=1), 1e-12) / 127
+                    vectors[rows] = np.rint(emb / scale[:, None]).astype(np.int8)
+                    scales[rows] = scale
+                else:
+                    vectors[rows] = emb.astype(np.float16)
+                for i, (cid, doc, meta) in enumerate(zip(got["ids"], got["documents"],
+                                                         got["metadatas"])):
+                    meta = meta or {}
+                    clusters[rows.start + i] = meta.get(CLUSTER_KEY, UNASSIGNED)
+                    line = json.dumps([doc, meta], ensure_ascii=False,
+                                      separators=(",", ":")).encode("utf-8") + b"\n"
+                    records.write(line)
+                    offsets.append(offsets[-1] + len(line))
+                ids.extend(got["ids"])
+        if len(ids) != total:
+            raise RuntimeError(f"collection changed during export ({len(ids)} of {total} rows)")
+        if vectors is None:                    # empty collection
+            np.save(tmp / "vectors.npy", np.zeros((0, 0), dtype=dtype))
+            if dtype == "int8":
+                np.save(tmp / "scales.npy", np.zeros(0, dtype=np.float32))
+        else:
+            for arr in (vectors, full, scales):
+                if arr is not None:
+                    arr.flush()
+        dim = 0 if vectors is None else vectors.shape[1]
+        del vectors, full, scales              # close the memmaps before renaming
+        if dtype == "float16":                 # scored directly, no rescoring copy
+            (tmp / "vectors_f32.npy").unlink(missing_ok=True)
+        elif not total:
+            np.save(tmp / "vectors_f32.npy", np.zeros((0, 0), dtype=np.float32))
+        id_arr = np.array([i.encode("utf-8") for i in ids], dtype=bytes) \
+            if ids else np.zeros(0, dtype="S1")
+        np.save(tmp / "ids.npy", id_arr)
+        np.save(tmp / "id_order.npy", np.argsort(id_arr, kind="stable"))
+        np.save(tmp / "clusters.npy", clusters)
+        np.save(tmp / "offsets.npy", np.asarray(offsets, dtype=np.int64))
+        (tmp / "meta.json").write_text(json.dumps({
+            "version": FORMAT_VERSION, "dtype": dtype, "dim": dim, "count": total,
+            "space": "cosine"}), encoding="utf-8")
+        if dest.exists():
+            shutil.rmtree(dest)
+        os.replace(tmp, dest)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    return total
+
+def sync_matrix(collection, version: str | Path, name: str, dtype: str | None) -> None:
+    """
+    Indexer hook: export the collection if `dtype` is set, otherwise drop a
+    matrix copied over from the previous version (it would be stale).
+    """
+    path = matrix_path(version, name)
+    if not dtype:
+        if path.exists():
+            shutil.rmtree(path)
+            print(f"[INDEX] Matrix export off – removed {path.name}")
+        return
+    count = export_matrix(collection, path, dtype)
+    size = sum(p.stat().st_size for p in path.iterdir()) / 2**20
+    print(f"[INDEX] Exported {count} vectors to {path.name} ({dtype}, {size:.1f} MiB)")
+
+def update_clusters(persist_dir: str | Path, name: str, labels: Dict[str, int],
+                    doc_key: str = "sop_id") -> bool:
+    """
+    Re-label rows after sop_clustering.py (labels: doc id → cluster) without
+    a re-export.  The column is replaced atomically; open stores pick it up.
+    Returns False if there is no matrix.
+    """
+    path = matrix_path(persist_dir, name)
+    if not (path / "meta.json").exists():
+        return False
+    clusters = np.load(path / "clusters.npy")
+    with open(path / "records.jsonl", "rb") as f:
+        for row, line in enumerate(f):
+            doc_id = str(json.loads(line)[1].get(doc_key))
+            if doc_id in labels:
+                clusters[row] = labels[doc_id]
+    fd, tmp = tempfile.mkstemp(dir=path, prefix=".clusters-", suffix=".npy")
+    with os.fdopen(fd, "wb") as f:
+        np.save(f, clusters)
+    os.replace(tmp, path / "clusters.npy")
+    return True
+
+
+# ───────────────────────────── search ────────────────────────────── #
+class MatrixStore:
+    """Read-only, Chroma-shaped view of an exported matrix directory."""
+
+    def __init__(self, path: str | Path, embedding_function=None):
+        self.path = Path(path)
+        info = json.loads((self.path / "meta.json").read_text(encoding="utf-8"))
+        if info.get("version") != FORMAT_VERSION:
+            raise ValueError(f"unsupported matrix format {info.get('version')}")
+        self.name = self.path.name.removeprefix("matrix_")
+        self.dtype = info["dtype"]
+        self.dim = info["dim"]
+        self.metadata = {"hnsw:space": info["space"]}   # read by rag._space
+        self._embedding_function = embedding_function
+        self._count = info["count"]
+        self._vectors = self._load("vectors.npy")
+        self._scales = self._load("scales.npy") if self.dtype == "int8" else None
+        self._full = self._load("vectors_f32.npy") if self.dtype == "int8" else None
+        self._ids = self._load("ids.npy")
+        self._id_order = self._load("id_order.npy")
+        self._sorted_ids = self._ids[self._id_order]   # binary-search keys for get(ids=…)
+        self._offsets = self._load("offsets.npy")
+        with open(self.path / "records.jsonl", "rb") as f:
+            self._records = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) \
+                if self._count else None
+        self._clusters: tuple[int, np.ndarray] | None = None
+        self._local = threading.local()         # per-thread float32 scan buffer
+        if len(self._ids) != self._count or len(self._vectors) != self._count:
+            raise ValueError(f"{self.path.name}: files hold a different number of rows")
+
+    @classmethod
+    def open(cls, persist_dir: str | Path, name: str,
+             embedding_function=None) -> Optional["MatrixStore"]:
+        """The store exported for `name` under `persist_dir`, or None if there is none."""
+        path = matrix_path(persist_dir, name)
+        if not (path / "meta.json").exists():
+            return None
+        return cls(path, embedding_function)
+
+    def _load(self, name: str) -> np.ndarray:
+        return np.load(self.path / name, mmap_mode="r" if self._count else None)
+
+    def count(self) -> int:
+        return self._count
+
+    def close(self) -> None:
+        """Release the mappings (needed before the files can be deleted on Windows)."""
+        if self._records is not None:
+            self._records.close()
+            self._records = None
+        self._vectors = self._full = self._scales = None
+
+    # ───────────── Chroma-compatible API ─────────────
+    def query(self, query_embeddings=None, n_results: int = 10, where: dict | None = None,
+              include: Sequence[str] = _DEFAULT_INCLUDE, query_texts=None) -> dict:
+        if query_embeddings is None:
+            query_embeddings = self._embedding_function(list(query_texts))
+        queries = _normalise(np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32)))
+        rows = self._rows_where(where)
+        out: Dict[str, list] = {"ids": [], "distances": [], "documents": [], "metadatas": []}
+        for sims in self._top_k(queries, n_results, rows):
+            picked = [r for r, _ in sims]
+            out["ids"].append(self._id_list(picked))
+            out["distances"].append([1.0 - s for _, s in sims])
+            if "documents" in include or "metadatas" in include:
+                recs = [self._record(r) for r in picked]
+                out["documents"].append([d for d, _ in recs])
+                out["metadatas"].append([m for _, m in recs])
+        return {k: v for k, v in out.items() if k == "ids" or k in include}
+
+    def get(self, ids: Sequence[str] | None = None, limit: int | None = None,
+            offset: int = 0, include: Sequence[str] = ("metadatas", "documents")) -> dict:
+        if ids is not None:
+            rows = self._rows_for(ids)
+        else:
+            end = self._count if limit is None else min(self._count, offset + limit)
+            rows = list(range(offset, end))
+        out: Dict[str, list] = {"ids": self._id_list(rows)}
+        if "documents" in include or "metadatas" in include:
+            recs = [self._record(r) for r in rows]
+            out["documents"] = [d for d, _ in recs]
+            out["metadatas"] = [m for _, m in recs]
+        if "embeddings" in include:
+            out["embeddings"] = self._dense(np.asarray(rows, dtype=np.int64))
+        return out
+
+    # ───────────── internals ─────────────
+    def _id_list(self, rows: Sequence[int]) -> List[str]:
+        return [self._ids[r].decode("utf-8") for r in rows]
+
+    def _record(self, row: int) -> tuple[str, dict]:
+        start, end = int(self._offsets[row]), int(self._offsets[row + 1])
+        doc, meta = json.loads(self._records[start:end])
+        return doc, meta
+
+    def _rows_for(self, ids: Sequence[str]) -> List[int]:
+        """Rows of the given IDs (binary search; unknown IDs are skipped like Chroma)."""
+        if not self._count:
+            return []
+        keys = np.array([i.encode("utf-8") for i in ids], dtype=self._ids.dtype)
+        pos = np.minimum(np.searchsorted(self._sorted_ids, keys), self._count - 1)
+        rows = self._id_order[pos]
+        return [int(r) for r, k in zip(rows, keys) if self._ids[r] == k]
+
+    def _rows_where(self, where: dict | None) -> np.ndarray | None:
+        """Row indices passing a cluster filter (the only kind rag.py sends)."""
+        if not where:
+            return None
+        if set(where) != {CLUSTER_KEY}:
+            raise ValueError(f"MatrixStore only filters on '{CLUSTER_KEY}', got {where}")
+        cond = where[CLUSTER_KEY]
+        wanted = cond["$in"] if isinstance(cond, dict) else [cond]
+        return np.flatnonzero(np.isin(self._cluster_column(), wanted))
+
+    def _cluster_column(self) -> np.ndarray:
+        """clusters.npy, reloaded when sop_clustering.py rewrites it."""
+        path = self.path / "clusters.npy"
+        mtime = path.stat().st_mtime_ns
+        if self._clusters is None or self._clusters[0] != mtime:
+            self._clusters = (mtime, np.load(path))
+        return self._clusters[1]
+
+    def _dense(self, rows: np.ndarray) -> np.ndarray:
+        """float32 rows in the order given: the rescoring copy for int8, the
+        widened matrix for float16 (rows are read in sorted order for locality)."""
+        order = np.argsort(rows)
+        source = self._full if self._full is not None else self._vectors
+        out = np.empty((len(rows), self.dim), dtype=np.float32)
+        out[order] = source[rows[order]]
+        return out
+
+    def _scan(self, queries: np.ndarray, rows: np.ndarray | None) -> np.ndarray:
+        """
+        Scores (len(rows) or N) × Q.  Blocks are widened into a reused
+        float32 buffer – fresh multi-MB arrays per block cost more in page
+        faults than the arithmetic.
+        """
+        n = self._count if rows is None else len(rows)
+        scores = np.empty((n, len(queries)), dtype=np.float32)
+        qt = np.ascontiguousarray(queries.T)
+        buf = getattr(self._local, "buf", None)
+        if buf is None:
+            buf = self._local.buf = np.empty((SCAN_BLOCK, self.dim), dtype=np.float32)
+        for start in range(0, n, SCAN_BLOCK):
+            stop = min(n, start + SCAN_BLOCK)
+            block = self._vectors[start:stop] if rows is None \
+                else self._vectors[rows[start:stop]]
+            wide = buf[:stop - start]
+            np.copyto(wide, block, casting="unsafe")
+            np.matmul(wide, qt, out=scores[start:stop])
+        if self._scales is not None:
+            scale = self._scales if rows is None else self._scales[rows]
+            scores *= np.asarray(scale)[:, None]
+        return scores
+
+    def _top_k(self, queries: np.ndarray, k: int,
+               rows: np.ndarray | None) -> List[List[tuple[int, float]]]:
+        """Per query: [(row, cosine similarity)] best first."""
+        n = self._count if rows is None else len(rows)
+        k = min(k, n)
+        if k <= 0:
+            return [[] for _ in queries]
+        scores = self._scan(queries, rows)
+        pool = min(n, k * RESCORE_FACTOR) if self._full is not None else k
+        results = []
+        for qi, q in enumerate(queries):
+            col = scores[:, qi]
+            cand = np.argpartition(-col, pool - 1)[:pool] if pool < n else np.arange(n)
+            picked = cand if rows is None else rows[cand]
+            if self._full is not None:         # exact float32 scores for the candidates
+                sims = self._dense(picked) @ q
+            else:
+                sims = col[cand]
+            best = np.argsort(-sims, kind="stable")[:k]
+            results.append([(int(picked[i]), float(sims[i])) for i in best])
+        return results